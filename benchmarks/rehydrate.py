@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Time the startup schedule rehydration against a SQLite database
+
+Fills a temporary database with synthetic users, then runs the bot's
+rehydrate_schedule() exactly as main() does at startup: all users and their
+service flags are loaded into the registry and the delivery slots are
+registered on a real job queue.
+
+    python benchmarks/rehydrate.py                    # 1k, 10k and 100k users
+    python benchmarks/rehydrate.py --users 100000 --max-seconds 1
+
+Exits with status 1 if a run is slower than --max-seconds.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from simulate_day import ROOT, RESULTS_DIR, git_commit, synthetic_users
+
+
+async def rehydrate(args):
+    import bot
+    from telegram.ext import Application
+
+    logging.getLogger().setLevel(logging.WARNING)
+    users, tracking = synthetic_users(args.users, args.seed)
+    bot.storage.open()
+    bot.storage.save_users(users)
+    bot.storage.batch_update_quran_tracking(list(tracking.values()))
+
+    application = Application.builder().token("123456:stub").build()
+    start = time.perf_counter()
+    await bot.rehydrate_schedule(application.job_queue)
+    wall_seconds = time.perf_counter() - start
+    bot.storage.close()
+
+    return {
+        "users": len(bot.user_registry),
+        "wall_seconds": round(wall_seconds, 4),
+        "jobs": len(application.job_queue.scheduler.get_jobs()),
+        "subscribers": {service: len(bot.user_registry.subscribers(service)) for service in bot.SERVICE_COLUMNS},
+    }
+
+
+def run_single(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ.update(STORAGE_BACKEND="sqlite", STORAGE_DB_FILE=os.path.join(workdir, "bot.db"),
+                          SHEETS_MIRROR_INTERVAL="0")
+        sys.path.insert(0, ROOT)
+        json.dump(asyncio.run(rehydrate(args)), sys.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the startup schedule rehydration")
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-seconds", type=float, default=1.0, help="Fail if a run takes longer")
+    parser.add_argument("--output", help="Result file, defaults to benchmarks/results/rehydrate-<date>-<commit>.json")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        args.users = args.users[0]
+        run_single(args)
+        return
+
+    runs = []
+    for users in args.users:
+        command = [sys.executable, os.path.abspath(__file__), "--single", "--users", str(users), "--seed", str(args.seed)]
+        output = subprocess.run(command, capture_output=True, text=True)
+        if output.returncode != 0:
+            sys.stderr.write(output.stderr)
+            sys.exit(f"Rehydration with {users} users failed")
+        result = json.loads(output.stdout)
+        runs.append(result)
+        print(f"{result['users']:>7} users: {result['wall_seconds'] * 1000:>8.1f}ms, {result['jobs']} jobs")
+
+    commit = git_commit()
+    report = {
+        "benchmark": "rehydrate",
+        "commit": commit,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "runs": runs,
+    }
+    path = args.output or os.path.join(RESULTS_DIR, f"rehydrate-{datetime.now():%Y%m%d-%H%M%S}-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    print(f"Results written to {path}")
+
+    slow = [run for run in runs if run["wall_seconds"] > args.max_seconds]
+    if slow:
+        sys.exit(f"Rehydration slower than {args.max_seconds}s for {', '.join(str(run['users']) for run in slow)} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Replay Telegram updates against the bot's Application with the network stubbed
+
+Updates come from a recording made with UPDATE_RECORD_FILE (anonymized JSONL,
+see update_recorder.py) or from a synthetic scenario, and are put on the
+Application's update queue at their recorded pace, sped up by --speed, or at
+a fixed --rate. Bot API calls go through a stub request object with a
+configurable latency, so the real handlers, conversation handler and
+persistence run exactly as in production.
+
+    python benchmarks/replay_updates.py --scenario noon-burst --users 2000
+    python benchmarks/replay_updates.py --updates updates.jsonl --speed 10
+
+Reports per-update end-to-end latency (from enqueueing to the last handler
+returning) and throughput for each kind of update, and writes them as JSON to
+benchmarks/results/.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from simulate_day import ROOT, RESULTS_DIR, git_commit, percentile
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Azkar", "username": "azkar_stub_bot"}
+
+SCENARIOS = ("noon-burst", "onboarding", "mixed")
+
+
+def update_kind(data):
+    """Name of the handler an update is meant for, used to group the results"""
+    import bot
+    if "callback_query" in data:
+        return {
+            bot.CONFIRM: "confirm_services",
+            bot.CONFIRM_READ: "confirm_read",
+            bot.MORE_QURAN: "more_quran",
+            bot.NO_MORE_QURAN: "no_more_quran",
+            bot.RETURN_TO_WIRD: "return_to_wird",
+        }.get(data["callback_query"].get("data"), "toggle_service")
+    text = (data.get("message") or {}).get("text", "")
+    if text.startswith("/"):
+        return text.split()[0][1:]
+    return "other"
+
+
+class SyntheticUpdates:
+    def __init__(self, seed):
+        """Builds Update dicts shaped like the ones Telegram sends"""
+        self.rng = random.Random(seed)
+        self._update_id = 0
+        self._message_id = 0
+        self.date = int(time.time())
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": "user"}
+
+    def _next_ids(self):
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    def command(self, user_id, command):
+        update_id, message_id = self._next_ids()
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": message_id, "date": self.date, "text": command,
+                "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id),
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+            },
+        }
+
+    def callback(self, user_id, data):
+        update_id, message_id = self._next_ids()
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id), "chat_instance": str(user_id), "data": data, "from": self._user(user_id),
+                "message": {
+                    "message_id": message_id, "date": self.date, "text": "<redacted>",
+                    "chat": {"id": user_id, "type": "private"}, "from": BOT_USER,
+                },
+            },
+        }
+
+
+def noon_burst(synthetic, user_ids, window):
+    """Everyone taps "نعم ✅" right after the noon wird, some ask for more or go back to the wird"""
+    import bot
+    rng = synthetic.rng
+    timeline = []
+    for user_id in user_ids:
+        # Most taps arrive within the first seconds of the window
+        offset = min(rng.expovariate(5 / window), window)
+        timeline.append((offset, synthetic.callback(user_id, bot.CONFIRM_READ)))
+        roll = rng.random()
+        if roll < 0.3:
+            timeline.append((offset + rng.uniform(2, 10), synthetic.callback(user_id, bot.MORE_QURAN)))
+        elif roll < 0.4:
+            timeline.append((offset + rng.uniform(2, 10), synthetic.callback(user_id, bot.RETURN_TO_WIRD)))
+    return timeline
+
+
+def onboarding(synthetic, user_ids, window):
+    """New users send /start, toggle a few services and confirm"""
+    import bot
+    rng = synthetic.rng
+    services = [bot.QURAN_SERVICE, bot.PROPHET_PRAYER_SERVICE, bot.DHIKR_SERVICE, bot.NIGHT_PRAYER_SERVICE]
+    timeline = []
+    for user_id in user_ids:
+        offset = rng.uniform(0, window)
+        timeline.append((offset, synthetic.command(user_id, "/start")))
+        for service in rng.sample(services, rng.randint(1, len(services))):
+            offset += rng.uniform(0.5, 3)
+            timeline.append((offset, synthetic.callback(user_id, service)))
+        offset += rng.uniform(0.5, 3)
+        timeline.append((offset, synthetic.callback(user_id, bot.CONFIRM)))
+    return timeline
+
+
+def seed_storage(users):
+    """Existing users subscribed to the Quran service, each with today's wird unread"""
+    from storage import MemoryStorage
+    user_data = {}
+    tracking = {}
+    for i in range(users):
+        user_id = str(100000000 + i)
+        user_data[user_id] = {
+            "username": f"user{i}", "joined_date": "2025-01-01 00:00:00",
+            "services": {"quran_service": True, "prophet_prayer_service": False,
+                         "dhikr_service": False, "night_prayer_service": False},
+        }
+        last_page = 5 + i % 595
+        tracking[user_id] = {
+            "user_id": user_id, "username": f"user{i}", "total_pages_read": last_page,
+            "current_position": last_page, "last_batch_confirmed": "False",
+            "pending_pages": ",".join(str(page) for page in range(last_page - 4, last_page + 1)),
+            "last_reminder_message_id": "", "last_wird_reminder_message_id": "1",
+        }
+    return MemoryStorage(users=user_data, quran_tracking=tracking)
+
+
+def load_recording(path):
+    timeline = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                entry = json.loads(line)
+                timeline.append((entry["offset"], entry["update"]))
+    return timeline
+
+
+def build_stub_request(latency):
+    from telegram.request import BaseRequest
+
+    class StubRequest(BaseRequest):
+        """Answers every Bot API call locally after ``latency`` seconds"""
+
+        def __init__(self):
+            self.calls = collections.Counter()
+            self._message_id = 1000000
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        def _message(self, chat_id, **fields):
+            self._message_id += 1
+            return {"message_id": self._message_id, "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER, **fields}
+
+        def _photo(self, chat_id, caption):
+            file_id = f"file-id-{caption}"
+            return self._message(chat_id, photo=[{"file_id": file_id, "file_unique_id": file_id,
+                                                  "width": 1, "height": 1}])
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            api_method = url.rsplit("/", 1)[-1]
+            self.calls[api_method] += 1
+            if latency:
+                await asyncio.sleep(latency)
+
+            parameters = request_data.parameters if request_data is not None else {}
+            chat_id = parameters.get("chat_id")
+            if api_method == "getMe":
+                result = BOT_USER
+            elif api_method in ("sendMessage", "editMessageText"):
+                result = self._message(chat_id, text=parameters.get("text", ""))
+            elif api_method == "sendPhoto":
+                result = self._photo(chat_id, parameters.get("caption"))
+            elif api_method == "sendMediaGroup":
+                result = [self._photo(chat_id, item.get("caption")) for item in parameters.get("media", [])]
+            else:
+                result = True
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    return StubRequest()
+
+
+async def replay(args):
+    import bot
+    from telegram import Update
+    from telegram.ext import Application, TypeHandler
+    from quran_pages import QuranPageIndex
+    from sqlite_persistence import SQLitePersistence
+    from user_registry import UserRegistry
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    synthetic = SyntheticUpdates(args.seed)
+    if args.updates:
+        timeline = load_recording(args.updates)
+        existing = []
+    else:
+        existing = [100000000 + i for i in range(args.users)]
+        new_users = [200000000 + i for i in range(args.users)]
+        timeline = []
+        if args.scenario in ("noon-burst", "mixed"):
+            timeline += noon_burst(synthetic, existing, args.window)
+        if args.scenario in ("onboarding", "mixed"):
+            timeline += onboarding(synthetic, new_users, args.window)
+    timeline.sort(key=lambda entry: entry[0])
+    if args.rate:
+        timeline = [(i / args.rate, data) for i, (_, data) in enumerate(timeline)]
+    else:
+        timeline = [(offset / args.speed, data) for offset, data in timeline]
+
+    bot.storage = seed_storage(len(existing))
+    bot.user_registry = UserRegistry(bot.storage.load_users, bot.storage.save_users)
+    bot.user_registry.load()
+    bot.quran_pages = QuranPageIndex(os.path.join(ROOT, bot.QURAN_IMAGES_LINKS_FILE))
+    bot.quran_pages.load()
+
+    request = build_stub_request(args.api_latency)
+    workdir = tempfile.TemporaryDirectory()
+    builder = (
+        Application.builder()
+        .token("123456:stub")
+        .persistence(SQLitePersistence(os.path.join(workdir.name, "persistence.db")))
+        .request(request)
+        .get_updates_request(build_stub_request(0))
+    )
+    if args.concurrent_updates > 1:
+        builder = builder.concurrent_updates(args.concurrent_updates)
+    application = builder.build()
+    bot.add_handlers(application)
+
+    enqueued = {}
+    latencies = collections.defaultdict(list)
+    kinds = {}
+    total = len(timeline)
+    finished = asyncio.Event()
+    completed = []
+
+    # Runs after every other handler group, i.e. when the update is fully handled
+    async def done(update, context):
+        latencies[kinds.pop(update.update_id)].append(time.perf_counter() - enqueued.pop(update.update_id))
+        completed.append(time.perf_counter())
+        if len(completed) == total:
+            finished.set()
+
+    application.add_handler(TypeHandler(Update, done), group=99)
+
+    await application.initialize()
+    await application.start()
+    try:
+        start = time.perf_counter()
+        for offset, data in timeline:
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            update = Update.de_json(data, application.bot)
+            kinds[update.update_id] = update_kind(data)
+            enqueued[update.update_id] = time.perf_counter()
+            await application.update_queue.put(update)
+        fed = time.perf_counter()
+        await asyncio.wait_for(finished.wait(), args.timeout)
+    finally:
+        await application.stop()
+        await application.shutdown()
+        workdir.cleanup()
+
+    elapsed = completed[-1] - start if completed else 0.0
+    return {
+        "source": args.updates or args.scenario,
+        "users": len(existing) if not args.updates else None,
+        "updates": total,
+        "concurrent_updates": args.concurrent_updates,
+        "api_latency_ms": args.api_latency * 1000,
+        "feed_seconds": round(fed - start, 3),
+        "wall_seconds": round(elapsed, 3),
+        "throughput_per_second": round(total / elapsed, 1) if elapsed else 0.0,
+        "api_calls": sum(request.calls.values()),
+        "api_calls_by_method": dict(request.calls),
+        "latency": {
+            kind: {
+                "count": len(samples),
+                "p50_ms": round(percentile(samples, 0.5) * 1000, 2),
+                "p95_ms": round(percentile(samples, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+                "max_ms": round(max(samples) * 1000, 2),
+            }
+            for kind, samples in sorted(latencies.items())
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay Telegram updates against the bot offline")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--updates", help="Recorded JSONL file, see UPDATE_RECORD_FILE")
+    source.add_argument("--scenario", choices=SCENARIOS, default="noon-burst")
+    parser.add_argument("--users", type=int, default=1000, help="Users taking part in a synthetic scenario")
+    parser.add_argument("--window", type=float, default=60, help="Seconds over which a scenario's users arrive")
+    parser.add_argument("--speed", type=float, default=1, help="Replay this many times faster than recorded")
+    parser.add_argument("--rate", type=float, default=0, help="Fixed updates per second instead of the recorded pace")
+    parser.add_argument("--concurrent-updates", type=int, default=1,
+                        help="Updates processed at once, the bot processes them one by one")
+    parser.add_argument("--api-latency", type=float, default=0.03, help="Seconds every stubbed API call takes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=3600, help="Seconds to wait for the queue to drain")
+    parser.add_argument("--output", help="Result file, defaults to benchmarks/results/replay-<date>-<commit>.json")
+    args = parser.parse_args()
+
+    os.environ["STORAGE_BACKEND"] = "memory"
+    sys.path.insert(0, ROOT)
+    result = asyncio.run(replay(args))
+
+    print(f"{result['updates']} updates in {result['wall_seconds']:.2f}s "
+          f"({result['throughput_per_second']}/s), {result['api_calls']} API calls")
+    for kind, stats in result["latency"].items():
+        print(f"  {kind:<18} n={stats['count']:<6} p50 {stats['p50_ms']:>9.2f}ms  p95 {stats['p95_ms']:>9.2f}ms  "
+              f"p99 {stats['p99_ms']:>9.2f}ms  max {stats['max_ms']:>9.2f}ms")
+
+    commit = git_commit()
+    report = {
+        "benchmark": "replay_updates",
+        "commit": commit,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "runs": [result],
+    }
+    path = args.output or os.path.join(RESULTS_DIR, f"replay-{datetime.now():%Y%m%d-%H%M%S}-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    print(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark replaying full Egypt-time days of deliveries
+
+Runs the real slot callbacks of bot.py and the confirm_reading handler
+against a stub Telegram Bot API and the in-memory storage backend, on an
+event loop with a simulated clock: whenever nothing is ready to run the clock
+jumps to the next timer, so the broadcast engine's rate limits cost
+simulated time instead of wall time.
+
+    python benchmarks/simulate_day.py                      # 1k, 10k and 100k users
+    python benchmarks/simulate_day.py --users 10000 --compare benchmarks/results/<previous>.json
+
+Every user count runs in its own process so that peak memory is measured
+per run. Results are written as JSON to benchmarks/results/.
+"""
+
+import argparse
+import asyncio
+import collections
+import heapq
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# Share of users subscribed to each service
+SUBSCRIPTION_RATES = {
+    "quran_service": 0.6,
+    "prophet_prayer_service": 0.5,
+    "dhikr_service": 0.5,
+    "night_prayer_service": 0.3,
+}
+
+WEEKDAYS = {"sunday": 0, "monday": 1, "tuesday": 2, "wednesday": 3, "thursday": 4, "friday": 5, "saturday": 6}
+
+DAY = 24 * 60 * 60
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Event loop whose clock jumps to the next timer whenever nothing is ready"""
+
+    def __init__(self):
+        super().__init__()
+        self._virtual_now = 0.0
+
+    def time(self):
+        return self._virtual_now
+
+    def advance_to(self, when):
+        self._virtual_now = max(self._virtual_now, when)
+
+    def _run_once(self):
+        # Relies on BaseEventLoop internals, fine for a benchmark. Cancelled
+        # timers are dropped first like the base loop does, and time always
+        # moves forward a little: sleeps shorter than the float resolution of
+        # the clock would otherwise never see time pass
+        while self._scheduled and self._scheduled[0]._cancelled:
+            self._timer_cancelled_count -= 1
+            heapq.heappop(self._scheduled)._scheduled = False
+        if not self._ready and self._scheduled:
+            self.advance_to(max(self._scheduled[0]._when, self._virtual_now + 1e-6))
+        super()._run_once()
+
+
+class StubBot:
+    def __init__(self, loop, blocked_chats, on_wird_prompt):
+        """
+        In-process stand-in for telegram.Bot counting every API call
+
+        Args:
+            loop (VirtualClockLoop): Loop providing the simulated time
+            blocked_chats (set): Chat IDs answering with Forbidden
+            on_wird_prompt (callable): Called with the chat ID whenever the
+                "did you read the wird" question is sent
+        """
+        from telegram.error import Forbidden
+        self._forbidden = Forbidden
+        self._loop = loop
+        self.blocked_chats = blocked_chats
+        self.on_wird_prompt = on_wird_prompt
+        self.calls = collections.Counter()
+        self.errors = collections.Counter()
+        self._message_id = 0
+
+    def _call(self, method, chat_id):
+        self.calls[method] += 1
+        if chat_id in self.blocked_chats:
+            self.errors[f"{method}:403"] += 1
+            raise self._forbidden("Forbidden: bot was blocked by the user")
+        self._message_id += 1
+        return self._message_id
+
+    def _message(self, chat_id, message_id, photo=None):
+        return SimpleNamespace(
+            message_id=message_id,
+            chat_id=chat_id,
+            photo=[SimpleNamespace(file_id=photo)] if photo else []
+        )
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        message_id = self._call("sendMessage", chat_id)
+        if text == "هل قرأت الوِرد؟":
+            self.on_wird_prompt(chat_id)
+        return self._message(chat_id, message_id)
+
+    async def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        message_id = self._call("sendPhoto", chat_id)
+        return self._message(chat_id, message_id, photo=f"file-id-{caption}")
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        message_id = self._call("sendMediaGroup", chat_id)
+        return [self._message(chat_id, message_id, photo=f"file-id-{item.caption}") for item in media]
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        self._call("deleteMessage", chat_id)
+        return True
+
+
+class StubCallbackQuery:
+    def __init__(self, stub_bot, user_id, data):
+        self._bot = stub_bot
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id)
+        self.message = SimpleNamespace(chat_id=user_id, message_id=0, reply_markup=None)
+
+    async def answer(self, *args, **kwargs):
+        self._bot.calls["answerCallbackQuery"] += 1
+
+    async def delete_message(self, *args, **kwargs):
+        self._bot.calls["deleteMessage"] += 1
+
+    async def edit_message_text(self, *args, **kwargs):
+        self._bot.calls["editMessageText"] += 1
+
+
+def counting_storage(storage_class):
+    """Subclass a storage backend so that every call is counted as one round trip"""
+    methods = ("load_users", "save_users", "subscribers", "get_quran_tracking",
+               "get_all_quran_tracking", "update_quran_tracking", "batch_update_quran_tracking")
+
+    def counted(name):
+        original = getattr(storage_class, name)
+
+        def method(self, *args, **kwargs):
+            self.round_trips[name] += 1
+            return original(self, *args, **kwargs)
+        return method
+
+    namespace = {name: counted(name) for name in methods}
+    counting_class = type(f"Counting{storage_class.__name__}", (storage_class,), namespace)
+
+    def init(self, *args, **kwargs):
+        self.round_trips = collections.Counter()
+        storage_class.__init__(self, *args, **kwargs)
+    counting_class.__init__ = init
+    return counting_class
+
+
+def synthetic_users(count, seed):
+    rng = random.Random(seed)
+    users = {}
+    tracking = {}
+    for i in range(count):
+        user_id = str(100000000 + i)
+        services = {service: rng.random() < rate for service, rate in SUBSCRIPTION_RATES.items()}
+        users[user_id] = {"username": f"user{i}", "joined_date": "2025-01-01 00:00:00", "services": services}
+        if services["quran_service"]:
+            last_page = rng.randrange(0, 600)
+            # Some users still have yesterday's pages open
+            unread = list(range(last_page - 4, last_page + 1)) if last_page > 5 and rng.random() < 0.1 else []
+            tracking[user_id] = {
+                "user_id": user_id,
+                "username": f"user{i}",
+                "total_pages_read": last_page,
+                "current_position": last_page,
+                "last_batch_confirmed": str(not unread),
+                "pending_pages": ",".join(str(page) for page in unread),
+                "last_reminder_message_id": "",
+                "last_wird_reminder_message_id": "",
+            }
+    return users, tracking
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[max(0, int(round(fraction * len(samples))) - 1)]
+
+
+async def simulate(args, loop):
+    import bot
+    from broadcast import BroadcastEngine
+    from outbox import DeliveryOutbox
+    from quran_pages import QuranPageIndex
+    from storage import MemoryStorage
+    from user_registry import UserRegistry
+    import broadcast
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # Rate limits follow the simulated clock
+    broadcast.time = SimpleNamespace(monotonic=loop.time)
+
+    users, tracking = synthetic_users(args.users, args.seed)
+    rng = random.Random(args.seed + 1)
+    blocked = {int(user_id) for user_id in users if rng.random() < args.blocked_fraction}
+
+    storage = counting_storage(MemoryStorage)(users=users, quran_tracking=tracking)
+    storage.round_trips.clear()
+    bot.storage = storage
+    bot.user_registry = UserRegistry(storage.load_users, storage.save_users)
+    bot.user_registry.load()
+    bot.broadcast_engine = BroadcastEngine(
+        global_rate=args.global_rate,
+        max_concurrency=int(os.environ.get("BROADCAST_CONCURRENCY", 20))
+    )
+    # Outbox writes are part of every run, the database just lives in memory
+    bot.outbox = DeliveryOutbox(":memory:")
+    bot.outbox.open()
+    # No file_id cache file, the stub hands out file ids on first send
+    bot.quran_pages = QuranPageIndex(os.path.join(ROOT, bot.QURAN_IMAGES_LINKS_FILE))
+    bot.quran_pages.load()
+
+    handler_latency = collections.defaultdict(list)
+    interactions = []
+
+    def on_wird_prompt(chat_id):
+        # Some users confirm their reading a while after the question arrives
+        if rng.random() < args.confirm_fraction:
+            interactions.append(loop.create_task(tap(chat_id, loop.time() + rng.expovariate(1 / 7200))))
+
+    stub = StubBot(loop, blocked, on_wird_prompt)
+
+    async def tap(chat_id, when):
+        await asyncio.sleep(max(0.0, when - loop.time()))
+        update = SimpleNamespace(callback_query=StubCallbackQuery(stub, chat_id, bot.CONFIRM_READ))
+        context = SimpleNamespace(bot=stub)
+        start = time.perf_counter()
+        await bot.confirm_reading(update, context)
+        handler_latency["confirm_reading"].append(time.perf_counter() - start)
+
+    scheduler = bot.build_slot_scheduler()
+    slot_runs = []
+
+    async def run_slot(slot, day_start):
+        when = day_start + slot.hour * 3600 + slot.minute * 60 + slot.second
+        await asyncio.sleep(max(0.0, when - loop.time()))
+        data = {"audience": slot.audience, "slot": slot.name, "run_id": f"{slot.name}:day{day_start // DAY}"}
+        context = SimpleNamespace(bot=stub, job=SimpleNamespace(name=slot.name, data=data))
+        calls_before = sum(stub.calls.values())
+        wall_start = time.perf_counter()
+        virtual_start = loop.time()
+        await slot.callback(context)
+        slot_runs.append({
+            "slot": slot.name,
+            "day": day_start // DAY,
+            "scheduled_at": f"{slot.hour:02d}:{slot.minute:02d}:{slot.second:02d}",
+            "recipients": len(bot.resolve_audience(slot.audience)),
+            "simulated_seconds": round(loop.time() - virtual_start, 1),
+            "wall_seconds": round(time.perf_counter() - wall_start, 3),
+            "api_calls_during_run": sum(stub.calls.values()) - calls_before,
+        })
+
+    wall_start = time.perf_counter()
+    jobs = []
+    for day_number, weekday in enumerate(args.weekdays):
+        day_start = day_number * DAY
+        for slot in scheduler.slots:
+            if WEEKDAYS[weekday] in slot.days:
+                jobs.append(loop.create_task(run_slot(slot, day_start)))
+    await asyncio.gather(*jobs)
+    while interactions:
+        pending, interactions[:] = list(interactions), []
+        await asyncio.gather(*pending)
+    wall_seconds = time.perf_counter() - wall_start
+
+    return {
+        "users": args.users,
+        "weekdays": args.weekdays,
+        "subscribers": {service: len(bot.user_registry.subscribers(service)) for service in SUBSCRIPTION_RATES},
+        "blocked_users": len(blocked),
+        "job_count": len(scheduler.slots),
+        "jobs_run": len(slot_runs),
+        "wall_seconds": round(wall_seconds, 3),
+        "simulated_seconds": round(loop.time(), 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "api_calls": sum(stub.calls.values()),
+        "api_calls_by_method": dict(stub.calls),
+        "api_errors": dict(stub.errors),
+        "storage_round_trips": sum(storage.round_trips.values()),
+        "storage_round_trips_by_method": dict(storage.round_trips),
+        "handlers": {
+            name: {
+                "count": len(samples),
+                "p50_ms": round(percentile(samples, 0.5) * 1000, 3),
+                "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+                "mean_ms": round(statistics.fmean(samples) * 1000, 3) if samples else 0.0,
+            }
+            for name, samples in handler_latency.items()
+        },
+        "slots": sorted(slot_runs, key=lambda run: (run["day"], run["scheduled_at"])),
+    }
+
+
+def run_single(args):
+    os.environ["STORAGE_BACKEND"] = "memory"
+    sys.path.insert(0, ROOT)
+    loop = VirtualClockLoop()
+    try:
+        result = loop.run_until_complete(simulate(args, loop))
+    finally:
+        loop.close()
+    json.dump(result, sys.stdout)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_summary(result, previous=None):
+    line = (
+        f"{result['users']:>7} users: wall {result['wall_seconds']:>8.2f}s  "
+        f"simulated {result['simulated_seconds'] / 3600:>6.1f}h  api_calls {result['api_calls']:>9}  "
+        f"storage {result['storage_round_trips']:>7}  peak {result['peak_rss_mb']:>7.1f}MB  jobs {result['job_count']}"
+    )
+    if previous:
+        deltas = []
+        for key in ("wall_seconds", "api_calls", "storage_round_trips", "peak_rss_mb"):
+            if previous.get(key):
+                deltas.append(f"{key} {100 * (result[key] - previous[key]) / previous[key]:+.1f}%")
+        line += "\n" + " " * 15 + "vs previous: " + ", ".join(deltas)
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate full days of bot deliveries offline")
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--weekdays", nargs="+", choices=list(WEEKDAYS), default=["thursday", "saturday"],
+                        help="Days to simulate back to back, the defaults include both global reminders")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--global-rate", type=float, default=30, help="Simulated Telegram messages per second")
+    parser.add_argument("--confirm-fraction", type=float, default=0.5, help="Share of users confirming their wird")
+    parser.add_argument("--blocked-fraction", type=float, default=0.02, help="Share of users who blocked the bot")
+    parser.add_argument("--output", help="Result file, defaults to benchmarks/results/<date>-<commit>.json")
+    parser.add_argument("--compare", help="Previous result file to compare against")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        args.users = args.users[0]
+        run_single(args)
+        return
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            previous = {run["users"]: run for run in json.load(file)["runs"]}
+
+    runs = []
+    for users in args.users:
+        command = [sys.executable, os.path.abspath(__file__), "--single", "--users", str(users),
+                   "--weekdays", *args.weekdays, "--seed", str(args.seed),
+                   "--global-rate", str(args.global_rate), "--confirm-fraction", str(args.confirm_fraction),
+                   "--blocked-fraction", str(args.blocked_fraction)]
+        output = subprocess.run(command, capture_output=True, text=True)
+        if output.returncode != 0:
+            sys.stderr.write(output.stderr)
+            sys.exit(f"Simulation with {users} users failed")
+        result = json.loads(output.stdout)
+        runs.append(result)
+        print_summary(result, previous.get(users))
+
+    commit = git_commit()
+    report = {
+        "benchmark": "simulate_day",
+        "commit": commit,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "runs": runs,
+    }
+    path = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    print(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
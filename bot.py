@@ -4,20 +4,41 @@
 import os
 import logging
 import pytz
-import json
-import requests
-import threading
-import http.server
-import socketserver
 import gspread
 import asyncio
-from sheets_integration import GoogleSheetsIntegration
+import csv
+import functools
+import io
+import signal
+import hmac
+import json
+import secrets
+import tempfile
+from broadcast import BroadcastEngine, UNREACHABLE_REASONS
+from http_server import HTTPServer
+from loop_monitor import LoopLagMonitor
+import metrics
+from metrics import MetricsHTTPXRequest
+from outbox import DeliveryOutbox, OutboxRun
+from quran_pages import QuranPageIndex, TOTAL_PAGES as TOTAL_QURAN_PAGES
+from sheets_mirror import SheetsMirror
+from sheets_storage import SheetsStorage, USER_SHEET_HEADER
+from sqlite_persistence import SQLitePersistence
+from slot_scheduler import SlotScheduler
+from sqlite_storage import SQLiteStorage
+from storage import MemoryStorage, SERVICE_COLUMNS
+from update_recorder import UpdateRecorder
+from user_registry import UserRegistry
+from user_stats import UserStats
+from user_sheet import UserSheet
 from google.oauth2 import service_account
 from datetime import datetime, time, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ChatAction
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.error import BadRequest
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler, 
-    ContextTypes, ConversationHandler, JobQueue, filters, PicklePersistence
+    ContextTypes, ConversationHandler, TypeHandler
 )
 
 # Enable logging
@@ -28,7 +49,6 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Bot token
-import os
 TOKEN = os.environ.get("BOT_TOKEN")
 
 
@@ -50,6 +70,14 @@ NO_MORE_QURAN = "no_more_quran"
 CONFIRM_READ = "confirm_read"  # New callback data for confirming reading
 RETURN_TO_WIRD = "return_to_wird"  # Callback data for the new button
 GET_USERS_COUNT = "get_users_count"  # New callback data for admin command
+USERS_INFO = "users_info"  # Callback data prefix of the /users_info page buttons
+USERS_INFO_PAGE_SIZE = 20  # Users per /users_info page
+# Longer usernames are cut on /users_info pages, 20 entries then stay below Telegram's 4096 characters
+# even when every name is made of characters counted twice (emoji)
+USERS_INFO_USERNAME_LENGTH = 32
+
+# context.user_data key of the services selected so far in the selection conversation
+SELECTED_SERVICES_KEY = "selected_services"
 
 # Admin user ID - Ahmed A. Ismail's user ID
 ADMIN_ID = 853742750
@@ -62,15 +90,58 @@ SHEET_NAME = "user_data"
 # Other data storage
 QURAN_TRACKER_FILE = "quran_tracker.json"
 QURAN_IMAGES_LINKS_FILE = "quran_images_links.json"  # File for image links
-PERSISTENCE_FILE = "persistence_data.pickle" # File for persistence data
+QURAN_FILE_IDS_FILE = "quran_file_ids.json"  # Telegram file ids of already sent pages
+PERSISTENCE_FILE = "persistence_data.pickle" # Old pickle persistence, imported once
+PERSISTENCE_DB_FILE = os.environ.get("PERSISTENCE_DB_FILE", "persistence_data.db")  # Conversation states and user_data
+
+# Seconds between two commits of changed conversation states and user_data
+PERSISTENCE_INTERVAL = float(os.environ.get("PERSISTENCE_INTERVAL", 60))
+
+# Where users and Quran tracking are stored: sqlite (default), sheets or memory
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sqlite")
 
-sheets = GoogleSheetsIntegration("telegram-bot-457917-a94e41b346fe.json")
+# Local database of the sqlite backend, Google Sheets only mirrors it
+STORAGE_DB_FILE = os.environ.get("STORAGE_DB_FILE", "azkar_bot.db")
 
-# Health check server port (for Railway deployment)
+# Seconds between two exports of the sqlite backend to Google Sheets, 0 disables the mirror
+SHEETS_MIRROR_INTERVAL = float(os.environ.get("SHEETS_MIRROR_INTERVAL", 600))
+
+# HTTP server port for health checks and the webhook (for Railway deployment)
 HEALTH_CHECK_PORT = int(os.environ.get("PORT", 8080))
 
+# Updates arrive by webhook when WEBHOOK_URL is set, otherwise by long polling
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+UPDATE_MODE = os.environ.get("UPDATE_MODE", "webhook" if WEBHOOK_URL else "polling")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+# Telegram sends it back in every webhook request, a random one is used if not configured
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+
+# Interval between two write-behind flushes of the user registry (seconds)
+USER_FLUSH_INTERVAL = float(os.environ.get("USER_FLUSH_INTERVAL", 5))
+
+# Durable outbox of scheduled runs, a run interrupted by a restart resumes with its pending recipients
+OUTBOX_DB_FILE = os.environ.get("OUTBOX_DB_FILE", "outbox.db")
+# Completed recipients recorded together, at most this many get a delivery twice after a crash
+OUTBOX_CHECKPOINT_SIZE = int(os.environ.get("OUTBOX_CHECKPOINT_SIZE", 50))
+# Interrupted runs older than this are abandoned instead of resumed (seconds)
+OUTBOX_RESUME_MAX_AGE = float(os.environ.get("OUTBOX_RESUME_MAX_AGE", 6 * 60 * 60))
+
+# Unreachable users are probed again after this many days, that many per night at most
+REPROBE_INTERVAL_DAYS = float(os.environ.get("REPROBE_INTERVAL_DAYS", 7))
+REPROBE_BATCH = int(os.environ.get("REPROBE_BATCH", 500))
+
+# Incoming updates are recorded, anonymized, to this JSONL file when set (for load tests)
+UPDATE_RECORD_FILE = os.environ.get("UPDATE_RECORD_FILE", "")
+
+# Cached worksheet, authorizing gspread is a network round trip
+_user_worksheet = None
+
 # Initialize Google Sheets client
 def init_google_sheets():
+    global _user_worksheet
+    if _user_worksheet is not None:
+        return _user_worksheet
+
     try:
         # Create credentials from the service account file
         credentials = service_account.Credentials.from_service_account_file(
@@ -82,250 +153,395 @@ def init_google_sheets():
         client = gspread.authorize(credentials)
         
         # Open the spreadsheet and worksheet
-        sheet = client.open_by_key(SHEET_ID).worksheet(SHEET_NAME)
+        _user_worksheet = client.open_by_key(SHEET_ID).worksheet(SHEET_NAME)
         
         logger.info("Successfully connected to Google Sheets")
-        return sheet
+        return _user_worksheet
     except Exception as e:
         logger.error(f"Error connecting to Google Sheets: {e}")
         return None
 
-# Load user data from Google Sheets
-def load_user_data():
-    try:
-        sheet = init_google_sheets()
-        if not sheet:
-            logger.error("Failed to initialize Google Sheets")
-            return {}
-            
-        # Get all records from the sheet
-        records = sheet.get_all_records()
-        
-        # Convert to the format expected by the bot
-        user_data = {}
-        for record in records:
-            user_id = str(record.get('user_id', ''))
-            if user_id:
-                user_data[user_id] = {
-                    "username": record.get('username', ''),
-                    "joined_date": record.get('joined_date', ''),
-                    "services": {
-                        QURAN_SERVICE: record.get('quran_service', False),
-                        PROPHET_PRAYER_SERVICE: record.get('prophet_prayer_service', False),
-                        DHIKR_SERVICE: record.get('dhikr_service', False),
-                        NIGHT_PRAYER_SERVICE: record.get('night_prayer_service', False)
-                    }
-                }
-        
-        logger.info(f"Loaded {len(user_data)} users from Google Sheets")
-        return user_data
-    except Exception as e:
-        logger.error(f"Error loading user data from Google Sheets: {e}")
-        return {}
+# Row-indexed access to the user_data worksheet
+user_sheet = UserSheet(init_google_sheets, USER_SHEET_HEADER)
+
+# Google Sheets storage, the backend itself or the target of the sqlite backend's mirror.
+# At most SHEETS_CONCURRENCY of its requests are in flight from the event loop.
+sheets_storage = SheetsStorage(user_sheet, CREDENTIALS_FILE,
+                               max_concurrency=int(os.environ.get("SHEETS_CONCURRENCY", 4)))
+
+# Create the storage backend selected by STORAGE_BACKEND, nothing is contacted before open()
+def build_storage(backend):
+    if backend == "sqlite":
+        return SQLiteStorage(STORAGE_DB_FILE)
+    if backend == "sheets":
+        return sheets_storage
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}, expected sqlite, sheets or memory")
 
-# Save user data to Google Sheets - Modified to run in a separate thread
-def save_user_data(data):
-    # Create a function to run in a separate thread
-    def save_data_thread():
+# Primary storage of users and Quran tracking
+storage = build_storage(STORAGE_BACKEND)
+
+# Run a storage call in a worker thread, on the backend's own thread pool if it has one
+async def storage_thread_call(method, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(storage.executor, functools.partial(method, *args))
+
+# Run a storage call, remote backends are kept off the event loop
+async def storage_call(method, *args):
+    if storage.remote:
+        return await storage_thread_call(method, *args)
+    return method(*args)
+
+# In-memory user registry, loaded once at startup and flushed to the local database in the background.
+# Its running totals answer admin commands and /metrics without scanning the users.
+user_registry = UserRegistry(storage.load_users, storage.save_users, flush_interval=USER_FLUSH_INTERVAL,
+                             stats=UserStats(storage.load_stats, storage.save_stats))
+
+# Periodic export of changed rows to Google Sheets, only the sqlite backend has one
+sheets_mirror = SheetsMirror(storage, sheets_storage) if STORAGE_BACKEND == "sqlite" and SHEETS_MIRROR_INTERVAL > 0 else None
+
+# Fresh Quran tracking state for a user who never received a wird
+def new_quran_tracking():
+    return {
+        "last_page": 0,
+        "total_pages_read": 0,
+        "unread_pages": [],  # Track unread pages
+        "last_read_confirmed": True,  # Track if last reading was confirmed
+        "last_reminder_message_id": None, # Track confirmation message ID
+        "last_wird_reminder_message_id": None # Track the 'متنساش' reminder message ID
+    }
+
+# Convert a quran_tracking sheet row to the tracking dict used by the handlers
+def quran_tracking_from_row(row):
+    def to_int(value, default=0):
         try:
-            sheet = init_google_sheets()
-            if not sheet:
-                logger.error("Failed to initialize Google Sheets")
-                return
-                
-            # Convert user data to format for Google Sheets
-            records = []
-            for user_id, user_info in data.items():
-                record = {
-                    'user_id': user_id,
-                    'username': user_info.get('username', ''),
-                    'joined_date': user_info.get('joined_date', ''),
-                    'quran_service': user_info.get('services', {}).get(QURAN_SERVICE, False),
-                    'prophet_prayer_service': user_info.get('services', {}).get(PROPHET_PRAYER_SERVICE, False),
-                    'dhikr_service': user_info.get('services', {}).get(DHIKR_SERVICE, False),
-                    'night_prayer_service': user_info.get('services', {}).get(NIGHT_PRAYER_SERVICE, False)
-                }
-                records.append(record)
-            
-            # Clear the current sheet data (except header)
-            sheet.clear()
-            
-            # Add header row
-            header = ['user_id', 'username', 'joined_date', 'quran_service', 
-                     'prophet_prayer_service', 'dhikr_service', 'night_prayer_service']
-            sheet.update('A1', [header])
-            
-            # Add all records
-            if records:
-                values = []
-                for record in records:
-                    row = [
-                        record['user_id'],
-                        record['username'],
-                        record['joined_date'],
-                        record['quran_service'],
-                        record['prophet_prayer_service'],
-                        record['dhikr_service'],
-                        record['night_prayer_service']
-                    ]
-                    values.append(row)
-                
-                sheet.update(f'A2:G{len(records)+1}', values)
-            
-            logger.info(f"Saved {len(records)} users to Google Sheets")
-        except Exception as e:
-            logger.error(f"Error saving user data to Google Sheets: {e}")
-    
-    # Start a new thread to save data
-    threading.Thread(target=save_data_thread).start()
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+    
+    pending_pages = str(row.get('pending_pages') or '')
+    return {
+        "last_page": to_int(row.get('current_position')),
+        "total_pages_read": to_int(row.get('total_pages_read')),
+        "unread_pages": [int(page) for page in pending_pages.split(',') if page.strip().isdigit()],
+        "last_read_confirmed": str(row.get('last_batch_confirmed', 'True')).strip().upper() != "FALSE",
+        "last_reminder_message_id": to_int(row.get('last_reminder_message_id'), None),
+        "last_wird_reminder_message_id": to_int(row.get('last_wird_reminder_message_id'), None)
+    }
 
-# Quran tracking now uses Google Sheets
+# Convert a tracking dict back to a quran_tracking sheet row
+def quran_tracking_to_row(user_id, tracking):
+    user = user_registry.get(user_id) or {}
+    return {
+        'user_id': user_id,
+        'username': user.get("username", ""),
+        'total_pages_read': tracking["total_pages_read"],
+        'current_position': tracking["last_page"],
+        'last_batch_confirmed': str(bool(tracking["last_read_confirmed"])),
+        'pending_pages': ",".join(str(page) for page in tracking["unread_pages"]),
+        'last_reminder_message_id': tracking.get("last_reminder_message_id") or '',
+        'last_wird_reminder_message_id': tracking.get("last_wird_reminder_message_id") or ''
+    }
 
-# Load Quran image links
-def load_quran_image_links():
-    if os.path.exists(QURAN_IMAGES_LINKS_FILE):
-        with open(QURAN_IMAGES_LINKS_FILE, 'r', encoding='utf-8') as file:
-            try:
-                # Load the array of objects
-                links_array = json.load(file)
-                
-                # Convert to a dictionary with page numbers as keys
-                links_dict = {}
-                for item in links_array:
-                    # Extract page number from filename (e.g., "1.jpg" -> "1")
-                    page_num = item["name"].split('.')[0]
-                    links_dict[page_num] = item["url"]
-                
-                return links_dict
-            except json.JSONDecodeError:
-                logger.error(f"Error parsing {QURAN_IMAGES_LINKS_FILE}")
-                return {}
-    else:
-        logger.error(f"File {QURAN_IMAGES_LINKS_FILE} not found")
+# Load a user's Quran tracking as {user_id: tracking}, empty if the user has none yet
+async def load_quran_tracker(user_id):
+    row = await storage_call(storage.get_quran_tracking, user_id)
+    if not row:
         return {}
+    return {user_id: quran_tracking_from_row(row)}
+
+# Save every entry of a {user_id: tracking} dict
+async def save_quran_tracker(quran_tracker):
+    await storage_call(storage.batch_update_quran_tracking, [
+        quran_tracking_to_row(user_id, tracking) for user_id, tracking in quran_tracker.items()
+    ])
+
+# Quran page image links, parsed once and reloaded only when the file changes
+quran_pages = QuranPageIndex(QURAN_IMAGES_LINKS_FILE, QURAN_FILE_IDS_FILE)
+
+# Telegram accepts 2 to 10 photos per media group
+MEDIA_GROUP_SIZE = 10
+
+# Send Quran pages as albums of up to 10 pages, pages without a link get a notice instead
+async def send_quran_pages(bot, chat_id, page_nums, report=None, rate_limited=False):
+    # Scheduled sends go through the broadcast engine, interactive ones are sent directly
+    async def call(method, **kwargs):
+        if rate_limited:
+            return await broadcast_engine.call(method, report=report, **kwargs)
+        return await method(**kwargs)
+    
+    # One API call per album, a single page cannot be a media group and goes out as a photo
+    async def send_album(pages, photos):
+        if len(pages) == 1:
+            message = await call(bot.send_photo, chat_id=chat_id, photo=photos[0], caption=f"صفحة {pages[0]}")
+            return [message]
+        media = [InputMediaPhoto(media=photo, caption=f"صفحة {page_num}") for page_num, photo in zip(pages, photos)]
+        return await call(bot.send_media_group, chat_id=chat_id, media=media)
+    
+    if not page_nums:
+        return
+    # One slice of the index and one check of the links file for the whole send
+    links = dict(quran_pages.pages(min(page_nums), max(page_nums)))
+    
+    album = []
+    
+    async def flush_album():
+        if not album:
+            return
+        pages = list(album)
+        album.clear()
+        
+        photos = [quran_pages.photo(page_num) for page_num in pages]
+        page_links = [links[page_num] for page_num in pages]
+        try:
+            messages = await send_album(pages, photos)
+        except BadRequest as e:
+            if photos == page_links:
+                raise
+            # A cached file_id was rejected, fall back to the Google Drive links
+            logger.warning(f"Cached file ids of pages {pages} rejected: {e}")
+            for page_num in pages:
+                quran_pages.forget_file_id(page_num)
+            messages = await send_album(pages, page_links)
+        
+        for page_num, message in zip(pages, messages):
+            quran_pages.remember_file_id(page_num, message)
+    
+    for page_num in page_nums:
+        if links.get(page_num):
+            album.append(page_num)
+            if len(album) == MEDIA_GROUP_SIZE:
+                await flush_album()
+        else:
+            # Keep the page order, the album so far goes out before the notice
+            await flush_album()
+            await call(
+                bot.send_message,
+                chat_id=chat_id,
+                text=f"عذراً، لم يتم العثور على رابط لصفحة {page_num}."
+            )
+    
+    await flush_album()
 
 # Define the new messages for scheduled sending
 DUA_MESSAGE = "إلهي أذهب البأس ربّ النّاس ، اشف وأنت الشّافي ، لا شفاء إلا شفاؤك ، شفاءً لا يغادر سقماً ، أذهب البأس ربّ النّاس ، بيدك الشّفاء ، لا كاشف له إلّا أنت يارب العالمين"
 AYAH_MESSAGE = "﴿ ۞ وَأَيُّوبَ إِذۡ نَادَىٰ رَبَّهُۥٓ أَنِّي مَسَّنِيَ ٱلضُّرُّ وَأَنتَ أَرۡحَمُ ٱلرَّٰحِمِينَ ﴾  [ الأنبياء : ٨٣ ]"
 
-# New callback function for Dua message
-async def send_dua_message(context: ContextTypes.DEFAULT_TYPE):
-    """Sends the scheduled Dua message to all users."""
-    logger.info("Running scheduled job: send_dua_message")
-    user_data = load_user_data()
-    if not user_data:
-        logger.info("No users found to send Dua message.")
+SATURDAY_REMINDER_MESSAGES = [
+    "🟣 بدايه اسبوع جديد وحاول تبعد عن الذنوب وخصوصا الكبائر عشان بتسبب مشاكل و تعب نفسي و نقص الرزق و عدم استجابه الدعاء و عدم التوفيق و غيره الكثير",
+    "بعض من الكبائر : ترك الصلاة , العقوق , الكذب , الغيبة , النميمة , الربا ( من ضمنها القروض ) , شرب الخمر والمخدرات , شتم الاهل ( اهل اي حد ) , الزنا , أكل المال الحرام , الرياء ( التظاهر بالصلاح ) , شهادة الزور , قطع صله الرحم"
+]
+THURSDAY_REMINDER_MESSAGES = [
+    "مِن مغرب الخَميس إلى مغرب الجُمعة كُلّ ثانية فيها خزائن من الحسناتِ والرّحمات وتفريج الكُربات\nفليُكثر المرء من الصَّلاة على النَّبي ﷺ",
+    "﴿ إِنَّ اللَّهَ وَمَلائِكَتَهُ يُصَلّونَ عَلَى النَّبِيِّ يا أَيُّهَا الَّذينَ آمَنوا صَلّوا عَلَيهِ وَسَلِّموا تَسليمًا ﴾ [ الأحزاب : ٥٦ ]"
+]
+
+# Shared rate-limited sender for all broadcasts
+broadcast_engine = BroadcastEngine(
+    global_rate=float(os.environ.get("BROADCAST_RATE", 30)),
+    max_concurrency=int(os.environ.get("BROADCAST_CONCURRENCY", 20))
+)
+metrics.gauge('bot_broadcast_pending', 'Recipients queued in running broadcasts', lambda: broadcast_engine.pending)
+
+# Who every scheduled run still has to reach, survives restarts
+outbox = DeliveryOutbox(OUTBOX_DB_FILE)
+
+# Broadcast audience covering every registered user, any service name selects its subscribers
+AUDIENCE_ALL = "all_users"
+
+# Resolve a broadcast audience to the list of recipient user IDs, unreachable users are left out
+def resolve_audience(audience):
+    if audience == AUDIENCE_ALL:
+        return user_registry.reachable_user_ids()
+    return user_registry.reachable_subscribers(audience)
+
+# Record a delivery outcome against the user, blocked, deactivated and deleted chats leave every audience
+def record_reachability(chat_id, status):
+    if status in UNREACHABLE_REASONS:
+        if user_registry.mark_unreachable(chat_id, status):
+            logger.info(f"User {chat_id} is unreachable ({status}), excluded from future deliveries")
+    elif status == "sent":
+        user_registry.mark_reachable(chat_id)
+
+# Any update from a user proves they can be reached again, e.g. after unblocking the bot
+async def restore_reachability(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if user is not None and not user_registry.is_reachable(user.id):
+        user_registry.mark_reachable(user.id)
+        logger.info(f"User {user.id} is reachable again")
+
+# Nightly re-probe of unreachable users with an invisible chat action, the ones that unblocked
+# the bot without writing to it return to their audiences
+async def reprobe_unreachable_users(context: ContextTypes.DEFAULT_TYPE):
+    user_ids = user_registry.due_for_probe(timedelta(days=REPROBE_INTERVAL_DAYS), REPROBE_BATCH)
+    if not user_ids:
         return
-    for user_id in user_data.keys():
+    
+    async def deliver(chat_id, report):
+        await broadcast_engine.call(context.bot.send_chat_action, chat_id=chat_id, action=ChatAction.TYPING,
+                                    report=report)
+    
+    async def on_done(chat_id, status):
+        record_reachability(chat_id, status)
+    
+    report = await broadcast_engine.run("reprobe_unreachable_users", [int(user_id) for user_id in user_ids],
+                                        deliver, on_done=on_done)
+    logger.info(f"Re-probed {report.total} unreachable users, {report.sent} are reachable again")
+
+# Outbox run ID of a slot job: resumed runs carry theirs, scheduled ones are keyed by slot and local date
+def outbox_run_id(context, name):
+    data = context.job.data if context.job and context.job.data else {}
+    return data.get("run_id") or f"{data.get('slot', name)}:{datetime.now(EGYPT_TZ):%Y-%m-%d}"
+
+# Run a delivery through the outbox: recipients are recorded before anything is sent and checkpointed
+# as they complete, so a run picked up again after a restart only serves the ones still pending.
+# send(chat_ids, on_done) performs the broadcast, before_checkpoint saves state the deliveries changed
+async def run_with_outbox(context, name, user_ids, send, before_checkpoint=None):
+    data = context.job.data if context.job and context.job.data else {}
+    run_id = outbox_run_id(context, name)
+    # A run of the whole audience is one large transaction, kept off the event loop
+    pending = await asyncio.to_thread(outbox.start_run, run_id, name, data.get("slot", name), user_ids)
+    # Recipients of a resumed run who unsubscribed or became unreachable since it started are skipped
+    # A new run returns the audience itself, anything else was picked up again
+    resumed = pending != user_ids
+    audience = set(user_ids)
+    stored = len(pending)
+    pending = [user_id for user_id in pending if user_id in audience]
+    if resumed:
+        logger.info(f"Outbox run {run_id} already served part of its audience, {len(pending)} of "
+                    f"{stored} pending recipients are still in it")
+    
+    if pending:
+        run = OutboxRun(outbox, run_id, OUTBOX_CHECKPOINT_SIZE, before_checkpoint)
+        
+        async def on_done(chat_id, status):
+            if status in UNREACHABLE_REASONS:
+                record_reachability(chat_id, status)
+            await run.done(chat_id, status)
+        
         try:
-            await context.bot.send_message(chat_id=int(user_id), text=DUA_MESSAGE)
-            logger.info(f"Sent Dua message to user {user_id}")
-        except Exception as e:
-            # Handle potential errors like user blocking the bot
-            logger.error(f"Failed to send Dua message to user {user_id}: {e}")
+            await send([int(user_id) for user_id in pending], on_done)
+        finally:
+            # Also when cancelled on shutdown, whoever was served must not be served again
+            checkpointed = await run.checkpoint()
+        if not checkpointed:
+            # Finishing would drop the recipients whose state was not saved, the run is resumed on the next start
+            logger.error(f"Outbox run {run_id} left unfinished, not every served recipient could be checkpointed")
+            return
+    await asyncio.to_thread(outbox.finish_run, run_id)
+
+# Send messages once to every user of an audience - shared by all broadcast jobs
+async def broadcast_messages(context: ContextTypes.DEFAULT_TYPE, name, messages):
+    job = context.job
+    audience = job.data.get("audience", AUDIENCE_ALL) if job and job.data else AUDIENCE_ALL
+    user_ids = resolve_audience(audience)
+    if not user_ids:
+        logger.info(f"No users found in audience {audience} for {name}.")
+        return
+    
+    # Expected API calls without retries, compare with api_calls in the final summary
+    logger.info(
+        f"Broadcast {name}: audience={audience} recipients={len(user_ids)} "
+        f"messages_per_user={len(messages)} api_call_budget={len(user_ids) * len(messages)}"
+    )
+    
+    async def send(chat_ids, on_done):
+        await broadcast_engine.send_messages(context.bot, name, chat_ids, messages, on_done=on_done)
+    
+    await run_with_outbox(context, name, user_ids, send)
+
+# New callback function for Dua message
+async def send_dua_message(context: ContextTypes.DEFAULT_TYPE):
+    """Sends the scheduled Dua message to the job's audience."""
+    await broadcast_messages(context, "send_dua_message", [DUA_MESSAGE])
 
 # New callback function for Ayah message
 async def send_ayah_message(context: ContextTypes.DEFAULT_TYPE):
-    """Sends the scheduled Ayah message to all users."""
-    logger.info("Running scheduled job: send_ayah_message")
-    user_data = load_user_data()
-    if not user_data:
-        logger.info("No users found to send Ayah message.")
-        return
-    for user_id in user_data.keys():
-        try:
-            await context.bot.send_message(chat_id=int(user_id), text=AYAH_MESSAGE)
-            logger.info(f"Sent Ayah message to user {user_id}")
-        except Exception as e:
-            # Handle potential errors like user blocking the bot
-            logger.error(f"Failed to send Ayah message to user {user_id}: {e}")
+    """Sends the scheduled Ayah message to the job's audience."""
+    await broadcast_messages(context, "send_ayah_message", [AYAH_MESSAGE])
 
 # New callback function for Global Saturday Reminder
 async def send_global_saturday_reminder(context: ContextTypes.DEFAULT_TYPE):
-    """Sends the scheduled Saturday reminder to all users."""
-    logger.info("Running scheduled job: send_global_saturday_reminder")
-    user_data = load_user_data()
-    if not user_data:
-        logger.info("No users found to send Saturday reminder.")
-        return
-    for user_id in user_data.keys():
-        try:
-            await context.bot.send_message(
-                chat_id=int(user_id),
-                text="🟣 بدايه اسبوع جديد وحاول تبعد عن الذنوب وخصوصا الكبائر عشان بتسبب مشاكل و تعب نفسي و نقص الرزق و عدم استجابه الدعاء و عدم التوفيق و غيره الكثير"
-            )
-            await context.bot.send_message(
-                chat_id=int(user_id),
-                text="بعض من الكبائر : ترك الصلاة , العقوق , الكذب , الغيبة , النميمة , الربا ( من ضمنها القروض ) , شرب الخمر والمخدرات , شتم الاهل ( اهل اي حد ) , الزنا , أكل المال الحرام , الرياء ( التظاهر بالصلاح ) , شهادة الزور , قطع صله الرحم"
-            )
-            logger.info(f"Sent Saturday reminder to user {user_id}")
-        except Exception as e:
-            logger.error(f"Failed to send Saturday reminder to user {user_id}: {e}")
+    """Sends the scheduled Saturday reminder to the job's audience."""
+    await broadcast_messages(context, "send_global_saturday_reminder", SATURDAY_REMINDER_MESSAGES)
 
 # New callback function for Global Thursday Reminder
 async def send_global_thursday_reminder(context: ContextTypes.DEFAULT_TYPE):
-    """Sends the scheduled Thursday reminder to all users."""
-    logger.info("Running scheduled job: send_global_thursday_reminder")
-    user_data = load_user_data()
-    if not user_data:
-        logger.info("No users found to send Thursday reminder.")
-        return
-    for user_id in user_data.keys():
-        try:
-            await context.bot.send_message(
-                chat_id=int(user_id),
-                text="مِن مغرب الخَميس إلى مغرب الجُمعة كُلّ ثانية فيها خزائن من الحسناتِ والرّحمات وتفريج الكُربات\nفليُكثر المرء من الصَّلاة على النَّبي ﷺ"
-            )
-            await context.bot.send_message(
-                chat_id=int(user_id),
-                text="﴿ إِنَّ اللَّهَ وَمَلائِكَتَهُ يُصَلّونَ عَلَى النَّبِيِّ يا أَيُّهَا الَّذينَ آمَنوا صَلّوا عَلَيهِ وَسَلِّموا تَسليمًا ﴾ [ الأحزاب : ٥٦ ]"
-            )
-            logger.info(f"Sent Thursday reminder and additional message to user {user_id}")
-        except Exception as e:
-            logger.error(f"Failed to send Thursday reminder to user {user_id}: {e}")
-
-# Helper function to convert Egypt time to UTC
-def egypt_time_to_utc(hour, minute=0, second=0):
-    # Create a datetime object for today with the specified time in Egypt timezone
-    now = datetime.now()
-    egypt_dt = EGYPT_TZ.localize(datetime(now.year, now.month, now.day, hour, minute, second))
-    # Convert to UTC
-    utc_dt = egypt_dt.astimezone(pytz.UTC)
-    # Return just the time component
-    return utc_dt.time()
-
-# Simple HTTP request handler for health checks
-class HealthCheckHandler(http.server.SimpleHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-        self.wfile.write(b'Bot is running')
-        
-    def log_message(self, format, *args):
-        # Suppress log messages
-        return
+    """Sends the scheduled Thursday reminder to the job's audience."""
+    await broadcast_messages(context, "send_global_thursday_reminder", THURSDAY_REMINDER_MESSAGES)
 
-# Start a simple HTTP server for health checks
-def start_health_check_server():
-    handler = HealthCheckHandler
-    try:
-        # Allow socket reuse to prevent "Address already in use" errors on restart
-        socketserver.TCPServer.allow_reuse_address = True
-        httpd = socketserver.TCPServer(("0.0.0.0", HEALTH_CHECK_PORT), handler)
-        logger.info(f"Starting health check server on port {HEALTH_CHECK_PORT}")
-        
+# Handler and job latency, labelled by callback name
+HANDLER_LATENCY = metrics.histogram('bot_handler_seconds', 'Update handler latency', ('handler',))
+HANDLER_ERRORS = metrics.counter('bot_handler_errors_total', 'Update handlers that raised', ('handler',))
+JOB_LATENCY = metrics.histogram('bot_job_seconds', 'Job callback latency', ('job',), buckets=metrics.JOB_BUCKETS)
+JOB_ERRORS = metrics.counter('bot_job_errors_total', 'Job callbacks that raised', ('job',))
+metrics.gauge('bot_registered_users', 'Users in the registry', lambda: user_registry.stats.total)
+metrics.gauge('bot_active_users', 'Users deliveries can reach', lambda: user_registry.stats.active)
+metrics.gauge('bot_unreachable_users', 'Users excluded from deliveries as unreachable',
+              lambda: {(reason,): count for reason, count in user_registry.stats.unreachable_counts().items()},
+              ('reason',))
+metrics.gauge('bot_service_subscribers', 'Users subscribed to a service',
+              lambda: {(service,): count for service, count in user_registry.stats.service_counts().items()},
+              ('service',))
+metrics.gauge('bot_users_joined_today', 'Users who joined today',
+              lambda: user_registry.stats.joined_since(datetime.now().strftime("%Y-%m-%d")))
+
+# Event loop lag above LOOP_LAG_THRESHOLD seconds is logged with the stack of the blocking code
+loop_monitor = LoopLagMonitor(threshold=float(os.environ.get("LOOP_LAG_THRESHOLD", 0.5)))
+metrics.gauge('event_loop_lag_p50_seconds', 'Median recent event loop lag', lambda: loop_monitor.percentiles()[0])
+metrics.gauge('event_loop_lag_p99_seconds', '99th percentile recent event loop lag', lambda: loop_monitor.percentiles()[1])
+
+# Wrap a handler callback to record its latency
+def timed_handler(callback):
+    return metrics.timed(HANDLER_LATENCY, HANDLER_ERRORS, handler=callback.__name__)(callback)
+
+# Wrap a job callback to record its latency
+def timed_job(callback, name=None):
+    return metrics.timed(JOB_LATENCY, JOB_ERRORS, job=name or callback.__name__)(callback)
+
+# HTTP server for health checks and, in webhook mode, incoming Telegram updates
+def build_http_server(application):
+    server = HTTPServer("0.0.0.0", HEALTH_CHECK_PORT)
+    
+    async def index(request):
+        return 200, 'text/html', 'Bot is running'
+    
+    # Liveness: the event loop still serves requests, with its recent lag
+    async def healthz(request):
+        p50, p99 = loop_monitor.percentiles()
+        return 200, 'text/plain', f'ok loop_lag_p50={p50:.4f}s loop_lag_p99={p99:.4f}s'
+    
+    # Readiness: users are loaded and updates are being processed
+    async def readyz(request):
+        if application.running and user_registry.loaded:
+            return 200, 'text/plain', 'ready'
+        return 503, 'text/plain', 'not ready'
+    
+    # Prometheus scrape endpoint
+    async def metrics_endpoint(request):
+        return 200, metrics.CONTENT_TYPE, metrics.REGISTRY.render()
+    
+    # Telegram webhook, only requests carrying our secret token are accepted
+    async def webhook(request):
+        token = request.headers.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(token.encode('latin-1'), WEBHOOK_SECRET.encode('latin-1')):
+            return 403, 'text/plain', 'Forbidden'
         try:
-            # Run the server with exception handling
-            httpd.serve_forever()
-        except Exception as e:
-            logger.error(f"Health check server error: {e}")
-        finally:
-            # Ensure server is properly closed if an exception occurs
-            httpd.server_close()
-            logger.info("Health check server closed")
-    except Exception as e:
-        logger.error(f"Failed to start health check server: {e}")
+            update = Update.de_json(json.loads(request.body), application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Rejected malformed webhook update: {e}")
+            return 400, 'text/plain', 'Bad Request'
+        await application.update_queue.put(update)
+        return 200, 'text/plain', 'ok'
+    
+    server.add_route('GET', '/', index)
+    server.add_route('GET', '/healthz', healthz)
+    server.add_route('GET', '/readyz', readyz)
+    server.add_route('GET', '/metrics', metrics_endpoint)
+    if UPDATE_MODE == "webhook":
+        server.add_route('POST', WEBHOOK_PATH, webhook)
+    return server
 
 # Admin command handler to get user count only
 async def get_users_count(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -334,86 +550,199 @@ async def get_users_count(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("هذا الأمر متاح فقط للمسؤول")
         return
         
-    user_data = load_user_data()
-    user_count = len(user_data)
+    # Every number comes from the running totals, nothing is counted here
+    stats = user_registry.stats.snapshot()
+    today = datetime.now()
+    joined_week = user_registry.stats.joined_since((today - timedelta(days=6)).strftime("%Y-%m-%d"))
+    service_names = {
+        QURAN_SERVICE: "القرآن",
+        PROPHET_PRAYER_SERVICE: "الصلاة على النبي",
+        DHIKR_SERVICE: "الأذكار",
+        NIGHT_PRAYER_SERVICE: "قيام الليل",
+    }
+    
+    message = f"عدد مستخدمي البوت الحاليين : {stats['total']}"
+    message += f"\nالمستخدمون النشطون : {stats['total'] - sum(stats['unreachable'].values())}"
+    if stats["unreachable"]:
+        reasons = {"blocked": "حظروا البوت", "deactivated": "حسابات محذوفة", "chat_not_found": "محادثات غير موجودة"}
+        message += f"\nلا يمكن الوصول إليهم : {sum(stats['unreachable'].values())}"
+        for reason, count in sorted(stats["unreachable"].items()):
+            message += f"\n- {reasons.get(reason, reason)} : {count}"
+    message += "\n\nالمشتركون في الخدمات :"
+    for service in SERVICE_COLUMNS:
+        message += f"\n- {service_names.get(service, service)} : {stats['services'].get(service, 0)}"
+    message += f"\n\nانضموا اليوم : {stats['joins'].get(today.strftime('%Y-%m-%d'), 0)}"
+    message += f"\nانضموا خلال آخر ٧ أيام : {joined_week}"
+    await update.message.reply_text(message)
 
-    # Send user count only
-    await update.message.reply_text(f"عدد مستخدمي البوت الحاليين : {user_count}")
+# One user's entry on a /users_info page
+def format_user_details(user_id, data):
+    username = data.get("username", "غير معروف")
+    # Names built from first and last name can be 128 characters long
+    if len(username) > USERS_INFO_USERNAME_LENGTH:
+        username = username[:USERS_INFO_USERNAME_LENGTH - 1] + "…"
+    joined_date = data.get("joined_date", "غير معروف")
+    
+    services = []
+    if data.get("services", {}).get(QURAN_SERVICE, False):
+        services.append("القرآن")
+    if data.get("services", {}).get(PROPHET_PRAYER_SERVICE, False):
+        services.append("الصلاة على النبي")
+    if data.get("services", {}).get(DHIKR_SERVICE, False):
+        services.append("الأذكار")
+    if data.get("services", {}).get(NIGHT_PRAYER_SERVICE, False):
+        services.append("قيام الليل")
+    
+    services_str = ", ".join(services) if services else "لا يوجد"
+    
+    # Format join date to show only the date part (remove time)
+    try:
+        date_only = joined_date.split(" ")[0] if " " in joined_date else joined_date
+    except:
+        date_only = joined_date
+    
+    return f"- اسم المستخدم: {username} ({user_id})\n- تاريخ الانضمام: {date_only}\n- الخدمات: {services_str}\n"
 
-# Admin command handler to get detailed user information
+# A /users_info page and its navigation keyboard, the buttons carry the cursor of the next or previous page
+def users_info_page(after=None, before=None):
+    position, users, total = user_registry.page(after=after, before=before, limit=USERS_INFO_PAGE_SIZE)
+    if not users:
+        return "لا يوجد مستخدمين مسجلين حالياً", None
+    
+    user_details = [format_user_details(user_id, data) for user_id, data in users]
+    text = f"معلومات المستخدمين ({position + 1}-{position + len(users)} من {total}):\n\n" + "\n".join(user_details)
+    
+    navigation = []
+    if position > 0:
+        navigation.append(InlineKeyboardButton("◀️ السابق", callback_data=f"{USERS_INFO}:prev:{users[0][0]}"))
+    if position + len(users) < total:
+        navigation.append(InlineKeyboardButton("التالي ▶️", callback_data=f"{USERS_INFO}:next:{users[-1][0]}"))
+    keyboard = [navigation] if navigation else []
+    keyboard.append([InlineKeyboardButton("📄 تصدير CSV", callback_data=f"{USERS_INFO}:csv")])
+    return text, InlineKeyboardMarkup(keyboard)
+
+# Rows of the users CSV export, produced one page of the registry at a time
+def users_csv_rows():
+    yield ["user_id", "username", "joined_date", *SERVICE_COLUMNS, "unreachable_reason", "unreachable_since"]
+    for user_id, data in user_registry.iter_users():
+        services = data.get("services", {})
+        unreachable = data.get("unreachable") or {}
+        yield [
+            user_id,
+            data.get("username", ""),
+            data.get("joined_date", ""),
+            *(int(bool(services.get(service))) for service in SERVICE_COLUMNS),
+            unreachable.get("reason", ""),
+            unreachable.get("since", ""),
+        ]
+
+# Stream the CSV rows into a temporary file, no full copy of the users is built in memory
+def write_users_csv():
+    file = tempfile.TemporaryFile()
+    # utf-8-sig so spreadsheet programs show the Arabic usernames correctly
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    csv.writer(text).writerows(users_csv_rows())
+    text.flush()
+    text.detach()
+    file.seek(0)
+    return file
+
+# Send all users as a CSV document
+async def send_users_csv(bot, chat_id):
+    file = await asyncio.to_thread(write_users_csv)
+    try:
+        await bot.send_document(
+            chat_id=chat_id,
+            document=file,
+            filename=f"users-{datetime.now(EGYPT_TZ):%Y%m%d-%H%M}.csv",
+            caption=f"عدد المستخدمين : {user_registry.stats.total}"
+        )
+    finally:
+        file.close()
+
+# Admin command handler to get detailed user information, "/users_info csv" exports all users
 async def get_users_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Check if the user is admin
     if update.effective_user.id != ADMIN_ID:
         await update.message.reply_text("هذا الأمر متاح فقط للمسؤول")
         return
-        
-    user_data = load_user_data()
     
-    # Get detailed user information with the requested format
-    user_details = []
-    for user_id, data in user_data.items():
-        username = data.get("username", "غير معروف")
-        joined_date = data.get("joined_date", "غير معروف")
-        
-        services = []
-        if data.get("services", {}).get(QURAN_SERVICE, False):
-            services.append("القرآن")
-        if data.get("services", {}).get(PROPHET_PRAYER_SERVICE, False):
-            services.append("الصلاة على النبي")
-        if data.get("services", {}).get(DHIKR_SERVICE, False):
-            services.append("الأذكار")
-        if data.get("services", {}).get(NIGHT_PRAYER_SERVICE, False):
-            services.append("قيام الليل")
-        
-        services_str = ", ".join(services) if services else "لا يوجد"
-        
-        # Format join date to show only the date part (remove time)
-        try:
-            date_only = joined_date.split(" ")[0] if " " in joined_date else joined_date
-        except:
-            date_only = joined_date
-            
-        user_details.append(f"- اسم المستخدم: {username} ({user_id})\n- تاريخ الانضمام: {date_only}\n- الخدمات: {services_str}\n")
+    if context.args and context.args[0].lower() == "csv":
+        await send_users_csv(context.bot, update.effective_chat.id)
+        return
     
-    # Send detailed user information
-    if user_details:
-        details_message = "معلومات المستخدمين:\n\n" + "\n".join(user_details)
-        await update.message.reply_text(details_message)
-    else:
-        await update.message.reply_text("لا يوجد مستخدمين مسجلين حالياً")
+    # Send the first page, the buttons page through the rest
+    text, reply_markup = users_info_page()
+    await update.message.reply_text(text, reply_markup=reply_markup)
 
-# Start command handler
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = str(update.effective_user.id)
+# Navigation and export buttons of /users_info pages
+async def users_info_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if update.effective_user.id != ADMIN_ID:
+        await query.answer("هذا الأمر متاح فقط للمسؤول")
+        return
+    await query.answer()
     
-    # Create services selection keyboard
+    _, action, *cursor = query.data.split(":", 2)
+    if action == "csv":
+        await send_users_csv(context.bot, update.effective_chat.id)
+        return
+    
+    cursor = cursor[0] if cursor else None
+    text, reply_markup = users_info_page(after=cursor if action == "next" else None,
+                                         before=cursor if action == "prev" else None)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+# Copy of a user's subscription flags, the starting point of a selection.
+# A user missing from the registry, e.g. in a restored conversation, starts with nothing selected
+def registered_services(user_id):
+    user = user_registry.get(user_id)
+    services = user["services"] if user is not None else {}
+    return {service: bool(services.get(service)) for service in SERVICE_COLUMNS}
+
+# Services selection keyboard, selected services are marked with ✅
+def services_keyboard(services):
     keyboard = [
         [
-            InlineKeyboardButton("القرآن الكريم", callback_data=QURAN_SERVICE),
+            InlineKeyboardButton(
+                " ✅ القرآن الكريم" if services.get(QURAN_SERVICE) else "القرآن الكريم", 
+                callback_data=QURAN_SERVICE
+            ),
         ],
         [
-            InlineKeyboardButton("الصلاة على النبي", callback_data=PROPHET_PRAYER_SERVICE),
+            InlineKeyboardButton(
+                " ✅ الصلاة على النبي" if services.get(PROPHET_PRAYER_SERVICE) else "الصلاة على النبي", 
+                callback_data=PROPHET_PRAYER_SERVICE
+            ),
         ],
         [
-            InlineKeyboardButton("الأدعية وذكر الله", callback_data=DHIKR_SERVICE),
+            InlineKeyboardButton(
+                " ✅ الأدعية وذكر الله" if services.get(DHIKR_SERVICE) else "الأدعية وذكر الله", 
+                callback_data=DHIKR_SERVICE
+            ),
         ],
         [
-            InlineKeyboardButton("قيام الليل", callback_data=NIGHT_PRAYER_SERVICE),
+            InlineKeyboardButton(
+                " ✅ قيام الليل" if services.get(NIGHT_PRAYER_SERVICE) else "قيام الليل", 
+                callback_data=NIGHT_PRAYER_SERVICE
+            ),
         ],
         [
             InlineKeyboardButton("🔵 تأكيد الاختيارات 🔵", callback_data=CONFIRM),
         ],
     ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return InlineKeyboardMarkup(keyboard)
+
+# Start command handler
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    user_id = str(update.effective_user.id)
     
     # Initialize user data if not exists
-    user_data = load_user_data()
     user_info = update.effective_user
     username = user_info.username if user_info.username else f"{user_info.first_name} {user_info.last_name if user_info.last_name else ''}".strip()
     
-    if user_id not in user_data:
-        user_data[user_id] = {
+    if user_id not in user_registry:
+        user_registry.add_user(user_id, {
             "username": username, # Store username
             "services": {
                 QURAN_SERVICE: False,
@@ -422,29 +751,25 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                 NIGHT_PRAYER_SERVICE: False
             },
             "joined_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-        save_user_data(user_data)
+        })
     # Update username if user already exists but username might have changed
-    elif user_data[user_id].get("username") != username:
-        user_data[user_id]["username"] = username
-        save_user_data(user_data)
+    else:
+        user_registry.set_username(user_id, username)
+    
+    # Selections stay in the session until they are confirmed, toggling never touches storage
+    selected_services = registered_services(user_id)
+    context.user_data[SELECTED_SERVICES_KEY] = selected_services
+    
     # Initialize quran tracker if not exists
-    quran_tracker = sheets.get_quran_tracking()  # from Google Sheets
+    quran_tracker = await load_quran_tracker(user_id)
     if user_id not in quran_tracker:
-        quran_tracker[user_id] = {
-            "last_page": 0,
-            "total_pages_read": 0,
-            "unread_pages": [],  # Track unread pages
-            "last_read_confirmed": True,  # Track if last reading was confirmed
-            "last_reminder_message_id": None, # Track confirmation message ID
-            "last_wird_reminder_message_id": None # Track the 'متنساش' reminder message ID
-        }
-        sheets.update_quran_tracking(quran_tracker)
+        quran_tracker[user_id] = new_quran_tracking()
+        await save_quran_tracker(quran_tracker)
     
     await update.message.reply_text(
         "مرحباً بك في بوت \"اذكر الله\"!\n\n"
         "يرجى اختيار الخدمات التي ترغب في الاشتراك بها:",
-        reply_markup=reply_markup
+        reply_markup=services_keyboard(selected_services)
     )
     
     return SELECTING_SERVICES
@@ -457,19 +782,22 @@ async def service_selection(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = str(query.from_user.id)
     callback_data = query.data
     
-    # Load user data
-    user_data = load_user_data()
+    # Selections of this conversation, a conversation restored without them starts from the registry
+    services = context.user_data.get(SELECTED_SERVICES_KEY)
+    if services is None:
+        services = registered_services(user_id)
+        context.user_data[SELECTED_SERVICES_KEY] = services
     
     # Handle confirmation
     if callback_data == CONFIRM:
         selected_services = []
-        if user_data[user_id]["services"][QURAN_SERVICE]:
+        if services[QURAN_SERVICE]:
             selected_services.append("القرآن الكريم")
-        if user_data[user_id]["services"][PROPHET_PRAYER_SERVICE]:
+        if services[PROPHET_PRAYER_SERVICE]:
             selected_services.append("الصلاة على النبي")
-        if user_data[user_id]["services"][DHIKR_SERVICE]:
+        if services[DHIKR_SERVICE]:
             selected_services.append("الأدعية وذكر الله")
-        if user_data[user_id]["services"][NIGHT_PRAYER_SERVICE]:
+        if services[NIGHT_PRAYER_SERVICE]:
             selected_services.append("قيام الليل")
         
         if not selected_services:
@@ -479,29 +807,33 @@ async def service_selection(update: Update, context: ContextTypes.DEFAULT_TYPE)
             )
             return SELECTING_SERVICES
         
+        # The only write of the whole selection, flushed by the registry in the background
+        saved = user_registry.set_services(user_id, services)
+        context.user_data.pop(SELECTED_SERVICES_KEY, None)
+        if saved is None:
+            # Unknown user, /start registers them again
+            await query.edit_message_text("تعذر حفظ اختياراتك، يرجى إرسال /start للبدء من جديد.")
+            return ConversationHandler.END
+        
         try:
             # First confirmation message - IMMEDIATELY CONFIRM to user
             await query.edit_message_text("تم تأكيد اختياراتك بنجاح!")
             
-            # Save to Google Sheets in background thread
-            save_user_data(user_data)
-            
-            # Schedule jobs in background task
-            asyncio.create_task(schedule_jobs_background(context, user_id))
+            # No per-user jobs: the delivery slots resolve subscribers from the registry when they fire
             
             # Create second message with service timings
             schedule_text = "مواعيد التذكيرات:\n\n"
             
-            if user_data[user_id]["services"][QURAN_SERVICE]:
+            if services[QURAN_SERVICE]:
                 schedule_text += "1- خدمة القرآن الكريم: يومياً الساعة 12:00 ظهراً\n\n"
             
-            if user_data[user_id]["services"][PROPHET_PRAYER_SERVICE]:
+            if services[PROPHET_PRAYER_SERVICE]:
                 schedule_text += "2- خدمة الصلاة على النبي: كل ساعة بداية من الساعة 12:15 ظهراً\n\n"
             
-            if user_data[user_id]["services"][DHIKR_SERVICE]:
+            if services[DHIKR_SERVICE]:
                 schedule_text += "3- خدمة الأدعية وذكر الله: في مواعيد متفرقه\n\n"
 
-            if user_data[user_id]["services"][NIGHT_PRAYER_SERVICE]:
+            if services[NIGHT_PRAYER_SERVICE]:
                 schedule_text += "4- خدمة قيام الليل: يومياً الساعة 12:00 منتصف الليل\n\n"
             
             schedule_text += "شكراً لاختيارك بوت \"اذكر الله\". ستبدأ في تلقي التذكيرات حسب المواعيد المذكورة أعلاه."
@@ -521,46 +853,13 @@ async def service_selection(update: Update, context: ContextTypes.DEFAULT_TYPE)
             )
             return SELECTING_SERVICES
     
-    # Toggle service selection
-    if callback_data in user_data[user_id]["services"]:
-        user_data[user_id]["services"][callback_data] = not user_data[user_id]["services"][callback_data]
-        
-        # Update keyboard with selected services
-        keyboard = [
-            [
-                InlineKeyboardButton(
-                    " ✅ القرآن الكريم" if user_data[user_id]["services"][QURAN_SERVICE] else "القرآن الكريم", 
-                    callback_data=QURAN_SERVICE
-                ),
-            ],
-            [
-                InlineKeyboardButton(
-                    " ✅ الصلاة على النبي" if user_data[user_id]["services"][PROPHET_PRAYER_SERVICE] else "الصلاة على النبي", 
-                    callback_data=PROPHET_PRAYER_SERVICE
-                ),
-            ],
-            [
-                InlineKeyboardButton(
-                    " ✅ الأدعية وذكر الله" if user_data[user_id]["services"][DHIKR_SERVICE] else "الأدعية وذكر الله", 
-                    callback_data=DHIKR_SERVICE
-                ),
-            ],
-            [
-                InlineKeyboardButton(
-                    " ✅ قيام الليل" if user_data[user_id]["services"][NIGHT_PRAYER_SERVICE] else "قيام الليل", 
-                    callback_data=NIGHT_PRAYER_SERVICE
-                ),
-            ],
-            [
-                InlineKeyboardButton("🔵 تأكيد الاختيارات 🔵", callback_data=CONFIRM),
-            ],
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    # Toggle service selection, only the session state changes until confirmation
+    if callback_data in services:
+        services[callback_data] = not services[callback_data]
         
         await query.edit_message_text(
             "يرجى اختيار الخدمات التي ترغب في الاشتراك بها:",
-            reply_markup=reply_markup
+            reply_markup=services_keyboard(services)
         )
     
     return SELECTING_SERVICES
@@ -582,8 +881,7 @@ async def return_to_wird_callback(update: Update, context: ContextTypes.DEFAULT_
     except Exception as e:
         logger.info(f"Could not delete original message {original_message_id} for user {user_id} in return_to_wird_callback: {e}")
 
-    quran_tracker = sheets.get_quran_tracking()  # from Google Sheets
-    quran_links = load_quran_image_links()
+    quran_tracker = await load_quran_tracker(user_id)
 
     if user_id not in quran_tracker:
         await context.bot.send_message(chat_id=chat_id, text="عذراً، لم يتم العثور على بيانات التتبع الخاصة بك.")
@@ -600,19 +898,8 @@ async def return_to_wird_callback(update: Update, context: ContextTypes.DEFAULT_
         text="إليك الورد الذي لم تقرأه بعد:" # Message indicating re-sending
     )
 
-    for page_num in unread_pages: # Iterate through all unread pages
-        page_num_str = str(page_num)
-        if page_num_str in quran_links:
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=quran_links[page_num_str],
-                caption=f"صفحة {page_num}"
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=f"عذراً، لم يتم العثور على رابط لصفحة {page_num}."
-            )
+    # Send all unread pages as albums
+    await send_quran_pages(context.bot, chat_id, unread_pages)
     
     # Ask if user read the pages
     read_keyboard = [
@@ -630,174 +917,79 @@ async def return_to_wird_callback(update: Update, context: ContextTypes.DEFAULT_
     
     # Save confirmation message ID for later deletion in confirm_reading
     quran_tracker[user_id]["last_reminder_message_id"] = confirmation_message.message_id
-    sheets.update_quran_tracking(quran_tracker)
+    await save_quran_tracker(quran_tracker)
 
-# New background task for scheduling jobs
-async def schedule_jobs_background(context: ContextTypes.DEFAULT_TYPE, user_id: str):
-    """Schedule jobs in a background task to avoid blocking the main thread"""
-    try:
-        # Load user data
-        user_data = load_user_data()
-        
-        # Check if job_queue exists
-        if not hasattr(context, 'job_queue') or context.job_queue is None:
-            logger.error("Job queue is not available in context")
-            raise ValueError("Job queue is not initialized. Please restart the bot.")
-        
-        # Remove existing jobs for this user
-        current_jobs = context.job_queue.get_jobs_by_name(user_id)
-        if current_jobs:
-            for job in current_jobs:
-                job.schedule_removal()
-        
-        # Notify user that scheduling is in progress
-        await context.bot.send_message(
-            chat_id=int(user_id),
-            text="جاري جدولة التذكيرات..."
-        )
-        
-        # Schedule Quran service (daily at 12:00 PM Egypt time)
-        if user_data[user_id]["services"][QURAN_SERVICE]:
-            # Convert to UTC for job queue
-            utc_time = egypt_time_to_utc(12, 0)  # 12:00 PM Egypt time
-            
-            context.job_queue.run_daily(
-                send_quran_reminder,
-                time=utc_time,
-                chat_id=int(user_id),
-                name=f"{user_id}_quran",
-                data=user_id
-            )
-        
-        # Schedule Prophet prayer service (hourly starting at 12:15 PM Egypt time)
-        if user_data[user_id]["services"][PROPHET_PRAYER_SERVICE]:
-            # First reminder at 12:15 PM Egypt time
-            utc_time = egypt_time_to_utc(12, 15)  # 12:15 PM Egypt time
-            
-            # Schedule hourly job
-            context.job_queue.run_daily(
-                send_prophet_prayer,
-                time=utc_time,
-                chat_id=int(user_id),
-                name=f"{user_id}_prophet_first",
-                data=user_id
-            )
-            
-            # Schedule remaining hourly reminders
-            now = datetime.now()
-            egypt_dt = EGYPT_TZ.localize(datetime(now.year, now.month, now.day, 12, 15))
-            
-            for hour in range(1, 24):
-                next_dt = egypt_dt + timedelta(hours=hour)
-                next_utc_time = next_dt.astimezone(pytz.UTC).time()
-                
-                context.job_queue.run_daily(
-                    send_prophet_prayer,
-                    time=next_utc_time,
-                    chat_id=int(user_id),
-                    name=f"{user_id}_prophet_{hour}",
-                    data=user_id
-                )
-        
-        # Schedule Dhikr service
-        if user_data[user_id]["services"][DHIKR_SERVICE]:
-            # Daily at 4:30 PM Egypt time
-            utc_time_430pm = egypt_time_to_utc(16, 30)  # 4:30 PM Egypt time
-            
-            context.job_queue.run_daily(
-                send_daily_dhikr,
-                time=utc_time_430pm,
-                chat_id=int(user_id),
-                name=f"{user_id}_daily_dhikr",
-                data=user_id
-            )
-            
-            # Every 12 hours starting at 12:00 PM Egypt time
-            utc_time_1145am = egypt_time_to_utc(11, 45)  # 11:45 AM Egypt time
-            
-            context.job_queue.run_daily(
-                send_12hour_dhikr,
-                time=utc_time_1145am,
-                chat_id=int(user_id),
-                name=f"{user_id}_12hour_dhikr_noon",
-                data=user_id
-            )
-            
-            # 12 hours later (11:45 PM)
-            utc_time_1145pm = egypt_time_to_utc(23, 45)  # 11:45 PM Egypt time
-            
-            context.job_queue.run_daily(
-                send_12hour_dhikr,
-                time=utc_time_1145pm,
-                chat_id=int(user_id),
-                name=f"{user_id}_12hour_dhikr_midnight",
-                data=user_id
-            )
-            
-            # Thursday Dhikr (now global) - REMOVED FROM HERE
-            
-            # Saturday Dhikr (now global) - REMOVED FROM HERE
-
-            # Schedule Dua message for Dhikr service users
-            # Tue, Thu, Sat at 4:30:10 PM Egypt time
-            utc_time_dhikr_dua = egypt_time_to_utc(16, 30, 10)
-            dhikr_dua_days = (1, 3, 5) # Tuesday, Thursday, Saturday
-
-            context.job_queue.run_daily(
-                send_dua_message, # Reusing the existing global send_dua_message function
-                time=utc_time_dhikr_dua,
-                days=dhikr_dua_days,
-                chat_id=int(user_id), # Specific to this user
-                name=f"{user_id}_dhikr_dua_schedule"
-            )
-            logger.info(f"Scheduled Dhikr Dua message for user {user_id} on Tue, Thu, Sat at 16:30:10 Egypt time.")
-
-            # Schedule Ayah message for Dhikr service users
-            # Tue, Thu, Sat at 4:30:15 PM Egypt time
-            utc_time_dhikr_ayah = egypt_time_to_utc(16, 30, 15)
-            dhikr_ayah_days = (1, 3, 5) # Tuesday, Thursday, Saturday
-
-            context.job_queue.run_daily(
-                send_ayah_message, # Reusing the existing global send_ayah_message function
-                time=utc_time_dhikr_ayah,
-                days=dhikr_ayah_days,
-                chat_id=int(user_id), # Specific to this user
-                name=f"{user_id}_dhikr_ayah_schedule"
-            )
-            logger.info(f"Scheduled Dhikr Ayah message for user {user_id} on Tue, Thu, Sat at 16:30:15 Egypt time.")    
-        # Schedule Night prayer service (daily at 12:00 AM Egypt time)
-        if user_data[user_id]["services"][NIGHT_PRAYER_SERVICE]:
-            # Convert to UTC for job queue
-            utc_time = egypt_time_to_utc(0, 0)  # 12:00 AM Egypt time
-            
-            context.job_queue.run_daily(
-                send_night_prayer,
-                time=utc_time,
-                chat_id=int(user_id),
-                name=f"{user_id}_night_prayer",
-                data=user_id
-            )
-        
-        logger.info(f"Successfully scheduled all jobs for user {user_id} in background")
-    except Exception as e:
-        logger.error(f"Error in background job scheduling for user {user_id}: {e}")
-
-# Schedule jobs based on user's selected services - KEPT FOR COMPATIBILITY
-async def schedule_jobs(context: ContextTypes.DEFAULT_TYPE, user_id: str):
-    # Create a background task to handle the scheduling
-    asyncio.create_task(schedule_jobs_background(context, user_id))
+# Next 5 pages after the last page sent, starting over after the last page of the Quran
+def next_wird_pages(last_page):
+    start_page = last_page + 1
+    end_page = start_page + 4  # Send 5 pages
+    
+    # Cap at 604 (total Quran pages)
+    if start_page > TOTAL_QURAN_PAGES:
+        start_page = 1
+    if end_page > TOTAL_QURAN_PAGES:
+        end_page = TOTAL_QURAN_PAGES
+    return start_page, end_page
 
-# Quran reminder handler - MODIFIED to send 5 pages and add reading confirmation
+# Quran reminder slot - the daily wird batch, runs once for all Quran subscribers
 async def send_quran_reminder(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job
-    chat_id = job.chat_id
-    user_id = job.data
+    user_ids = resolve_audience(context.job.data["audience"])
+    if not user_ids:
+        logger.info("No users found in audience for send_quran_reminder.")
+        return
     
-    # Load quran tracker
-    quran_tracker = sheets.get_quran_tracking()  # from Google Sheets
+    # One bulk read of everyone's tracking state instead of one per subscriber
+    rows = await storage_thread_call(storage.get_all_quran_tracking)
+    if rows is None:
+        # Never send with guessed positions, that would skip or repeat pages
+        logger.error("Could not read Quran tracking, skipping the daily wird run")
+        return
+    
+    # Work out every subscriber's pages in one pass before sending anything
+    quran_tracker = {}
+    wird_pages = {}
+    for user_id in user_ids:
+        row = rows.get(user_id)
+        tracking = quran_tracking_from_row(row) if row else new_quran_tracking()
+        quran_tracker[user_id] = tracking
+        if not tracking["unread_pages"]:
+            start_page, end_page = next_wird_pages(tracking["last_page"])
+            wird_pages[user_id] = list(range(start_page, end_page + 1))
+    logger.info(f"Daily wird: {len(wird_pages)} users get new pages, {len(user_ids) - len(wird_pages)} have unread pages")
+    
+    changed = {}
+    
+    async def deliver(chat_id, report):
+        user_id = str(chat_id)
+        if await deliver_quran_wird(context, chat_id, quran_tracker[user_id], wird_pages.get(user_id), report):
+            changed[user_id] = quran_tracker[user_id]
+    
+    async def send(chat_ids, on_done):
+        await broadcast_engine.run("send_quran_reminder", chat_ids, deliver, on_done=on_done)
+    
+    # New positions are saved in batches before the users are marked served, a resumed run
+    # recomputes the pages of everyone else from what is stored
+    async def save_tracking(user_ids):
+        saved = [user_id for user_id in user_ids if user_id in changed]
+        if not saved:
+            return True
+        rows_to_write = [quran_tracking_to_row(user_id, changed[user_id]) for user_id in saved]
+        if not await storage_call(storage.batch_update_quran_tracking, rows_to_write):
+            # Kept for the next checkpoint, which retries them together with its own users
+            return False
+        for user_id in saved:
+            changed.pop(user_id, None)
+        return True
+    
+    await run_with_outbox(context, "send_quran_reminder", user_ids, send, before_checkpoint=save_tracking)
+
+# Send the daily wird to a single user - MODIFIED to send 5 pages and add reading confirmation
+# Updates tracking in place, returns True if it changed and has to be saved
+async def deliver_quran_wird(context: ContextTypes.DEFAULT_TYPE, chat_id, tracking, pages_to_send, report=None):
+    bot = context.bot
     
     # Check if user has unread pages
-    if quran_tracker[user_id]["unread_pages"]:
+    if not pages_to_send:
         # Create the button
         keyboard = [
             [
@@ -805,56 +997,33 @@ async def send_quran_reminder(context: ContextTypes.DEFAULT_TYPE):
             ]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await context.bot.send_message(
+        await broadcast_engine.call(
+            bot.send_message,
             chat_id=chat_id,
             text="🔴 لديك صفحات لم تقرأها بعد. يرجى قراءتها أولاً.",
-            reply_markup=reply_markup
+            reply_markup=reply_markup,
+            report=report
         )
-        return
-    
-    # Get user's last page
-    last_page = quran_tracker[user_id]["last_page"]
-    
-    # Determine pages to send (5 pages)
-    start_page = last_page + 1
-    end_page = start_page + 4  # Send 5 pages
+        return False
     
-    # Cap at 604 (total Quran pages)
-    if start_page > 604:
-        start_page = 1
-    if end_page > 604:
-        end_page = 604
+    start_page, end_page = pages_to_send[0], pages_to_send[-1]
     
     # Send initial message
-    await context.bot.send_message(
+    await broadcast_engine.call(
+        bot.send_message,
         chat_id=chat_id,
-        text=f"🔵 إليك ورد اليوم من القرآن الكريم ( من {start_page} إلى {end_page} ) :"
+        text=f"🔵 إليك ورد اليوم من القرآن الكريم ( من {start_page} إلى {end_page} ) :",
+        report=report
     )
     
     # Send pages
-    quran_links = load_quran_image_links()
-    pages_to_send = list(range(start_page, end_page + 1))
-    
-    for page_num in pages_to_send:
-        page_num_str = str(page_num)
-        if page_num_str in quran_links:
-            await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=quran_links[page_num_str],
-                caption=f"صفحة {page_num}"
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=f"عذراً، لم يتم العثور على رابط لصفحة {page_num}."
-            )
+    await send_quran_pages(bot, chat_id, pages_to_send, report=report, rate_limited=True)
     
     # Update quran tracker
-    quran_tracker[user_id]["last_page"] = end_page
-    quran_tracker[user_id]["unread_pages"] = pages_to_send
-    quran_tracker[user_id]["last_read_confirmed"] = False
-    quran_tracker[user_id]["total_pages_read"] += len(pages_to_send)
-    sheets.update_quran_tracking(quran_tracker)
+    tracking["last_page"] = end_page
+    tracking["unread_pages"] = pages_to_send
+    tracking["last_read_confirmed"] = False
+    tracking["total_pages_read"] += len(pages_to_send)
     
     # Ask if user read the pages
     read_keyboard = [
@@ -864,46 +1033,44 @@ async def send_quran_reminder(context: ContextTypes.DEFAULT_TYPE):
     ]
     read_reply_markup = InlineKeyboardMarkup(read_keyboard)
     
-    message = await context.bot.send_message(
-        chat_id=chat_id,
-        text="هل قرأت الوِرد؟",
-        reply_markup=read_reply_markup
-    )
-    
-    # Save message ID for later reference
-    quran_tracker[user_id]["last_reminder_message_id"] = message.message_id
-    sheets.update_quran_tracking(quran_tracker)
-    
-    # Schedule reminder at 11:50 PM Egypt time if not confirmed
-    now_egypt = datetime.now(EGYPT_TZ)
-    # Create the specific datetime for 11:50 PM today in Egypt timezone
-    reminder_dt_egypt = now_egypt.replace(hour=23, minute=50, second=0, microsecond=0)
-
-    # Convert the reminder datetime to UTC for the job queue
-    reminder_dt_utc = reminder_dt_egypt.astimezone(pytz.utc)
-
-    # Ensure the reminder time is in the future relative to the current UTC time
-    # This prevents scheduling reminders for the past if the main job runs late or if it's already past 11:50 PM Egypt time
-    if reminder_dt_utc > datetime.now(pytz.utc):
-        context.job_queue.run_once(
-            send_reading_reminder,
-            reminder_dt_utc, # Use the specific datetime object
+    try:
+        message = await broadcast_engine.call(
+            bot.send_message,
             chat_id=chat_id,
-            name=f"{user_id}_reading_reminder_{now_egypt.date()}", # Add date to name for uniqueness
-            data=user_id
+            text="هل قرأت الوِرد؟",
+            reply_markup=read_reply_markup,
+            report=report
         )
+        # Save message ID for later reference
+        tracking["last_reminder_message_id"] = message.message_id
+    except Exception as e:
+        # The pages went out, the new position still has to be saved
+        logger.error(f"Failed to send wird confirmation to user {chat_id}: {e}")
+    
+    # The 11:50 PM reminder is its own slot, see send_reading_reminder
+    return True
 
-# Reading reminder handler
+# Reading reminder slot - reminds Quran subscribers who did not confirm their wird
 async def send_reading_reminder(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job
-    chat_id = job.chat_id
-    user_id = job.data
+    user_ids = resolve_audience(context.job.data["audience"])
+    
+    async def deliver(chat_id, report):
+        await deliver_reading_reminder(context, chat_id, report)
+    
+    async def send(chat_ids, on_done):
+        await broadcast_engine.run("send_reading_reminder", chat_ids, deliver, on_done=on_done)
+    
+    await run_with_outbox(context, "send_reading_reminder", user_ids, send)
+
+# Reading reminder for a single user
+async def deliver_reading_reminder(context: ContextTypes.DEFAULT_TYPE, chat_id, report=None):
+    user_id = str(chat_id)
     
     # Load quran tracker
-    quran_tracker = sheets.get_quran_tracking()  # from Google Sheets
+    quran_tracker = await load_quran_tracker(user_id)
     
     # Check if reading was confirmed
-    if not quran_tracker[user_id]["last_read_confirmed"]:
+    if user_id in quran_tracker and not quran_tracker[user_id]["last_read_confirmed"]:
         # Create the button
         keyboard = [
             [
@@ -913,14 +1080,16 @@ async def send_reading_reminder(context: ContextTypes.DEFAULT_TYPE):
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         # Send the reminder message with the button
-        message = await context.bot.send_message(
+        message = await broadcast_engine.call(
+            context.bot.send_message,
             chat_id=chat_id,
             text="🔴 متنساش تقرأ الوِرد",
-            reply_markup=reply_markup
+            reply_markup=reply_markup,
+            report=report
         )
         # Store the message ID
         quran_tracker[user_id]["last_wird_reminder_message_id"] = message.message_id
-        sheets.update_quran_tracking(quran_tracker)
+        await save_quran_tracker(quran_tracker)
 
 # Reading confirmation handler
 async def confirm_reading(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -930,7 +1099,8 @@ async def confirm_reading(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(query.from_user.id)
     
     # Load quran tracker
-    quran_tracker = sheets.get_quran_tracking()  # from Google Sheets
+    quran_tracker = await load_quran_tracker(user_id)
+    quran_tracker.setdefault(user_id, new_quran_tracking())
     
     # Mark reading as confirmed
     quran_tracker[user_id]["last_read_confirmed"] = True
@@ -946,7 +1116,7 @@ async def confirm_reading(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Reset the ID after attempting deletion
         quran_tracker[user_id]["last_wird_reminder_message_id"] = None
         
-    sheets.update_quran_tracking(quran_tracker)
+    await save_quran_tracker(quran_tracker)
     
     # Delete the confirmation message ("هل قرأت الورد؟")
     await query.delete_message()
@@ -981,36 +1151,17 @@ async def more_quran_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = str(query.from_user.id)
     
     # Get user's last page
-    quran_tracker = sheets.get_quran_tracking()  # from Google Sheets
+    quran_tracker = await load_quran_tracker(user_id)
+    quran_tracker.setdefault(user_id, new_quran_tracking())
     last_page = quran_tracker[user_id]["last_page"]
     
     # Determine pages to send (5 more pages)
-    start_page = last_page + 1
-    end_page = start_page + 4  # Send 5 pages
-    
-    # Cap at 604 (total Quran pages)
-    if start_page > 604:
-        start_page = 1
-    if end_page > 604:
-        end_page = 604
+    start_page, end_page = next_wird_pages(last_page)
     
     await query.edit_message_text("جاري إرسال المزيد من الصفحات...")
     
     # Send pages
-    quran_links = load_quran_image_links()
-    for page_num in range(start_page, end_page + 1):
-        page_num_str = str(page_num)
-        if page_num_str in quran_links:
-            await context.bot.send_photo(
-                chat_id=query.message.chat_id,
-                photo=quran_links[page_num_str],
-                caption=f"صفحة {page_num}"
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=f"عذراً، لم يتم العثور على رابط لصفحة {page_num}."
-            )
+    await send_quran_pages(context.bot, query.message.chat_id, list(range(start_page, end_page + 1)))
     
     # Update quran tracker
     quran_tracker[user_id]["last_page"] = end_page
@@ -1019,7 +1170,7 @@ async def more_quran_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     # Add these pages to unread pages
     new_pages = list(range(start_page, end_page + 1))
     quran_tracker[user_id]["unread_pages"].extend(new_pages)
-    sheets.update_quran_tracking(quran_tracker)
+    await save_quran_tracker(quran_tracker)
     
     # Ask if user read the pages
     read_keyboard = [
@@ -1037,7 +1188,7 @@ async def more_quran_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     # Save message ID for later reference
     quran_tracker[user_id]["last_reminder_message_id"] = message.message_id
-    sheets.update_quran_tracking(quran_tracker)
+    await save_quran_tracker(quran_tracker)
 
 # No more Quran handler
 async def no_more_quran_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1045,115 +1196,156 @@ async def no_more_quran_callback(update: Update, context: ContextTypes.DEFAULT_T
     await query.answer()
     await query.edit_message_text("حسناً، سنرسل لك المزيد غداً إن شاء الله.")
 
-# Prophet prayer handler
+PROPHET_PRAYER_MESSAGES = [
+    "🟢 اللهم صلِ وسلم و زِد و بارك علي سيدنا محمد وعلي آله و صحبه اچمعين"
+]
+DAILY_DHIKR_MESSAGES = [
+    "🟡 ادعيه و ذكر اللّه :",
+    "لا حول ولا قوة إلا باللًٰه العليّ العظيم",
+    "سبحان الله عدد خلقه و رضا نفسه و زنه عرشه و مداد كلماته",
+    "استغفر الله العظيم الذي لا اله إلا هو الحي القيوم واتوب إليه",
+    "لا اله الا الله وحده لا شريك له ، له الملك وله الحمد وهو علي كل شئ قدير",
+    "اللهم اغفر للمؤمنين و المؤمنات , المسلمين و المسلمات الاحياء منهم والاموات",
+    "اللهم أنت ربي لا إله إلا أنت ، خلقتني وأنا عبدك وأنا على عهدك و وعدك ما استطعت ، أعوذ بك من شر ما صنعت ، أبوء لك بنعمتك عليّْ ، وأبوء بذنبي فاغفر لي فإنه لا يغفر الذنوب إلا أنت",
+    "آيه الكرسي : \n« ٱللَّهُ لَاۤ إِلَـٰهَ إِلَّا هُوَ ٱلۡحَیُّ ٱلۡقَيُّومُۚ لَا تَأۡخُذُهُۥ سِنَةࣱ وَلَا نَوۡمࣱۚ لَّهُۥ مَا فِی ٱلسَّمَـٰوَ ٰتِ وَمَا فِی ٱلۡأَرۡضِۗ مَن ذَا ٱلَّذِی يَشۡفَعُ عِندَهُۥۤ إِلَّا بِإِذۡنِهِۦۚ يَعۡلَمُ مَا بَيۡنَ أَيۡدِيهِمۡ وَمَا خَلۡفَهُمۡۖ وَلَا يُحِيطُونَ بِشَیۡءࣲ مِّنۡ عِلۡمِهِۦۤ إِلَّا بِمَا شَاۤءَۚ وَسِعَ كُرۡسِيُّهُ ٱلسَّمَـٰوَ ٰتِ وَٱلۡأَرۡضَۖ وَلَا يَـُٔودُهُۥ حِفۡظُهُمَاۚ وَهُوَ ٱلۡعَلِیُّ ٱلۡعَظِيمُ »",
+    "اللهم إني أسألك من الخير كله : عاجله وآجله ، ما علمت منه وما لم أعلم ، وأعوذ بك من الشر كله عاجله وآجله ، ما علمت منه وما لم أعلم. اللهم إني أسألك من خير ما سألك عبدك ونبيك ، وأعوذ بك من شر ما استعاذ بك عبدك ونبيك. اللهم إني أسألك الجنة ، وما قرب إليها من قول أو عمل ، وأعوذ بك من النار ، وما قرب إليها من قول أو عمل ، وأسألك أن تجعل كل قضاء قضيته لي خيرا."
+]
+TWELVE_HOUR_DHIKR_MESSAGES = [
+    " 🟡 بسم الله الذي لايضر مع اسمه شئ في الارض ولا في السماء وهو السميع العليم '' ثلاث مرات '' "
+]
+NIGHT_PRAYER_MESSAGES = [
+    " 🟤 تذكير قيام الليل : ",
+    "وإن لم تستطع فا قرائه اخر آيتان من سوره البقره كفتاه :",
+    "بسم الله الرحمن الرحيم ﴿ آمَنَ الرَّسُولُ بِمَا أُنْزِلَ إِلَيْهِ مِنْ رَبِّهِ وَالْمُؤْمِنُونَ ۚ كُلٌّ آمَنَ بِاللَّهِ وَمَلَائِكَتِهِ وَكُتُبِهِ وَرُسُلِهِ لَا نُفَرِّقُ بَيْنَ أَحَدٍ مِنْ رُسُلِهِ ۚ وَقَالُوا سَمِعْنَا وَأَطَعْنَا ۖ غُفْرَانَكَ رَبَّنَا وَإِلَيْكَ الْمَصِيرُ ( ٢٨٥ ) لَا يُكَلِّفُ اللَّهُ نَفْسًا إِلَّا وُسْعَهَا لَهَا مَا كَسَبَتْ وَعَلَيْهَا مَا اكْتَسَبَتْ رَبَّنَا لَا تُؤَاخِذْنَا إِنْ نَسِينَا أَوْ أَخْطَأْنَا رَبَّنَا وَلَا تَحْمِلْ عَلَيْنَا إِصْرًا كَمَا حَمَلْتَهُ عَلَى الَّذِينَ مِنْ قَبْلِنَا رَبَّنَا وَلَا تُحَمِّلْنَا مَا لَا طَاقَةَ لَنَا بِهِ وَاعْفُ عَنَّا وَاغْفِرْ لَنَا وَارْحَمْنَا أَنْتَ مَوْلَانَا فَانْصُرْنَا عَلَى الْقَوْمِ الْكَافِرِينَ ( ٢٨٦ ) ﴾"
+]
+
+# Prophet prayer slot
 async def send_prophet_prayer(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job
-    chat_id = job.chat_id
-    
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="🟢 اللهم صلِ وسلم و زِد و بارك علي سيدنا محمد وعلي آله و صحبه اچمعين"
-    )
+    await broadcast_messages(context, "send_prophet_prayer", PROPHET_PRAYER_MESSAGES)
 
-# Daily Dhikr handler
+# Daily Dhikr slot
 async def send_daily_dhikr(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job
-    chat_id = job.chat_id
-    
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="🟡 ادعيه و ذكر اللّه :"
-    )
-    
-    dhikr_messages = [
-        "لا حول ولا قوة إلا باللًٰه العليّ العظيم",
-        "سبحان الله عدد خلقه و رضا نفسه و زنه عرشه و مداد كلماته",
-        "استغفر الله العظيم الذي لا اله إلا هو الحي القيوم واتوب إليه",
-        "لا اله الا الله وحده لا شريك له ، له الملك وله الحمد وهو علي كل شئ قدير",
-        "اللهم اغفر للمؤمنين و المؤمنات , المسلمين و المسلمات الاحياء منهم والاموات",
-        "اللهم أنت ربي لا إله إلا أنت ، خلقتني وأنا عبدك وأنا على عهدك و وعدك ما استطعت ، أعوذ بك من شر ما صنعت ، أبوء لك بنعمتك عليّْ ، وأبوء بذنبي فاغفر لي فإنه لا يغفر الذنوب إلا أنت",
-        "آيه الكرسي : \n« ٱللَّهُ لَاۤ إِلَـٰهَ إِلَّا هُوَ ٱلۡحَیُّ ٱلۡقَيُّومُۚ لَا تَأۡخُذُهُۥ سِنَةࣱ وَلَا نَوۡمࣱۚ لَّهُۥ مَا فِی ٱلسَّمَـٰوَ ٰتِ وَمَا فِی ٱلۡأَرۡضِۗ مَن ذَا ٱلَّذِی يَشۡفَعُ عِندَهُۥۤ إِلَّا بِإِذۡنِهِۦۚ يَعۡلَمُ مَا بَيۡنَ أَيۡدِيهِمۡ وَمَا خَلۡفَهُمۡۖ وَلَا يُحِيطُونَ بِشَیۡءࣲ مِّنۡ عِلۡمِهِۦۤ إِلَّا بِمَا شَاۤءَۚ وَسِعَ كُرۡسِيُّهُ ٱلسَّمَـٰوَ ٰتِ وَٱلۡأَرۡضَۖ وَلَا يَـُٔودُهُۥ حِفۡظُهُمَاۚ وَهُوَ ٱلۡعَلِیُّ ٱلۡعَظِيمُ »",
-        "اللهم إني أسألك من الخير كله : عاجله وآجله ، ما علمت منه وما لم أعلم ، وأعوذ بك من الشر كله عاجله وآجله ، ما علمت منه وما لم أعلم. اللهم إني أسألك من خير ما سألك عبدك ونبيك ، وأعوذ بك من شر ما استعاذ بك عبدك ونبيك. اللهم إني أسألك الجنة ، وما قرب إليها من قول أو عمل ، وأعوذ بك من النار ، وما قرب إليها من قول أو عمل ، وأسألك أن تجعل كل قضاء قضيته لي خيرا."
+    await broadcast_messages(context, "send_daily_dhikr", DAILY_DHIKR_MESSAGES)
 
-    ]
-    
-    for message in dhikr_messages:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=message
-        )
-
-# 12-hour Dhikr handler
+# 12-hour Dhikr slot
 async def send_12hour_dhikr(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job
-    chat_id = job.chat_id
-    message_text = " 🟡 بسم الله الذي لايضر مع اسمه شئ في الارض ولا في السماء وهو السميع العليم '' ثلاث مرات '' "
-    for _ in range(1):
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=message_text
-        )
+    await broadcast_messages(context, "send_12hour_dhikr", TWELVE_HOUR_DHIKR_MESSAGES)
 
-# Thursday Dhikr handler
-async def send_thursday_dhikr(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job
-    chat_id = job.chat_id
-    
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="مِن مغرب الخَميس إلى مغرب الجُمعة كُلّ ثانية فيها خزائن من الحسناتِ والرّحمات وتفريج الكُربات\n🟣 فليُكثر المرء من الصَّلاة على النَّبي ﷺ",
-    )
+# Night prayer slot
+async def send_night_prayer(context: ContextTypes.DEFAULT_TYPE):
+    await broadcast_messages(context, "send_night_prayer", NIGHT_PRAYER_MESSAGES)
 
-# Saturday Dhikr handler
-async def send_saturday_dhikr(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job
-    chat_id = job.chat_id
-    
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="🟣 بدايه اسبوع جديد وحاول تبعد عن الذنوب وخصوصا الكبائر عشان بتسبب مشاكل و تعب نفسي و نقص الرزق و عدم استجابه الدعاء و عدم التوفيق و غيره الكثير"
-    )
-    
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="بعض من الكبائر : ترك الصلاة , العقوق , الكذب , الغيبة , النميمة , الربا ( من ضمنها القروض ) , شرب الخمر والمخدرات , شتم الاهل ( اهل اي حد ) , الزنا , أكل المال الحرام , الرياء ( التظاهر بالصلاح ) , شهادة الزور , قطع صله الرحم"
-    )
+# Days of the week in python-telegram-bot v20 job queues (0 is Sunday)
+SUNDAY, MONDAY, TUESDAY, WEDNESDAY, THURSDAY, FRIDAY, SATURDAY = range(7)
 
-# Night prayer handler
-async def send_night_prayer(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job
-    chat_id = job.chat_id
-    
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text=" 🟤 تذكير قيام الليل : "
-    )
-    
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="وإن لم تستطع فا قرائه اخر آيتان من سوره البقره كفتاه :"
-    )
-    
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="بسم الله الرحمن الرحيم ﴿ آمَنَ الرَّسُولُ بِمَا أُنْزِلَ إِلَيْهِ مِنْ رَبِّهِ وَالْمُؤْمِنُونَ ۚ كُلٌّ آمَنَ بِاللَّهِ وَمَلَائِكَتِهِ وَكُتُبِهِ وَرُسُلِهِ لَا نُفَرِّقُ بَيْنَ أَحَدٍ مِنْ رُسُلِهِ ۚ وَقَالُوا سَمِعْنَا وَأَطَعْنَا ۖ غُفْرَانَكَ رَبَّنَا وَإِلَيْكَ الْمَصِيرُ ( ٢٨٥ ) لَا يُكَلِّفُ اللَّهُ نَفْسًا إِلَّا وُسْعَهَا لَهَا مَا كَسَبَتْ وَعَلَيْهَا مَا اكْتَسَبَتْ رَبَّنَا لَا تُؤَاخِذْنَا إِنْ نَسِينَا أَوْ أَخْطَأْنَا رَبَّنَا وَلَا تَحْمِلْ عَلَيْنَا إِصْرًا كَمَا حَمَلْتَهُ عَلَى الَّذِينَ مِنْ قَبْلِنَا رَبَّنَا وَلَا تُحَمِّلْنَا مَا لَا طَاقَةَ لَنَا بِهِ وَاعْفُ عَنَّا وَاغْفِرْ لَنَا وَارْحَمْنَا أَنْتَ مَوْلَانَا فَانْصُرْنَا عَلَى الْقَوْمِ الْكَافِرِينَ ( ٢٨٦ ) ﴾"
+# All deliveries, one timer per distinct Egypt-time slot
+def build_slot_scheduler():
+    scheduler = SlotScheduler(EGYPT_TZ)
+    
+    # Quran service: daily at 12:00 PM, reminder at 11:50 PM for unconfirmed reading
+    scheduler.add_slot("quran_wird", send_quran_reminder, QURAN_SERVICE, 12, 0)
+    scheduler.add_slot("quran_reading_reminder", send_reading_reminder, QURAN_SERVICE, 23, 50)
+    
+    # Prophet prayer service: hourly starting at 12:15 PM
+    for hour in range(24):
+        scheduler.add_slot(f"prophet_prayer_{(12 + hour) % 24:02d}15", send_prophet_prayer,
+                           PROPHET_PRAYER_SERVICE, (12 + hour) % 24, 15)
+    
+    # Dhikr service: daily at 4:30 PM and every 12 hours at 11:45
+    scheduler.add_slot("daily_dhikr", send_daily_dhikr, DHIKR_SERVICE, 16, 30)
+    scheduler.add_slot("12hour_dhikr_noon", send_12hour_dhikr, DHIKR_SERVICE, 11, 45)
+    scheduler.add_slot("12hour_dhikr_midnight", send_12hour_dhikr, DHIKR_SERVICE, 23, 45)
+    
+    # Dhikr service: Dua and Ayah on Tue, Thu, Sat at 4:30:10 PM and 4:30:15 PM
+    dhikr_days = (TUESDAY, THURSDAY, SATURDAY)
+    scheduler.add_slot("dhikr_dua", send_dua_message, DHIKR_SERVICE, 16, 30, 10, days=dhikr_days)
+    scheduler.add_slot("dhikr_ayah", send_ayah_message, DHIKR_SERVICE, 16, 30, 15, days=dhikr_days)
+    
+    # Night prayer service: daily at 12:00 AM
+    scheduler.add_slot("night_prayer", send_night_prayer, NIGHT_PRAYER_SERVICE, 0, 0)
+    
+    # Global reminders for all users: Thursday at 4:00 PM, Saturday at 9:00 AM
+    scheduler.add_slot("global_thursday_reminder", send_global_thursday_reminder, AUDIENCE_ALL,
+                       16, 0, days=(THURSDAY,))
+    scheduler.add_slot("global_saturday_reminder", send_global_saturday_reminder, AUDIENCE_ALL,
+                       9, 0, days=(SATURDAY,))
+    
+    return scheduler
+
+# Seconds the last startup rehydration took, exported as a gauge
+last_rehydration_seconds = 0.0
+metrics.gauge('bot_schedule_rehydration_seconds', 'Duration of the startup schedule rehydration',
+              lambda: last_rehydration_seconds)
+
+# Startup phase restoring every subscriber's deliveries in one bulk pass: the users and their
+# service flags are loaded into the registry, which indexes subscribers per service, and one
+# job per slot is registered. Slots resolve their audience from that index when they fire, so
+# nothing per user has to be re-created after a redeploy.
+async def rehydrate_schedule(job_queue):
+    global last_rehydration_seconds
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    
+    loaded = await asyncio.to_thread(user_registry.load)
+    users_loaded = loop.time()
+    if not loaded:
+        logger.error("Users could not be loaded, slots reach nobody until the registry loads in the background")
+    
+    scheduler = build_slot_scheduler()
+    scheduler.register(job_queue, wrap=timed_job)
+    finished = loop.time()
+    
+    last_rehydration_seconds = finished - started
+    service_counts = user_registry.stats.service_counts()
+    subscribers = ", ".join(f"{service}={service_counts.get(service, 0)}" for service in SERVICE_COLUMNS)
+    logger.info(
+        f"Schedule rehydrated in {last_rehydration_seconds * 1000:.0f}ms: {len(user_registry)} users and "
+        f"service index in {(users_loaded - started) * 1000:.0f}ms, {len(scheduler.slots)} slots in "
+        f"{(finished - users_loaded) * 1000:.0f}ms ({subscribers})"
     )
+    if last_rehydration_seconds > 1:
+        logger.warning(f"Schedule rehydration took {last_rehydration_seconds:.2f}s, redeploys delay the first updates")
+    return scheduler
 
-# Main function
-async def main():
-    # Create the Application with persistence
-    persistence = PicklePersistence(filepath=PERSISTENCE_FILE)
-    application = Application.builder().token(TOKEN).persistence(persistence).build()
+# Queue the runs a restart interrupted again, they continue with their pending recipients
+async def resume_outbox_runs(job_queue, scheduler):
+    slots = {slot.name: slot for slot in scheduler.slots}
+    for run in await asyncio.to_thread(outbox.unfinished_runs):
+        slot = slots.get(run["payload_ref"])
+        age = datetime.now().timestamp() - run["created"]
+        if slot is None or age > OUTBOX_RESUME_MAX_AGE:
+            logger.warning(f"Abandoning outbox run {run['run_id']} started {age / 3600:.1f}h ago "
+                           f"with {run['pending']} recipients pending")
+            await asyncio.to_thread(outbox.finish_run, run["run_id"])
+            continue
+        
+        job_queue.run_once(
+            timed_job(slot.callback, slot.name),
+            when=0,
+            name=f"{slot.name}_resume",
+            data={"audience": slot.audience, "slot": slot.name, "run_id": run["run_id"]},
+            # A late start must still resume the run instead of dropping it as missed
+            job_kwargs={"misfire_grace_time": None}
+        )
+        logger.info(f"Resuming outbox run {run['run_id']} with {run['pending']} recipients pending")
+    
+    # Finished runs are only kept to make repeated runs of the same slot and day no-ops
+    await asyncio.to_thread(outbox.prune, 7 * 24 * 60 * 60)
 
+# Register all update handlers, shared by main() and the replay benchmark
+def add_handlers(application):
+    # Users writing to the bot are reachable again, before any other handler runs
+    application.add_handler(TypeHandler(Update, restore_reachability), group=-2)
+    
     # Add conversation handler for service selection
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
+        entry_points=[CommandHandler("start", timed_handler(start))],
         states={
             SELECTING_SERVICES: [
-                CallbackQueryHandler(service_selection, pattern=f"^({QURAN_SERVICE}|{PROPHET_PRAYER_SERVICE}|{DHIKR_SERVICE}|{NIGHT_PRAYER_SERVICE}|{CONFIRM})$"),
+                CallbackQueryHandler(timed_handler(service_selection), pattern=f"^({QURAN_SERVICE}|{PROPHET_PRAYER_SERVICE}|{DHIKR_SERVICE}|{NIGHT_PRAYER_SERVICE}|{CONFIRM})$"),
             ],
         },
-        fallbacks=[CommandHandler("start", start)],
+        fallbacks=[CommandHandler("start", timed_handler(start))],
         name="service_selection",
         persistent=True,
     )
@@ -1161,44 +1353,130 @@ async def main():
     application.add_handler(conv_handler)
     
     # Add callback query handlers
-    application.add_handler(CallbackQueryHandler(confirm_reading, pattern=f"^{CONFIRM_READ}$"))
-    application.add_handler(CallbackQueryHandler(return_to_wird_callback, pattern=f"^{RETURN_TO_WIRD}$"))
-    application.add_handler(CallbackQueryHandler(more_quran_callback, pattern=f"^{MORE_QURAN}$"))
-    application.add_handler(CallbackQueryHandler(no_more_quran_callback, pattern=f"^{NO_MORE_QURAN}$"))
+    application.add_handler(CallbackQueryHandler(timed_handler(confirm_reading), pattern=f"^{CONFIRM_READ}$"))
+    application.add_handler(CallbackQueryHandler(timed_handler(return_to_wird_callback), pattern=f"^{RETURN_TO_WIRD}$"))
+    application.add_handler(CallbackQueryHandler(timed_handler(more_quran_callback), pattern=f"^{MORE_QURAN}$"))
+    application.add_handler(CallbackQueryHandler(timed_handler(no_more_quran_callback), pattern=f"^{NO_MORE_QURAN}$"))
     
     # Add admin command handlers
-    application.add_handler(CommandHandler("users_count", get_users_count))
-    application.add_handler(CommandHandler("users_info", get_users_info))
-    
-    # Schedule global reminders (for all users)
-    # Thursday reminder at 4:00 PM Egypt time
-    thursday_time = egypt_time_to_utc(16, 0)  # 4:00 PM Egypt time
-    application.job_queue.run_daily(
-        send_global_thursday_reminder,
-        time=thursday_time,
-        days=(3,),  # Thursday (0 is Monday in python-telegram-bot)
-        name="global_thursday_reminder"
+    application.add_handler(CommandHandler("users_count", timed_handler(get_users_count)))
+    application.add_handler(CommandHandler("users_info", timed_handler(get_users_info)))
+    application.add_handler(CallbackQueryHandler(timed_handler(users_info_callback), pattern=f"^{USERS_INFO}:"))
+
+# Main function
+async def main():
+    # Create the Application with persistence, only changed keys are written
+    persistence = SQLitePersistence(PERSISTENCE_DB_FILE, update_interval=PERSISTENCE_INTERVAL,
+                                    pickle_file=PERSISTENCE_FILE)
+    # Every Bot API call is counted by method and status code
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .persistence(persistence)
+        .request(MetricsHTTPXRequest(connection_pool_size=256))
+        .get_updates_request(MetricsHTTPXRequest(connection_pool_size=1))
+        .build()
     )
+    metrics.gauge('bot_scheduled_jobs', 'Jobs in the job queue', lambda: len(application.job_queue.jobs()))
     
-    # Saturday reminder at 9:00 AM Egypt time
-    saturday_time = egypt_time_to_utc(9, 0)  # 9:00 AM Egypt time
-    application.job_queue.run_daily(
-        send_global_saturday_reminder,
-        time=saturday_time,
-        days=(5,),  # Saturday (0 is Monday in python-telegram-bot)
-        name="global_saturday_reminder"
-    )
+    add_handlers(application)
+    
+    # Record updates before any handler sees them
+    update_recorder = None
+    if UPDATE_RECORD_FILE:
+        update_recorder = UpdateRecorder(UPDATE_RECORD_FILE)
+        application.add_handler(TypeHandler(Update, update_recorder.record), group=-1)
+        logger.info(f"Recording anonymized updates to {UPDATE_RECORD_FILE}")
+    
+    # Watch for blocking calls from the start, including the startup phase
+    loop_monitor.start()
+    
+    # Health checks are served from the start, /readyz reports ready once updates are processed
+    http_server = build_http_server(application)
+    await http_server.start()
+    
+    # Open the storage, a fresh local database is seeded from Google Sheets
+    await storage_thread_call(storage.open)
+    if sheets_mirror is not None:
+        await asyncio.get_running_loop().run_in_executor(sheets_storage.executor, sheets_storage.open)
+        # Raises while the local database is empty and Sheets can not be read, the platform restarts the bot
+        await sheets_mirror.restore()
+        application.job_queue.run_repeating(timed_job(sheets_mirror.job, "sheets_mirror"), interval=SHEETS_MIRROR_INTERVAL,
+                                            first=SHEETS_MIRROR_INTERVAL, name="sheets_mirror")
+    
+    # Last persisted totals answer /metrics until the registry has loaded and recounted the users
+    await asyncio.to_thread(user_registry.stats.load)
+    
+    # Parse the Quran page links once, sends only index into memory from now on
+    quran_pages.load()
+    quran_pages.load_file_ids()
+    
+    # Rebuild the whole delivery schedule from the stored subscriptions before any update arrives
+    scheduler = await rehydrate_schedule(application.job_queue)
+    user_registry.start()
     
-    # Start the health check server in a separate thread
-    threading.Thread(target=start_health_check_server, daemon=True).start()
+    await asyncio.to_thread(outbox.open)
+    
+    # Unreachable users get another chance at night, away from the delivery slots
+    application.job_queue.run_daily(timed_job(reprobe_unreachable_users), time(3, 30, tzinfo=EGYPT_TZ),
+                                    name="reprobe_unreachable_users")
     
     # Start the bot
     await application.initialize()
     await application.start()
-    await application.updater.start_polling()
     
-    # Run the bot until the user presses Ctrl-C
-    await application.idle()
+    # Runs interrupted by the previous shutdown or crash continue now that the job queue is running,
+    # queued before initialize() they would be missed whenever it takes longer than the grace time
+    await resume_outbox_runs(application.job_queue, scheduler)
+    if UPDATE_MODE == "webhook":
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES
+            )
+            logger.info(f"Receiving updates by webhook on {WEBHOOK_PATH}")
+        else:
+            # Local runs and tests POST updates to the endpoint themselves
+            logger.info(f"Webhook mode without WEBHOOK_URL, only accepting updates POSTed to {WEBHOOK_PATH}")
+    else:
+        # Polling removes any webhook set by a previous deployment
+        await application.updater.start_polling()
+    
+    # Run the bot until the user presses Ctrl-C or the platform sends SIGTERM
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Signal handlers are not available on Windows
+            pass
+    
+    try:
+        await stop_event.wait()
+    finally:
+        # Stop accepting webhook updates before the application stops processing them
+        await http_server.stop()
+        await loop_monitor.stop()
+        if application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        if update_recorder is not None:
+            update_recorder.close()
+        
+        # Force a final flush of pending user changes, then a last export to Google Sheets
+        await asyncio.to_thread(user_registry.close)
+        if sheets_mirror is not None:
+            try:
+                await sheets_mirror.export()
+            except Exception as e:
+                logger.error(f"Error in the final Google Sheets export: {e}")
+        storage.close()
+        if sheets_mirror is not None:
+            sheets_storage.close()
+        outbox.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import random
+import time
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Delivery outcomes meaning the user can not be reached until they write to the bot again
+UNREACHABLE_REASONS = ("blocked", "deactivated", "chat_not_found")
+
+
+def unreachable_reason(error):
+    """
+    Classify a Telegram error that rules out any further delivery to a chat
+
+    Args:
+        error (Exception): Error raised by an API call
+
+    Returns:
+        str: One of UNREACHABLE_REASONS, or None if the error may be temporary
+    """
+    message = str(error).lower()
+    if isinstance(error, Forbidden):
+        return "deactivated" if "deactivated" in message else "blocked"
+    if isinstance(error, BadRequest) and "chat not found" in message:
+        return "chat_not_found"
+    return None
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        """
+        Token bucket used to pace Telegram API calls
+
+        Args:
+            rate (float): Tokens added per second
+            capacity (float): Maximum number of tokens, i.e. the allowed burst
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    @property
+    def idle(self):
+        """True once the bucket is full again and can be dropped"""
+        self._refill()
+        return self._tokens >= self.capacity
+
+
+class BroadcastReport:
+    def __init__(self, name, total):
+        """
+        Progress and outcome of a single broadcast run
+
+        Args:
+            name (str): Broadcast name used in log lines
+            total (int): Number of recipients
+        """
+        self.name = name
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.api_calls = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def elapsed(self):
+        end = self.finished if self.finished is not None else time.monotonic()
+        return end - self.started
+
+    def summary(self):
+        return (
+            f"{self.name}: {self.done}/{self.total} done, sent={self.sent} failed={self.failed} "
+            f"blocked={self.blocked} api_calls={self.api_calls} elapsed={self.elapsed:.1f}s"
+        )
+
+
+class BroadcastEngine:
+    def __init__(self, global_rate=30, per_chat_rate=1, per_chat_burst=3,
+                 max_concurrency=20, max_retries=3, retry_backoff=1.0, progress_interval=15):
+        """
+        Rate-limited concurrent sender shared by all broadcasts
+
+        Every API call goes through a global token bucket (Telegram allows about
+        30 messages per second per bot) and a per-chat bucket. A RetryAfter from
+        Telegram pauses the whole pipeline for the requested time, transient
+        network errors are retried with exponential backoff.
+
+        Args:
+            global_rate (float): API calls per second across all chats
+            per_chat_rate (float): API calls per second to a single chat
+            per_chat_burst (int): Calls a single chat may receive back to back
+            max_concurrency (int): Recipients being delivered at the same time
+            max_retries (int): Retries of a call after a transient error
+            retry_backoff (float): Base delay in seconds of the exponential backoff
+            progress_interval (float): Seconds between two progress log lines
+        """
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.progress_interval = progress_interval
+
+        self._global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self._chat_buckets = {}
+        self._resume_at = 0.0
+        self._pending = 0
+
+    @property
+    def pending(self):
+        """Recipients queued in running broadcasts that were not handled yet"""
+        return self._pending
+
+    async def _wait_if_paused(self):
+        while True:
+            delay = self._resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate, capacity=self.per_chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def call(self, method, *args, report=None, **kwargs):
+        """
+        Run a single Telegram API call under the rate limits
+
+        Args:
+            method (callable): Bot coroutine method, e.g. bot.send_message
+            report (BroadcastReport): Optional report counting API calls
+            **kwargs: Arguments of the call, ``chat_id`` selects the per-chat limit
+
+        Returns:
+            The result of the API call
+        """
+        chat_id = kwargs.get("chat_id")
+        attempt = 0
+        while True:
+            await self._wait_if_paused()
+            await self._chat_bucket(chat_id).acquire()
+            await self._global_bucket.acquire()
+            # A pause may have started while waiting for tokens
+            await self._wait_if_paused()
+
+            if report is not None:
+                report.api_calls += 1
+            try:
+                return await method(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                logger.warning(f"Flood control hit, pausing all broadcasts for {retry_after}s")
+                self._resume_at = max(self._resume_at, time.monotonic() + retry_after)
+            except (Forbidden, BadRequest):
+                # BadRequest is a NetworkError too, but retrying never helps
+                raise
+            except NetworkError as e:
+                # Covers TimedOut and other transient transport errors
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt) * (1 + random.random() / 2)
+                attempt += 1
+                logger.info(f"Transient error for chat {chat_id} ({e}), retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def run(self, name, chat_ids, deliver, on_done=None):
+        """
+        Deliver to every recipient with bounded concurrency
+
+        Args:
+            name (str): Broadcast name used in log lines
+            chat_ids (list): Recipient chat IDs
+            deliver (callable): Coroutine function ``deliver(chat_id, report)``
+                performing the calls for one recipient through ``call``
+            on_done (callable): Optional coroutine function ``on_done(chat_id, status)``
+                awaited once a recipient completed, status is sent, failed or one
+                of UNREACHABLE_REASONS
+
+        Returns:
+            BroadcastReport: Counters of the finished run
+        """
+        report = BroadcastReport(name, len(chat_ids))
+        queue = asyncio.Queue()
+        for chat_id in chat_ids:
+            queue.put_nowait(chat_id)
+        self._pending += len(chat_ids)
+
+        async def worker():
+            while True:
+                try:
+                    chat_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    await deliver(chat_id, report)
+                    report.sent += 1
+                    status = "sent"
+                except Exception as e:
+                    status = unreachable_reason(e)
+                    if status is not None:
+                        # The user blocked the bot, deleted the account or the chat is gone
+                        report.blocked += 1
+                        logger.info(f"{name}: user {chat_id} is unreachable ({status}): {e}")
+                    else:
+                        report.failed += 1
+                        status = "failed"
+                        logger.error(f"Failed to send {name} to user {chat_id}: {e}")
+                finally:
+                    self._pending -= 1
+                if on_done is not None:
+                    await on_done(chat_id, status)
+
+        async def progress():
+            while True:
+                await asyncio.sleep(self.progress_interval)
+                logger.info(f"Broadcast progress {report.summary()}")
+
+        progress_task = asyncio.create_task(progress())
+        try:
+            workers = min(self.max_concurrency, len(chat_ids))
+            await asyncio.gather(*(worker() for _ in range(workers)))
+        finally:
+            progress_task.cancel()
+            # Anything left was cancelled together with the run
+            self._pending -= queue.qsize()
+            report.finished = time.monotonic()
+            self._drop_idle_buckets()
+
+        logger.info(f"Broadcast finished {report.summary()}")
+        return report
+
+    async def send_messages(self, bot, name, chat_ids, messages, on_done=None):
+        """
+        Send the same text messages to every recipient
+
+        Args:
+            bot (telegram.Bot): Bot used to send
+            name (str): Broadcast name used in log lines
+            chat_ids (list): Recipient chat IDs
+            messages (list): Texts sent in order to each recipient
+            on_done (callable): Passed on to ``run``
+
+        Returns:
+            BroadcastReport: Counters of the finished run
+        """
+        async def deliver(chat_id, report):
+            for text in messages:
+                await self.call(bot.send_message, chat_id=chat_id, text=text, report=report)
+
+        return await self.run(name, chat_ids, deliver, on_done=on_done)
+
+    def _drop_idle_buckets(self):
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.idle]:
+            del self._chat_buckets[chat_id]
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+from http import HTTPStatus
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(status.phrase)
+        self.status = status
+
+
+class Request:
+    def __init__(self, method, path, version, headers, body):
+        """
+        A parsed HTTP request
+
+        Args:
+            method (str): Request method, e.g. POST
+            path (str): Request path without the query string
+            version (str): HTTP version, e.g. HTTP/1.1
+            headers (dict): Header names in lower case -> values
+            body (bytes): Request body
+        """
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.1':
+            return connection != 'close'
+        return connection == 'keep-alive'
+
+
+class HTTPServer:
+    def __init__(self, host, port, max_body_size=1024 * 1024, read_timeout=30):
+        """
+        Minimal asyncio HTTP/1.1 server running on the bot's event loop
+
+        Serves the Telegram webhook and the health endpoints on one port
+        without a thread per request. Routes are coroutine functions taking a
+        Request and returning ``(status, content_type, body)``.
+
+        Args:
+            host (str): Interface to listen on
+            port (int): Port to listen on
+            max_body_size (int): Largest accepted request body in bytes
+            read_timeout (float): Seconds an idle connection is kept open
+        """
+        self.host = host
+        self.port = port
+        self.max_body_size = max_body_size
+        self.read_timeout = read_timeout
+        self._routes = {}
+        self._server = None
+        # Open keep-alive connections -> their handler tasks, closed on stop
+        self._connections = {}
+
+    def add_route(self, method, path, handler):
+        """
+        Args:
+            method (str): Request method, e.g. GET
+            path (str): Exact request path
+            handler (callable): Coroutine function ``handler(request)``
+        """
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # Closing the transports makes idle handlers see EOF and return
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*self._connections.values(), return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+            logger.info("HTTP server closed")
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= 100:
+                raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HTTPError(HTTPStatus.LENGTH_REQUIRED)
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST)
+        if length > self.max_body_size:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        body = await reader.readexactly(length) if length else b''
+
+        return Request(method.upper(), urlsplit(target).path, version, headers, body)
+
+    async def _dispatch(self, request):
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return HTTPStatus.METHOD_NOT_ALLOWED, 'text/plain', HTTPStatus.METHOD_NOT_ALLOWED.phrase
+            return HTTPStatus.NOT_FOUND, 'text/plain', HTTPStatus.NOT_FOUND.phrase
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Error handling {request.method} {request.path}: {e}")
+            return HTTPStatus.INTERNAL_SERVER_ERROR, 'text/plain', HTTPStatus.INTERNAL_SERVER_ERROR.phrase
+
+    def _write_response(self, writer, status, content_type, body, keep_alive):
+        status = HTTPStatus(status)
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+
+    async def _handle_connection(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.read_timeout)
+                except HTTPError as e:
+                    self._write_response(writer, e.status, 'text/plain', e.status.phrase, False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+
+                status, content_type, body = await self._dispatch(request)
+                self._write_response(writer, status, content_type, body, request.keep_alive)
+                await writer.drain()
+                if not request.keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            # Idle, truncated, reset or oversized request lines all just end the connection
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
@@ -0,0 +1,115 @@
+import asyncio
+import collections
+import logging
+import math
+import sys
+import threading
+import time
+import traceback
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = metrics.histogram('event_loop_lag_seconds', 'Delay of event loop wakeups past their schedule',
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+LOOP_STALLS = metrics.counter('event_loop_stalls_total', 'Event loop blocked for longer than the threshold')
+
+
+class LoopLagMonitor:
+    def __init__(self, interval=0.25, threshold=0.5, window=2400):
+        """
+        Measures how late the event loop runs its callbacks and catches blocking calls
+
+        A sampler task sleeps for ``interval`` and records how much later than
+        requested it woke up. A watchdog thread checks the sampler's heartbeat;
+        once the loop has been stuck for more than ``threshold`` seconds it logs
+        the stack of the event loop thread, i.e. the code that is blocking it,
+        while it is still blocking.
+
+        Args:
+            interval (float): Seconds between two samples
+            threshold (float): Lag in seconds reported as a stall
+            window (int): Number of recent samples kept for the percentiles
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self._samples = collections.deque(maxlen=window)
+
+        self._loop = None
+        self._loop_thread_id = None
+        self._heartbeat = time.monotonic()
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start sampling the running loop, must be called from a coroutine"""
+        if self._task is not None:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = self._loop.create_task(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _sample(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            self._samples.append(lag)
+            LOOP_LAG.observe(lag)
+            if lag > self.threshold:
+                # The watchdog logged the stack while it was blocked, this is the full duration
+                logger.warning(f"Event loop was blocked for {lag:.2f}s")
+
+    def _watch(self):
+        reported = False
+        while not self._stopped.wait(self.interval):
+            stalled_for = time.monotonic() - self._heartbeat - self.interval
+            if stalled_for <= self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+
+            # Report each stall once, with the stack as it is blocking
+            reported = True
+            LOOP_STALLS.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else 'unavailable'
+            task = asyncio.current_task(self._loop)
+            task_name = task.get_coro().__qualname__ if task is not None else 'no task'
+            logger.warning(f"Event loop blocked for {stalled_for:.2f}s in {task_name}, stack:\n{stack}")
+
+    def percentiles(self):
+        """
+        Returns:
+            tuple: (p50, p99) of the recent lag samples in seconds
+        """
+        samples = sorted(self._samples)
+        if not samples:
+            return 0.0, 0.0
+        # Nearest-rank percentiles
+        return (
+            samples[math.ceil(0.50 * len(samples)) - 1],
+            samples[math.ceil(0.99 * len(samples)) - 1]
+        )
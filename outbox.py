@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox_runs (
+    run_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    payload_ref TEXT NOT NULL,
+    created REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    run_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    status TEXT,
+    PRIMARY KEY (run_id, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox(run_id, user_id) WHERE status IS NULL;
+"""
+
+
+class DeliveryOutbox:
+    def __init__(self, db_file):
+        """
+        Durable record of who a scheduled run still has to reach
+
+        Every run enqueues one entry per recipient before sending anything and
+        entries are marked with their outcome as recipients complete. A run
+        interrupted by a restart is found again by ``unfinished_runs`` and
+        continues with its pending recipients only, so nobody gets the same
+        delivery twice and nobody is dropped.
+
+        Args:
+            db_file (str): Path of the SQLite database, created if missing
+        """
+        self.db_file = db_file
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        with self._lock:
+            if self._conn is not None:
+                return
+            conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        logger.info(f"Opened delivery outbox {self.db_file}")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def start_run(self, run_id, name, payload_ref, user_ids):
+        """
+        Enqueue a run, or pick up a run with the same ID that did not finish
+
+        Args:
+            run_id (str): Unique ID of the run, e.g. slot name and date
+            name (str): Name used in log lines
+            payload_ref (str): What to deliver, e.g. the slot name
+            user_ids (list): Recipients, only used when the run is new
+
+        Returns:
+            list: IDs of the recipients still pending, empty if the run already finished
+        """
+        with self._lock, self._conn:
+            run = self._conn.execute("SELECT finished FROM outbox_runs WHERE run_id = ?", (run_id,)).fetchone()
+            if run is not None:
+                if run[0] is not None:
+                    return []
+                rows = self._conn.execute(
+                    "SELECT user_id FROM outbox WHERE run_id = ? AND status IS NULL", (run_id,)
+                ).fetchall()
+                return [row[0] for row in rows]
+
+            self._conn.execute(
+                "INSERT INTO outbox_runs (run_id, name, payload_ref, created) VALUES (?, ?, ?, ?)",
+                (run_id, name, payload_ref, time.time())
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO outbox (run_id, user_id) VALUES (?, ?)",
+                ((run_id, str(user_id)) for user_id in user_ids)
+            )
+            return [str(user_id) for user_id in user_ids]
+
+    def mark_done(self, run_id, outcomes):
+        """
+        Record the outcome of completed recipients in one transaction
+
+        Args:
+            run_id (str): Run ID
+            outcomes (dict): user_id -> status, e.g. sent, blocked or failed
+        """
+        if not outcomes:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE outbox SET status = ? WHERE run_id = ? AND user_id = ?",
+                ((status, run_id, str(user_id)) for user_id, status in outcomes.items())
+            )
+
+    def finish_run(self, run_id):
+        """Mark a run finished and drop its entries, only the run itself is kept"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE outbox_runs SET finished = ? WHERE run_id = ?", (time.time(), run_id))
+            self._conn.execute("DELETE FROM outbox WHERE run_id = ?", (run_id,))
+
+    def unfinished_runs(self):
+        """
+        Returns:
+            list: Dicts with run_id, name, payload_ref, created and the number of pending recipients
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT r.run_id, r.name, r.payload_ref, r.created,
+                       (SELECT COUNT(*) FROM outbox o WHERE o.run_id = r.run_id AND o.status IS NULL)
+                FROM outbox_runs r WHERE r.finished IS NULL ORDER BY r.created
+                """
+            ).fetchall()
+        return [
+            {"run_id": run_id, "name": name, "payload_ref": payload_ref, "created": created, "pending": pending}
+            for run_id, name, payload_ref, created, pending in rows
+        ]
+
+    def prune(self, max_age):
+        """Forget finished runs older than ``max_age`` seconds"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM outbox_runs WHERE finished IS NOT NULL AND finished < ?",
+                               (time.time() - max_age,))
+
+
+class OutboxRun:
+    def __init__(self, outbox, run_id, checkpoint_size=50, before_checkpoint=None):
+        """
+        Buffers the outcomes of one run and writes them to the outbox in batches
+
+        Args:
+            outbox (DeliveryOutbox): Outbox of the run
+            run_id (str): Run ID
+            checkpoint_size (int): Completed recipients written together, a
+                crash re-sends at most this many
+            before_checkpoint (callable): Optional coroutine function receiving
+                the completed user IDs before they are marked, e.g. to save the
+                state their delivery changed. Returning False leaves them pending,
+                they are tried again with the next checkpoint.
+        """
+        self.outbox = outbox
+        self.run_id = run_id
+        self.checkpoint_size = checkpoint_size
+        self.before_checkpoint = before_checkpoint
+        self._outcomes = {}
+        # Completed since the last checkpoint, recipients left over by a failed one do not count
+        self._completed = 0
+        self._lock = asyncio.Lock()
+
+    async def done(self, chat_id, status):
+        self._outcomes[str(chat_id)] = status
+        self._completed += 1
+        if self._completed >= self.checkpoint_size:
+            await self.checkpoint()
+
+    async def checkpoint(self):
+        """
+        Returns:
+            bool: True if every completed recipient so far is marked in the outbox
+        """
+        async with self._lock:
+            outcomes, self._outcomes = self._outcomes, {}
+            self._completed = 0
+            if not outcomes:
+                return True
+            try:
+                if self.before_checkpoint is not None and await self.before_checkpoint(list(outcomes)) is False:
+                    logger.error(f"Outbox {self.run_id}: state of {len(outcomes)} recipients not saved, left pending")
+                    self._outcomes.update(outcomes)
+                    return False
+                await asyncio.to_thread(self.outbox.mark_done, self.run_id, outcomes)
+                return True
+            except Exception as e:
+                logger.error(f"Outbox {self.run_id}: error checkpointing {len(outcomes)} recipients: {e}")
+                self._outcomes.update(outcomes)
+                return False
@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+from telegram import Bot
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Total number of pages in the Quran
+TOTAL_PAGES = 604
+
+
+class QuranPageIndex:
+    def __init__(self, links_file, file_ids_file=None):
+        """
+        Page number -> image link index for the Quran page images
+
+        The links file is parsed once into a list indexed by page number, so
+        looking up a page or a range of pages never touches the file again. The
+        file is only re-read when its modification time changes.
+
+        Pages that were sent once also get their Telegram file_id recorded in
+        ``file_ids_file``; later sends reuse it instead of making Telegram
+        download the image from Google Drive again.
+
+        Args:
+            links_file (str): Path to the JSON array of {"name": "<page>.jpg", "url": ...}
+            file_ids_file (str): Path of the persistent page -> file_id cache
+        """
+        self.links_file = links_file
+        self.file_ids_file = file_ids_file
+        # Index 0 is unused so that pages map directly to positions
+        self._links = [None] * (TOTAL_PAGES + 1)
+        self._file_ids = [None] * (TOTAL_PAGES + 1)
+        self._mtime = None
+
+    def load(self):
+        """
+        Parse the links file into the page index
+
+        Returns:
+            bool: True if the file was loaded, False otherwise
+        """
+        try:
+            mtime = os.path.getmtime(self.links_file)
+            with open(self.links_file, 'r', encoding='utf-8') as file:
+                links_array = json.load(file)
+        except FileNotFoundError:
+            logger.error(f"File {self.links_file} not found")
+            return False
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Error parsing {self.links_file}: {e}")
+            return False
+
+        links = [None] * (TOTAL_PAGES + 1)
+        for item in links_array:
+            # Extract page number from filename (e.g., "1.jpg" -> 1)
+            try:
+                page_num = int(item["name"].split('.')[0])
+            except (KeyError, ValueError):
+                continue
+            if 1 <= page_num <= TOTAL_PAGES:
+                links[page_num] = item["url"]
+
+        self._links = links
+        self._mtime = mtime
+        logger.info(f"Loaded {sum(1 for link in links if link)} Quran page links")
+        return True
+
+    def load_file_ids(self):
+        """Load the page -> Telegram file_id cache, a missing file is an empty cache"""
+        if not self.file_ids_file or not os.path.exists(self.file_ids_file):
+            return
+
+        try:
+            with open(self.file_ids_file, 'r', encoding='utf-8') as file:
+                cached = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Error parsing {self.file_ids_file}: {e}")
+            return
+
+        for page_num, file_id in cached.items():
+            page_num = int(page_num)
+            if 1 <= page_num <= TOTAL_PAGES:
+                self._file_ids[page_num] = file_id
+        logger.info(f"Loaded {len(cached)} cached Quran page file ids")
+
+    def _save_file_ids(self):
+        if not self.file_ids_file:
+            return
+
+        cached = {str(page_num): file_id for page_num, file_id in enumerate(self._file_ids) if file_id}
+        tmp_file = f"{self.file_ids_file}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as file:
+                json.dump(cached, file)
+            # Replace atomically so a crash never leaves a truncated cache behind
+            os.replace(tmp_file, self.file_ids_file)
+        except OSError as e:
+            logger.error(f"Error saving {self.file_ids_file}: {e}")
+
+    def photo(self, page_num):
+        """
+        Get what to pass as ``photo`` when sending a page
+
+        Args:
+            page_num (int): Page number between 1 and 604
+
+        The links file is not checked for changes, callers resolve the links
+        of a send with pages() first.
+
+        Returns:
+            str: Cached Telegram file_id, the image link if the page was never
+                sent, or None if the page has no link
+        """
+        page_num = int(page_num)
+        if not 1 <= page_num <= TOTAL_PAGES:
+            return None
+        return self._file_ids[page_num] or self._links[page_num]
+
+    def remember_file_id(self, page_num, message):
+        """
+        Record the file_id Telegram assigned to a page sent by its link
+
+        Pages that already have a cached file_id are left alone. Telegram may
+        return a different file_id for the same file on every send, only
+        file_unique_id is stable, so comparing ids would rewrite the cache
+        for most pages of every broadcast.
+
+        Args:
+            page_num (int): Page number of the sent image
+            message (telegram.Message): Message returned by send_photo
+        """
+        if message is None or not message.photo:
+            return
+        page_num = int(page_num)
+        if not 1 <= page_num <= TOTAL_PAGES or self._file_ids[page_num]:
+            return
+        # The largest size is the original upload
+        self._file_ids[page_num] = message.photo[-1].file_id
+        self._save_file_ids()
+
+    def forget_file_id(self, page_num):
+        """Drop a cached file_id Telegram no longer accepts"""
+        page_num = int(page_num)
+        if 1 <= page_num <= TOTAL_PAGES and self._file_ids[page_num]:
+            self._file_ids[page_num] = None
+            self._save_file_ids()
+
+    @property
+    def missing_file_ids(self):
+        """Pages that have a link but no cached file_id yet"""
+        return [
+            page_num for page_num in range(1, TOTAL_PAGES + 1)
+            if self._links[page_num] and not self._file_ids[page_num]
+        ]
+
+    def reload_if_changed(self):
+        """Re-read the links file if it was modified since the last load"""
+        try:
+            mtime = os.path.getmtime(self.links_file)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load()
+
+    def get(self, page_num):
+        """
+        Args:
+            page_num (int): Page number between 1 and 604
+
+        Returns:
+            str: Image link of the page or None if it is missing
+        """
+        self.reload_if_changed()
+        page_num = int(page_num)
+        if 1 <= page_num <= TOTAL_PAGES:
+            return self._links[page_num]
+        return None
+
+    def pages(self, start_page, end_page):
+        """
+        Get the image links of a range of pages
+
+        Args:
+            start_page (int): First page, inclusive
+            end_page (int): Last page, inclusive
+
+        Returns:
+            list: (page number, link or None) pairs for the range
+        """
+        self.reload_if_changed()
+        start_page = max(1, start_page)
+        end_page = min(TOTAL_PAGES, end_page)
+        return list(zip(range(start_page, end_page + 1), self._links[start_page:end_page + 1]))
+
+
+async def warm_file_id_cache(bot, chat_id, index, delay=1.0):
+    """
+    Upload every page without a cached file_id to a chat and record the ids
+
+    Args:
+        bot (telegram.Bot): Initialized bot
+        chat_id (int): Private chat receiving the uploads
+        index (QuranPageIndex): Loaded page index with its file_id cache
+        delay (float): Seconds between two uploads, stays under the per-chat limit
+
+    Returns:
+        int: Number of pages uploaded
+    """
+    uploaded = 0
+    for page_num in index.missing_file_ids:
+        while True:
+            try:
+                message = await bot.send_photo(chat_id=chat_id, photo=index.get(page_num), caption=f"صفحة {page_num}")
+                break
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                logger.error(f"Failed to upload page {page_num}: {e}")
+                message = None
+                break
+
+        if message is not None:
+            index.remember_file_id(page_num, message)
+            uploaded += 1
+            logger.info(f"Cached file id of page {page_num}")
+        await asyncio.sleep(delay)
+
+    return uploaded
+
+
+async def _warm(args):
+    index = QuranPageIndex(args.links_file, args.file_ids_file)
+    if not index.load():
+        return
+    index.load_file_ids()
+
+    async with Bot(os.environ["BOT_TOKEN"]) as bot:
+        uploaded = await warm_file_id_cache(bot, args.chat_id, index, delay=args.delay)
+    logger.info(f"Uploaded {uploaded} pages, {len(index.missing_file_ids)} still missing")
+
+
+if __name__ == "__main__":
+    # Pre-upload all pages once, e.g. python quran_pages.py <admin chat id>
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Pre-upload Quran pages and cache their Telegram file ids")
+    parser.add_argument("chat_id", type=int, help="Private chat that receives the uploads")
+    parser.add_argument("--links-file", default="quran_images_links.json")
+    parser.add_argument("--file-ids-file", default="quran_file_ids.json")
+    parser.add_argument("--delay", type=float, default=1.0, help="Seconds between two uploads")
+    asyncio.run(_warm(parser.parse_args()))
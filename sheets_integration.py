@@ -1,9 +1,15 @@
-import os
-import json
+import re
+import time
+import threading
+import httplib2
+import google_auth_httplib2
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
 from datetime import datetime
 
+# Blocking client. Callers on the event loop reach it through SheetsStorage, whose calls run on its
+# bounded thread pool (SHEETS_CONCURRENCY workers) via storage_call in bot.py and the Sheets mirror.
 class GoogleSheetsIntegration:
     def __init__(self, credentials_file):
         """
@@ -15,7 +21,9 @@ class GoogleSheetsIntegration:
         self.SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
         self.credentials = service_account.Credentials.from_service_account_file(
             credentials_file, scopes=self.SCOPES)
-        self.service = build('sheets', 'v4', credentials=self.credentials)
+        self._local = threading.local()
+        self.service = build('sheets', 'v4', credentials=self.credentials,
+                             requestBuilder=self._build_request)
         self.sheets = self.service.spreadsheets()
         
         # Google Sheet ID from the provided link
@@ -25,9 +33,27 @@ class GoogleSheetsIntegration:
         self.USER_DATA_SHEET = 'user_data'
         self.QURAN_TRACKING_SHEET = 'quran_tracking'
         
+        # Per sheet user_id -> row number index and header cache, see _find_row
+        self.INDEX_TTL = 300
+        self._row_index = {}
+        self._headers = {}
+        self._index_loaded_at = {}
+        self._index_lock = threading.Lock()
+        
         # Ensure sheets exist
         self._ensure_sheets_exist()
     
+    def _build_request(self, http, *args, **kwargs):
+        """
+        Build API requests on a per-thread connection
+
+        httplib2 connections are not thread-safe, so every thread gets its own
+        one, all of them authorized with the same shared credentials.
+        """
+        if not hasattr(self._local, 'http'):
+            self._local.http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+        return HttpRequest(self._local.http, *args, **kwargs)
+
     def _ensure_sheets_exist(self):
         """Ensure that required sheets exist, create them if they don't"""
         try:
@@ -99,7 +125,8 @@ class GoogleSheetsIntegration:
             # Add headers
             headers = [
                 'user_id', 'username', 'total_pages_read', 'current_position',
-                'last_batch_sent', 'last_batch_confirmed', 'pending_pages', 'last_update'
+                'last_batch_sent', 'last_batch_confirmed', 'pending_pages', 'last_update',
+                'last_reminder_message_id', 'last_wird_reminder_message_id'
             ]
             
             values = [headers]
@@ -114,6 +141,140 @@ class GoogleSheetsIntegration:
         except Exception as e:
             print(f"Error creating quran_tracking sheet: {e}")
     
+    def _column_letter(self, column_number):
+        """Convert a 1-based column number to its A1 letter(s)"""
+        letters = ''
+        while column_number > 0:
+            column_number, remainder = divmod(column_number - 1, 26)
+            letters = chr(65 + remainder) + letters
+        return letters
+
+    def _load_index(self, sheet_name):
+        """
+        Rebuild the user_id -> row number index and header cache of a sheet
+
+        Both come from a single batchGet of the header row and column A.
+        """
+        result = self.sheets.values().batchGet(
+            spreadsheetId=self.SPREADSHEET_ID,
+            ranges=[f'{sheet_name}!1:1', f'{sheet_name}!A:A']
+        ).execute()
+
+        value_ranges = result.get('valueRanges', [])
+        header_values = value_ranges[0].get('values', [[]]) if value_ranges else [[]]
+        id_values = value_ranges[1].get('values', []) if len(value_ranges) > 1 else []
+
+        rows = {}
+        for i, row in enumerate(id_values[1:], start=2):  # Skip header row
+            if row and row[0] != '':
+                rows[str(row[0])] = i
+
+        with self._index_lock:
+            self._headers[sheet_name] = header_values[0] if header_values else []
+            self._row_index[sheet_name] = rows
+            self._index_loaded_at[sheet_name] = time.monotonic()
+
+    def _invalidate_index(self, sheet_name):
+        with self._index_lock:
+            self._index_loaded_at.pop(sheet_name, None)
+
+    def _index_is_fresh(self, sheet_name):
+        loaded_at = self._index_loaded_at.get(sheet_name)
+        return loaded_at is not None and time.monotonic() - loaded_at < self.INDEX_TTL
+
+    def _find_row(self, sheet_name, user_id):
+        """
+        Get the row number of a user, loading the index lazily
+
+        A miss on an index older than INDEX_TTL refreshes it once, so rows added
+        by someone else are still found.
+        """
+        if sheet_name not in self._index_loaded_at:
+            self._load_index(sheet_name)
+
+        row_number = self._row_index[sheet_name].get(str(user_id))
+        if row_number is None and not self._index_is_fresh(sheet_name):
+            self._load_index(sheet_name)
+            row_number = self._row_index[sheet_name].get(str(user_id))
+        return row_number
+
+    def _read_row(self, sheet_name, user_id):
+        """Read a single user's row with one targeted range request"""
+        for _ in range(2):
+            row_number = self._find_row(sheet_name, user_id)
+            if row_number is None:
+                return None
+
+            headers = self._headers[sheet_name]
+            last_column = self._column_letter(max(len(headers), 1))
+            result = self.sheets.values().get(
+                spreadsheetId=self.SPREADSHEET_ID,
+                range=f'{sheet_name}!A{row_number}:{last_column}{row_number}'
+            ).execute()
+
+            values = result.get('values', [])
+            row = values[0] if values else []
+            if row and str(row[0]) == str(user_id):
+                # Create dict from headers and row data
+                return {header: row[i] if i < len(row) else None for i, header in enumerate(headers)}
+
+            # Rows moved since the index was built, rebuild it and try again
+            self._invalidate_index(sheet_name)
+
+        return None
+
+    def _ensure_headers(self, sheet_name, keys):
+        """Add columns the sheet does not have yet, e.g. after new fields were introduced"""
+        headers = self._headers[sheet_name]
+        missing = [key for key in keys if key not in headers]
+        if missing:
+            headers = headers + missing
+            self.sheets.values().update(
+                spreadsheetId=self.SPREADSHEET_ID,
+                range=f'{sheet_name}!A1',
+                valueInputOption='RAW',
+                body={'values': [headers]}
+            ).execute()
+            with self._index_lock:
+                self._headers[sheet_name] = headers
+        return headers
+
+    def _write_row(self, sheet_name, data):
+        """Update a user's row in place or append it, one request in the common case"""
+        row_number = self._find_row(sheet_name, data['user_id'])
+        headers = self._ensure_headers(sheet_name, data.keys())
+
+        # Create row with data in the correct order
+        row_data = [data.get(header, '') for header in headers]
+        body = {'values': [row_data]}
+
+        if row_number:
+            self.sheets.values().update(
+                spreadsheetId=self.SPREADSHEET_ID,
+                range=f'{sheet_name}!A{row_number}',
+                valueInputOption='RAW',
+                body=body
+            ).execute()
+            return True
+
+        result = self.sheets.values().append(
+            spreadsheetId=self.SPREADSHEET_ID,
+            range=f'{sheet_name}!A:A',
+            valueInputOption='RAW',
+            insertDataOption='INSERT_ROWS',
+            body=body
+        ).execute()
+
+        # Remember where the row landed, e.g. "quran_tracking!A12:J12" -> 12
+        updated_range = result.get('updates', {}).get('updatedRange', '')
+        match = re.search(r'![A-Z]+(\d+)', updated_range)
+        with self._index_lock:
+            if match:
+                self._row_index[sheet_name][str(data['user_id'])] = int(match.group(1))
+            else:
+                self._index_loaded_at.pop(sheet_name, None)
+        return True
+
     def get_user_data(self, user_id):
         """
         Get user data from the user_data sheet
@@ -125,31 +286,9 @@ class GoogleSheetsIntegration:
             dict: User data or None if not found
         """
         try:
-            # Get all user data
-            result = self.sheets.values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=f'{self.USER_DATA_SHEET}!A:M'
-            ).execute()
-            
-            values = result.get('values', [])
-            if not values:
-                return None
-                
-            # Get headers
-            headers = values[0]
-            
-            # Find user by user_id
-            for row in values[1:]:  # Skip header row
-                if row and str(row[0]) == str(user_id):
-                    # Create dict from headers and row data
-                    user_data = {}
-                    for i, header in enumerate(headers):
-                        user_data[header] = row[i] if i < len(row) else None
-                    return user_data
-            
-            return None
-            
+            return self._read_row(self.USER_DATA_SHEET, user_id)
         except Exception as e:
+            self._invalidate_index(self.USER_DATA_SHEET)
             print(f"Error getting user data: {e}")
             return None
     
@@ -164,82 +303,11 @@ class GoogleSheetsIntegration:
             bool: True if successful, False otherwise
         """
         try:
-            # Check if user exists
-            existing_user = self.get_user_data(user_data['user_id'])
-            
-            # Get all user data to find the row index
-            result = self.sheets.values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=f'{self.USER_DATA_SHEET}!A:A'
-            ).execute()
-            
-            values = result.get('values', [])
-            
             # Add current timestamp
             user_data['last_update'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            if existing_user:
-                # Find the row index
-                row_index = None
-                for i, row in enumerate(values):
-                    if row and str(row[0]) == str(user_data['user_id']):
-                        row_index = i + 1  # +1 because sheets are 1-indexed
-                        break
-                
-                if row_index:
-                    # Get headers to ensure correct order
-                    headers_result = self.sheets.values().get(
-                        spreadsheetId=self.SPREADSHEET_ID,
-                        range=f'{self.USER_DATA_SHEET}!1:1'
-                    ).execute()
-                    
-                    headers = headers_result.get('values', [[]])[0]
-                    
-                    # Create row with data in the correct order
-                    row_data = []
-                    for header in headers:
-                        row_data.append(user_data.get(header, ''))
-                    
-                    # Update the row
-                    body = {'values': [row_data]}
-                    self.sheets.values().update(
-                        spreadsheetId=self.SPREADSHEET_ID,
-                        range=f'{self.USER_DATA_SHEET}!A{row_index}',
-                        valueInputOption='RAW',
-                        body=body
-                    ).execute()
-                    
-                    return True
-            else:
-                # Add new user
-                # Get headers to ensure correct order
-                headers_result = self.sheets.values().get(
-                    spreadsheetId=self.SPREADSHEET_ID,
-                    range=f'{self.USER_DATA_SHEET}!1:1'
-                ).execute()
-                
-                headers = headers_result.get('values', [[]])[0]
-                
-                # Create row with data in the correct order
-                row_data = []
-                for header in headers:
-                    row_data.append(user_data.get(header, ''))
-                
-                # Append the row
-                body = {'values': [row_data]}
-                self.sheets.values().append(
-                    spreadsheetId=self.SPREADSHEET_ID,
-                    range=f'{self.USER_DATA_SHEET}!A:A',
-                    valueInputOption='RAW',
-                    insertDataOption='INSERT_ROWS',
-                    body=body
-                ).execute()
-                
-                return True
-                
-            return False
-            
+            return self._write_row(self.USER_DATA_SHEET, user_data)
         except Exception as e:
+            self._invalidate_index(self.USER_DATA_SHEET)
             print(f"Error adding or updating user: {e}")
             return False
     
@@ -254,31 +322,9 @@ class GoogleSheetsIntegration:
             dict: Quran tracking data or None if not found
         """
         try:
-            # Get all tracking data
-            result = self.sheets.values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=f'{self.QURAN_TRACKING_SHEET}!A:H'
-            ).execute()
-            
-            values = result.get('values', [])
-            if not values:
-                return None
-                
-            # Get headers
-            headers = values[0]
-            
-            # Find user by user_id
-            for row in values[1:]:  # Skip header row
-                if row and str(row[0]) == str(user_id):
-                    # Create dict from headers and row data
-                    tracking_data = {}
-                    for i, header in enumerate(headers):
-                        tracking_data[header] = row[i] if i < len(row) else None
-                    return tracking_data
-            
-            return None
-            
+            return self._read_row(self.QURAN_TRACKING_SHEET, user_id)
         except Exception as e:
+            self._invalidate_index(self.QURAN_TRACKING_SHEET)
             print(f"Error getting Quran tracking data: {e}")
             return None
     
@@ -293,83 +339,122 @@ class GoogleSheetsIntegration:
             bool: True if successful, False otherwise
         """
         try:
-            # Check if tracking exists
-            existing_tracking = self.get_quran_tracking(tracking_data['user_id'])
-            
-            # Get all tracking data to find the row index
+            # Add current timestamp
+            tracking_data['last_update'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            return self._write_row(self.QURAN_TRACKING_SHEET, tracking_data)
+        except Exception as e:
+            self._invalidate_index(self.QURAN_TRACKING_SHEET)
+            print(f"Error updating Quran tracking data: {e}")
+            return False
+    
+    def get_all_quran_tracking(self):
+        """
+        Get Quran tracking data of all users with a single request
+        
+        Also refreshes the row index and header cache of the sheet.
+        
+        Returns:
+            dict: user_id -> Quran tracking data, None if the sheet could not be read
+        """
+        try:
             result = self.sheets.values().get(
                 spreadsheetId=self.SPREADSHEET_ID,
-                range=f'{self.QURAN_TRACKING_SHEET}!A:A'
+                range=self.QURAN_TRACKING_SHEET
             ).execute()
             
             values = result.get('values', [])
+            headers = values[0] if values else []
             
-            # Add current timestamp
-            tracking_data['last_update'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            tracking = {}
+            rows = {}
+            for i, row in enumerate(values[1:], start=2):  # Skip header row
+                if row and row[0] != '':
+                    user_id = str(row[0])
+                    rows[user_id] = i
+                    tracking[user_id] = {header: row[j] if j < len(row) else None for j, header in enumerate(headers)}
             
-            if existing_tracking:
-                # Find the row index
-                row_index = None
-                for i, row in enumerate(values):
-                    if row and str(row[0]) == str(tracking_data['user_id']):
-                        row_index = i + 1  # +1 because sheets are 1-indexed
-                        break
-                
-                if row_index:
-                    # Get headers to ensure correct order
-                    headers_result = self.sheets.values().get(
-                        spreadsheetId=self.SPREADSHEET_ID,
-                        range=f'{self.QURAN_TRACKING_SHEET}!1:1'
-                    ).execute()
-                    
-                    headers = headers_result.get('values', [[]])[0]
-                    
-                    # Create row with data in the correct order
-                    row_data = []
-                    for header in headers:
-                        row_data.append(tracking_data.get(header, ''))
-                    
-                    # Update the row
-                    body = {'values': [row_data]}
-                    self.sheets.values().update(
-                        spreadsheetId=self.SPREADSHEET_ID,
-                        range=f'{self.QURAN_TRACKING_SHEET}!A{row_index}',
-                        valueInputOption='RAW',
-                        body=body
-                    ).execute()
-                    
-                    return True
-            else:
-                # Add new tracking
-                # Get headers to ensure correct order
-                headers_result = self.sheets.values().get(
+            with self._index_lock:
+                self._headers[self.QURAN_TRACKING_SHEET] = headers
+                self._row_index[self.QURAN_TRACKING_SHEET] = rows
+                self._index_loaded_at[self.QURAN_TRACKING_SHEET] = time.monotonic()
+            
+            return tracking
+            
+        except Exception as e:
+            print(f"Error getting all Quran tracking data: {e}")
+            return None
+    
+    def batch_update_quran_tracking(self, tracking_rows):
+        """
+        Update Quran tracking data of many users at once
+        
+        Existing rows are written with one values.batchUpdate call, new users
+        are added with one append call.
+        
+        Args:
+            tracking_rows (list): Tracking data dicts, each with a user_id
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not tracking_rows:
+            return True
+        
+        sheet_name = self.QURAN_TRACKING_SHEET
+        try:
+            if sheet_name not in self._index_loaded_at:
+                self._load_index(sheet_name)
+            
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            keys = {}
+            for tracking_data in tracking_rows:
+                tracking_data['last_update'] = now
+                keys.update(dict.fromkeys(tracking_data))
+            headers = self._ensure_headers(sheet_name, keys)
+            
+            updates = []
+            new_rows = []
+            new_ids = []
+            for tracking_data in tracking_rows:
+                row_data = [tracking_data.get(header, '') for header in headers]
+                row_number = self._row_index[sheet_name].get(str(tracking_data['user_id']))
+                if row_number:
+                    updates.append({'range': f'{sheet_name}!A{row_number}', 'values': [row_data]})
+                else:
+                    new_rows.append(row_data)
+                    new_ids.append(str(tracking_data['user_id']))
+            
+            if updates:
+                self.sheets.values().batchUpdate(
                     spreadsheetId=self.SPREADSHEET_ID,
-                    range=f'{self.QURAN_TRACKING_SHEET}!1:1'
+                    body={'valueInputOption': 'RAW', 'data': updates}
                 ).execute()
-                
-                headers = headers_result.get('values', [[]])[0]
-                
-                # Create row with data in the correct order
-                row_data = []
-                for header in headers:
-                    row_data.append(tracking_data.get(header, ''))
-                
-                # Append the row
-                body = {'values': [row_data]}
-                self.sheets.values().append(
+            
+            if new_rows:
+                result = self.sheets.values().append(
                     spreadsheetId=self.SPREADSHEET_ID,
-                    range=f'{self.QURAN_TRACKING_SHEET}!A:A',
+                    range=f'{sheet_name}!A:A',
                     valueInputOption='RAW',
                     insertDataOption='INSERT_ROWS',
-                    body=body
+                    body={'values': new_rows}
                 ).execute()
                 
-                return True
-                
-            return False
+                # Appended rows are contiguous, starting at the first row of updatedRange
+                updated_range = result.get('updates', {}).get('updatedRange', '')
+                match = re.search(r'![A-Z]+(\d+)', updated_range)
+                with self._index_lock:
+                    if match:
+                        first_row = int(match.group(1))
+                        for offset, user_id in enumerate(new_ids):
+                            self._row_index[sheet_name][user_id] = first_row + offset
+                    else:
+                        self._index_loaded_at.pop(sheet_name, None)
+            
+            return True
             
         except Exception as e:
-            print(f"Error updating Quran tracking data: {e}")
+            self._invalidate_index(sheet_name)
+            print(f"Error batch updating Quran tracking data: {e}")
             return False
     
     def get_all_users(self):
@@ -453,3 +538,4 @@ class GoogleSheetsIntegration:
         except Exception as e:
             print(f"Error getting users by service: {e}")
             return []
+
@@ -0,0 +1,108 @@
+import asyncio
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SheetsMirror:
+    def __init__(self, storage, target):
+        """
+        Periodic one-way export of the local storage to Google Sheets
+
+        Google Sheets is no longer read at runtime, it only receives the rows
+        that changed since the previous export so it can still be browsed and
+        edited as a report. A failed export leaves the rows pending and is
+        retried on the next run.
+
+        Args:
+            storage (SQLiteStorage): Primary storage
+            target (SheetsStorage): Google Sheets storage receiving the changes
+        """
+        self.storage = storage
+        self.target = target
+        self._lock = asyncio.Lock()
+
+    async def _target_call(self, method, *args):
+        """Run a Google Sheets call on the target's bounded thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.target.executor, functools.partial(method, *args))
+
+    async def restore(self, attempts=5, retry_delay=10):
+        """
+        Seed an empty local database from Google Sheets
+
+        While the database is empty Sheets is the only copy of the users, so
+        the import is retried and startup is aborted if Sheets stays
+        unreadable. Going on with an empty database would let the first new
+        user make it non-empty and the existing users would never be imported.
+
+        Args:
+            attempts (int): Reads of the sheets before giving up
+            retry_delay (float): Seconds before the first retry, doubled after every failure
+
+        Returns:
+            bool: True if the database was seeded, False if it was not empty
+
+        Raises:
+            RuntimeError: If the database is empty and Sheets could not be read
+        """
+        if not await asyncio.to_thread(self.storage.is_empty):
+            return False
+
+        for attempt in range(1, attempts + 1):
+            users = await self._target_call(self.target.load_users)
+            tracking = await self._target_call(self.target.get_all_quran_tracking)
+            if users is not None and tracking is not None:
+                break
+            if attempt == attempts:
+                raise RuntimeError(f"Could not read Google Sheets to seed the empty local database "
+                                   f"after {attempts} attempts")
+            logger.error(f"Could not read Google Sheets to seed the empty local database, "
+                         f"retrying in {retry_delay:.0f}s (attempt {attempt}/{attempts})")
+            await asyncio.sleep(retry_delay)
+            retry_delay *= 2
+
+        # The imported rows already match the sheet, nothing to export back
+        await asyncio.to_thread(self.storage.save_users, users, True)
+        await asyncio.to_thread(self.storage.batch_update_quran_tracking, list(tracking.values()), True)
+        logger.info(f"Imported {len(users)} users and {len(tracking)} Quran tracking rows from Google Sheets")
+        return True
+
+    async def export(self):
+        """
+        Push every row changed since the last export
+
+        Returns:
+            bool: True if everything pending was exported
+        """
+        async with self._lock:
+            users, user_versions = await asyncio.to_thread(self.storage.unmirrored_users)
+            tracking_rows, tracking_versions = await asyncio.to_thread(self.storage.unmirrored_quran_tracking)
+            if not users and not tracking_rows:
+                return True
+
+            exported = True
+            if users:
+                if await self._target_call(self.target.save_users, users):
+                    await asyncio.to_thread(self.storage.mark_users_mirrored, user_versions)
+                else:
+                    exported = False
+            if tracking_rows:
+                if await self._target_call(self.target.batch_update_quran_tracking, tracking_rows):
+                    await asyncio.to_thread(self.storage.mark_quran_tracking_mirrored, tracking_versions)
+                else:
+                    exported = False
+
+            logger.info(
+                f"Sheets mirror: {len(users)} users, {len(tracking_rows)} Quran tracking rows "
+                f"{'exported' if exported else 'left pending after an error'}"
+            )
+            return exported
+
+    async def job(self, context):
+        """Job queue callback running one export"""
+        try:
+            await self.export()
+        except Exception as e:
+            logger.error(f"Error exporting to Google Sheets: {e}")
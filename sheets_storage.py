@@ -0,0 +1,145 @@
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from sheets_integration import GoogleSheetsIntegration
+from storage import SERVICE_COLUMNS, StorageBackend
+from user_sheet import normalize_user_id
+
+logger = logging.getLogger(__name__)
+
+# Column layout of the user_data worksheet
+USER_SHEET_HEADER = ['user_id', 'username', 'joined_date', *SERVICE_COLUMNS]
+
+SHEETS_LATENCY = metrics.histogram('sheets_call_seconds', 'Google Sheets call latency', ('method',))
+
+
+def timed_sheets_call(func):
+    """Observe the latency of a Google Sheets storage call, labelled by method"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with SHEETS_LATENCY.time(method=func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def parse_service_flag(value):
+    """Service flags come back as booleans, or as strings from rows written by hand"""
+    if isinstance(value, str):
+        return value.strip().upper() == "TRUE"
+    return bool(value)
+
+
+class SheetsStorage(StorageBackend):
+    # Every call is a Google Sheets round trip
+    remote = True
+
+    def __init__(self, user_sheet, credentials_file, max_concurrency=4):
+        """
+        Storage backed directly by the Google Sheets workbook
+
+        Users live in the user_data worksheet, Quran tracking in the
+        quran_tracking sheet. Nothing is contacted before the first call, the
+        Sheets API client is created lazily. Calls from the event loop run on
+        a dedicated bounded thread pool.
+
+        Args:
+            user_sheet (UserSheet): Row-indexed access to the user_data worksheet
+            credentials_file (str): Service account credentials of the Sheets API client
+            max_concurrency (int): Maximum number of Sheets requests in flight from the event loop
+        """
+        self.user_sheet = user_sheet
+        self.credentials_file = credentials_file
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='sheets')
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                self._client = GoogleSheetsIntegration(self.credentials_file)
+            return self._client
+
+    @timed_sheets_call
+    def open(self):
+        """Authorize and make sure the required sheets exist"""
+        self._get_client()
+
+    def close(self):
+        """Wait for in-flight requests and release the thread pool"""
+        self.executor.shutdown(wait=True)
+
+    def is_empty(self):
+        users = self.load_users()
+        tracking = self.get_all_quran_tracking()
+        return not users and not tracking
+
+    @timed_sheets_call
+    def load_users(self):
+        try:
+            records = self.user_sheet.load_records()
+            if records is None:
+                logger.error("Failed to initialize Google Sheets")
+                return None
+
+            # Convert to the format expected by the bot
+            user_data = {}
+            for record in records:
+                user_id = normalize_user_id(record.get('user_id', ''))
+                if user_id:
+                    user_data[user_id] = {
+                        "username": str(record.get('username', '')),
+                        "joined_date": str(record.get('joined_date', '')),
+                        "services": {
+                            service: parse_service_flag(record.get(service, False)) for service in SERVICE_COLUMNS
+                        }
+                    }
+
+            logger.info(f"Loaded {len(user_data)} users from Google Sheets")
+            return user_data
+        except Exception as e:
+            logger.error(f"Error loading user data from Google Sheets: {e}")
+            return None
+
+    @timed_sheets_call
+    def save_users(self, changed_users):
+        try:
+            # Convert user data to rows in the worksheet's column order
+            rows = {}
+            for user_id, user_info in changed_users.items():
+                services = user_info.get('services', {})
+                rows[user_id] = [
+                    user_id,
+                    user_info.get('username', ''),
+                    user_info.get('joined_date', ''),
+                    *(services.get(service, False) for service in SERVICE_COLUMNS)
+                ]
+
+            if not self.user_sheet.upsert_rows(rows):
+                logger.error("Failed to initialize Google Sheets")
+                return False
+            return True
+        except Exception as e:
+            logger.error(f"Error saving user data to Google Sheets: {e}")
+            return False
+
+    def subscribers(self, service):
+        users = self.load_users() or {}
+        return [user_id for user_id, data in users.items() if data["services"].get(service)]
+
+    @timed_sheets_call
+    def get_quran_tracking(self, user_id):
+        return self._get_client().get_quran_tracking(user_id)
+
+    @timed_sheets_call
+    def get_all_quran_tracking(self):
+        return self._get_client().get_all_quran_tracking()
+
+    @timed_sheets_call
+    def update_quran_tracking(self, tracking_data):
+        return self._get_client().update_quran_tracking(tracking_data)
+
+    @timed_sheets_call
+    def batch_update_quran_tracking(self, tracking_rows):
+        return self._get_client().batch_update_quran_tracking(tracking_rows)
@@ -0,0 +1,91 @@
+import logging
+from datetime import time
+
+logger = logging.getLogger(__name__)
+
+# Every day of the week, 0-6 is sunday - saturday in python-telegram-bot v20
+ALL_DAYS = tuple(range(7))
+
+
+class DeliverySlot:
+    def __init__(self, name, hour, minute, second, days, audience, callback):
+        """
+        A point in the local day at which one delivery runs for a whole audience
+
+        Args:
+            name (str): Unique slot name, also used as the job name
+            hour (int): Local hour of the slot
+            minute (int): Local minute of the slot
+            second (int): Local second of the slot
+            days (tuple): Days of the week the slot runs on, 0 is sunday
+            audience (str): Audience resolved when the slot fires
+            callback (callable): Job callback delivering to the audience
+        """
+        self.name = name
+        self.hour = hour
+        self.minute = minute
+        self.second = second
+        self.days = days
+        self.audience = audience
+        self.callback = callback
+
+
+class SlotScheduler:
+    def __init__(self, timezone, misfire_grace_time=5 * 60):
+        """
+        One job queue timer per distinct delivery slot
+
+        Subscribers are not scheduled individually; each slot's callback
+        resolves its audience when it fires, so the number of jobs only depends
+        on the number of slots.
+
+        Args:
+            timezone (tzinfo): Timezone the slot times are expressed in
+            misfire_grace_time (int): Seconds a slot may still run after its
+                time, e.g. when the event loop was stalled. A missed slot would
+                skip its whole audience for the day.
+        """
+        self.timezone = timezone
+        self.misfire_grace_time = misfire_grace_time
+        self.slots = []
+
+    def add_slot(self, name, callback, audience, hour, minute=0, second=0, days=ALL_DAYS):
+        """
+        Add a daily slot
+
+        Args:
+            name (str): Unique slot name
+            callback (callable): Job callback, receives the audience in ``context.job.data``
+            audience (str): Audience of the slot
+            hour (int): Local hour
+            minute (int): Local minute
+            second (int): Local second
+            days (tuple): Days of the week, 0 is sunday
+        """
+        self.slots.append(DeliverySlot(name, hour, minute, second, days, audience, callback))
+
+    def register(self, job_queue, wrap=None):
+        """
+        Create the job queue timers for all slots
+
+        Args:
+            job_queue (JobQueue): Application job queue
+            wrap (callable): Optional decorator applied to every callback, e.g. for metrics
+
+        Returns:
+            int: Number of jobs created
+        """
+        for slot in self.slots:
+            # A timezone-aware time makes the cron trigger follow local DST changes
+            job_queue.run_daily(
+                wrap(slot.callback) if wrap else slot.callback,
+                time=time(slot.hour, slot.minute, slot.second, tzinfo=self.timezone),
+                days=slot.days,
+                name=slot.name,
+                data={"audience": slot.audience, "slot": slot.name},
+                # Late runs still happen, several missed ones collapse into one
+                job_kwargs={"misfire_grace_time": self.misfire_grace_time, "coalesce": True}
+            )
+
+        logger.info(f"Registered {len(self.slots)} delivery slots")
+        return len(self.slots)
@@ -0,0 +1,235 @@
+import asyncio
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+from telegram.ext import BasePersistence
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS persistence (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (kind, key)
+) WITHOUT ROWID;
+"""
+
+USER_DATA = "user_data"
+CHAT_DATA = "chat_data"
+BOT_DATA = "bot_data"
+CALLBACK_DATA = "callback_data"
+# Conversation states are stored under "conversation:<handler name>"
+CONVERSATION = "conversation:"
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, db_file, update_interval=60, pickle_file=None):
+        """
+        python-telegram-bot persistence storing every key as its own SQLite row
+
+        Unlike PicklePersistence nothing is ever rewritten as a whole. The
+        application hands over only the conversations, user_data and chat_data
+        entries that changed; they are staged in memory and every persistence
+        run is committed as one transaction.
+
+        user_data and chat_data are loaded lazily: startup only reads the
+        conversation states and bot_data, a user's or chat's row is read the
+        first time an update or job needs it.
+
+        Args:
+            db_file (str): Path of the SQLite database, created if missing
+            update_interval (float): Seconds between two persistence runs of the application
+            pickle_file (str): PicklePersistence file imported once into an empty database
+        """
+        super().__init__(update_interval=update_interval)
+        self.db_file = db_file
+        self.pickle_file = pickle_file
+
+        self._conn = None
+        self._lock = threading.Lock()
+
+        # (kind, key) -> pickled value, None deletes the row
+        self._pending = {}
+        self._commit_task = None
+
+        self._loaded_users = set()
+        self._loaded_chats = set()
+
+    # ---- database ----
+
+    def _connect(self):
+        with self._lock:
+            if self._conn is not None:
+                return
+            conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+            if conn.execute("SELECT 1 FROM persistence LIMIT 1").fetchone() is None:
+                self._import_pickle()
+
+    def _import_pickle(self):
+        if not self.pickle_file or not os.path.exists(self.pickle_file):
+            return
+        try:
+            with open(self.pickle_file, 'rb') as file:
+                data = pickle.load(file)
+        except Exception as e:
+            logger.error(f"Could not import {self.pickle_file}: {e}")
+            return
+
+        rows = []
+        for name, conversations in (data.get("conversations") or {}).items():
+            rows.extend(
+                (CONVERSATION + name, self._conversation_key(key), pickle.dumps(state))
+                for key, state in conversations.items()
+            )
+        for kind in (USER_DATA, CHAT_DATA):
+            rows.extend((kind, str(key), pickle.dumps(value)) for key, value in (data.get(kind) or {}).items())
+        if data.get(BOT_DATA):
+            rows.append((BOT_DATA, "", pickle.dumps(data[BOT_DATA])))
+
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO persistence (kind, key, value) VALUES (?, ?, ?)", rows)
+        logger.info(f"Imported {len(rows)} persisted entries from {self.pickle_file}")
+
+    async def _open(self):
+        if self._conn is None:
+            await asyncio.to_thread(self._connect)
+
+    def _select(self, kind, key=None):
+        with self._lock:
+            if key is None:
+                return self._conn.execute("SELECT key, value FROM persistence WHERE kind = ?", (kind,)).fetchall()
+            return self._conn.execute(
+                "SELECT key, value FROM persistence WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchall()
+
+    async def _load(self, kind, key=None):
+        await self._open()
+        return await asyncio.to_thread(self._select, kind, key)
+
+    def _write(self, pending):
+        upserts = [(kind, key, value) for (kind, key), value in pending.items() if value is not None]
+        deletes = [(kind, key) for (kind, key), value in pending.items() if value is None]
+        with self._lock, self._conn:
+            if upserts:
+                self._conn.executemany(
+                    "INSERT INTO persistence (kind, key, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT(kind, key) DO UPDATE SET value = excluded.value",
+                    upserts
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM persistence WHERE kind = ? AND key = ?", deletes)
+
+    def _stage(self, kind, key, value):
+        self._pending[(kind, key)] = value
+        # The application updates all changed keys concurrently, one task commits them together
+        if self._commit_task is None:
+            self._commit_task = asyncio.get_running_loop().create_task(self._commit())
+
+    async def _commit(self):
+        # Let the rest of this persistence run stage its changes first
+        await asyncio.sleep(0)
+        self._commit_task = None
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        try:
+            await self._open()
+            await asyncio.to_thread(self._write, pending)
+        except Exception as e:
+            logger.error(f"Error committing {len(pending)} persisted entries: {e}")
+            # Retry with the next run, newer values staged meanwhile win
+            for entry, value in pending.items():
+                self._pending.setdefault(entry, value)
+
+    @staticmethod
+    def _conversation_key(key):
+        return json.dumps(list(key))
+
+    # ---- BasePersistence ----
+
+    async def get_user_data(self):
+        # Loaded per user in refresh_user_data
+        return {}
+
+    async def get_chat_data(self):
+        # Loaded per chat in refresh_chat_data
+        return {}
+
+    async def get_bot_data(self):
+        rows = await self._load(BOT_DATA)
+        return pickle.loads(rows[0][1]) if rows else {}
+
+    async def get_callback_data(self):
+        rows = await self._load(CALLBACK_DATA)
+        return pickle.loads(rows[0][1]) if rows else None
+
+    async def get_conversations(self, name):
+        rows = await self._load(CONVERSATION + name)
+        return {tuple(json.loads(key)): pickle.loads(value) for key, value in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        value = pickle.dumps(new_state) if new_state is not None else None
+        self._stage(CONVERSATION + name, self._conversation_key(key), value)
+
+    async def update_user_data(self, user_id, data):
+        self._loaded_users.add(user_id)
+        self._stage(USER_DATA, str(user_id), pickle.dumps(data))
+
+    async def update_chat_data(self, chat_id, data):
+        self._loaded_chats.add(chat_id)
+        self._stage(CHAT_DATA, str(chat_id), pickle.dumps(data))
+
+    async def update_bot_data(self, data):
+        self._stage(BOT_DATA, "", pickle.dumps(data))
+
+    async def update_callback_data(self, data):
+        self._stage(CALLBACK_DATA, "", pickle.dumps(data))
+
+    async def drop_user_data(self, user_id):
+        self._loaded_users.discard(user_id)
+        self._stage(USER_DATA, str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._loaded_chats.discard(chat_id)
+        self._stage(CHAT_DATA, str(chat_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        # Only the first access reads the row, afterwards memory is authoritative
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+        rows = await self._load(USER_DATA, str(user_id))
+        if rows:
+            user_data.update(pickle.loads(rows[0][1]))
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        if chat_id in self._loaded_chats:
+            return
+        self._loaded_chats.add(chat_id)
+        rows = await self._load(CHAT_DATA, str(chat_id))
+        if rows:
+            chat_data.update(pickle.loads(rows[0][1]))
+
+    async def refresh_bot_data(self, bot_data):
+        # bot_data is loaded once at startup
+        return
+
+    async def flush(self):
+        """Commit everything still staged and close the database"""
+        if self._commit_task is not None:
+            await self._commit_task
+        if self._pending:
+            await self._commit()
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
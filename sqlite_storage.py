@@ -0,0 +1,389 @@
+import json
+import logging
+import sqlite3
+import threading
+from storage import QURAN_TRACKING_COLUMNS, SERVICE_COLUMNS, StorageBackend
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    username TEXT NOT NULL DEFAULT '',
+    joined_date TEXT NOT NULL DEFAULT '',
+    {', '.join(f'{column} INTEGER NOT NULL DEFAULT 0' for column in SERVICE_COLUMNS)},
+    version INTEGER NOT NULL DEFAULT 1,
+    mirrored_version INTEGER NOT NULL DEFAULT 0
+);
+{''.join(
+    f'CREATE INDEX IF NOT EXISTS users_{column} ON users(user_id) WHERE {column} = 1;'
+    for column in SERVICE_COLUMNS
+)}
+CREATE INDEX IF NOT EXISTS users_unmirrored ON users(user_id) WHERE version > mirrored_version;
+
+CREATE TABLE IF NOT EXISTS quran_tracking (
+    user_id TEXT PRIMARY KEY,
+    username TEXT NOT NULL DEFAULT '',
+    total_pages_read INTEGER NOT NULL DEFAULT 0,
+    current_position INTEGER NOT NULL DEFAULT 0,
+    last_batch_confirmed TEXT NOT NULL DEFAULT 'True',
+    pending_pages TEXT NOT NULL DEFAULT '',
+    last_reminder_message_id INTEGER,
+    last_wird_reminder_message_id INTEGER,
+    version INTEGER NOT NULL DEFAULT 1,
+    mirrored_version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS quran_tracking_unmirrored ON quran_tracking(user_id) WHERE version > mirrored_version;
+
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+# Columns added after the first release, created on open in databases that lack them
+ADDED_USER_COLUMNS = {
+    'unreachable_reason': 'TEXT',
+    'unreachable_since': 'TEXT',
+    'last_probe': 'TEXT',
+}
+
+# Indexes on added columns, created once the columns exist
+ADDED_INDEXES = """
+CREATE INDEX IF NOT EXISTS users_unreachable ON users(user_id) WHERE unreachable_reason IS NOT NULL;
+"""
+
+
+def _to_int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class SQLiteStorage(StorageBackend):
+    def __init__(self, db_file):
+        """
+        Local SQLite store of users and Quran tracking
+
+        This is the primary copy of all bot state, every read and write is a
+        local indexed lookup. The database runs in WAL mode so the registry's
+        flusher thread and the event loop never block each other for long.
+
+        Every row carries a version that is bumped on each write and the
+        version last exported to Google Sheets, so the Sheets mirror only
+        picks up rows that changed since its previous run.
+
+        Args:
+            db_file (str): Path of the SQLite database, created if missing
+        """
+        self.db_file = db_file
+        self._conn = None
+        # One connection shared by the event loop and the flusher thread
+        self._lock = threading.Lock()
+
+    def open(self):
+        """Open the database and create the tables if needed"""
+        with self._lock:
+            if self._conn is not None:
+                return
+            conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL with synchronous=NORMAL only risks the last commits on power loss
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            existing = {row['name'] for row in conn.execute("PRAGMA table_info(users)")}
+            for column, column_type in ADDED_USER_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE users ADD COLUMN {column} {column_type}")
+            conn.executescript(ADDED_INDEXES)
+            self._conn = conn
+        logger.info(f"Opened SQLite storage {self.db_file}")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def is_empty(self):
+        """
+        Returns:
+            bool: True if neither users nor Quran tracking were ever stored
+        """
+        with self._lock:
+            users = self._conn.execute("SELECT 1 FROM users LIMIT 1").fetchone()
+            tracking = self._conn.execute("SELECT 1 FROM quran_tracking LIMIT 1").fetchone()
+            return users is None and tracking is None
+
+    # ---- users ----
+
+    def _unreachable_from_columns(self, reason, since, probed):
+        if reason is None:
+            return None
+        return {"reason": reason, "since": since, "probed": probed}
+
+    def _user_from_row(self, row):
+        return {
+            "username": row['username'],
+            "joined_date": row['joined_date'],
+            "services": {column: bool(row[column]) for column in SERVICE_COLUMNS},
+            "unreachable": self._unreachable_from_columns(
+                row['unreachable_reason'], row['unreachable_since'], row['last_probe']
+            )
+        }
+
+    def _user_params(self, user_id, user_info):
+        services = user_info.get('services', {})
+        unreachable = user_info.get('unreachable') or {}
+        return (
+            str(user_id),
+            user_info.get('username', ''),
+            user_info.get('joined_date', ''),
+            *(int(bool(services.get(column, False))) for column in SERVICE_COLUMNS),
+            unreachable.get('reason'),
+            unreachable.get('since'),
+            unreachable.get('probed')
+        )
+
+    def load_users(self):
+        """
+        Load all users in the user registry's format
+
+        Returns:
+            dict: user_id -> {"username", "joined_date", "services", "unreachable"}, or None on error
+        """
+        try:
+            with self._lock:
+                # Plain tuples, building a sqlite3.Row per user dominates the load time
+                cursor = self._conn.cursor()
+                cursor.row_factory = None
+                rows = cursor.execute(
+                    f"SELECT user_id, username, joined_date, unreachable_reason, unreachable_since, last_probe, "
+                    f"{', '.join(SERVICE_COLUMNS)} FROM users"
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error loading users from SQLite: {e}")
+            return None
+
+        # Only a handful of flag combinations exist, copying a prepared dict beats building one per user
+        services_by_flags = {}
+
+        def services(flags):
+            prepared = services_by_flags.get(flags)
+            if prepared is None:
+                prepared = services_by_flags[flags] = dict(zip(SERVICE_COLUMNS, map(bool, flags)))
+            return prepared.copy()
+
+        return {
+            row[0]: {
+                "username": row[1],
+                "joined_date": row[2],
+                "services": services(row[6:]),
+                "unreachable": None if row[3] is None else self._unreachable_from_columns(*row[3:6])
+            }
+            for row in rows
+        }
+
+    def save_users(self, changed_users, mirrored=False):
+        """
+        Insert or update users in a single transaction
+
+        Args:
+            changed_users (dict): user_id -> user data in the registry's format
+            mirrored (bool): True if the rows already match Google Sheets,
+                e.g. when importing from it
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not changed_users:
+            return True
+
+        columns = ('user_id', 'username', 'joined_date') + SERVICE_COLUMNS + tuple(ADDED_USER_COLUMNS)
+        updates = ', '.join(f'{column} = excluded.{column}' for column in columns[1:])
+        sql = (
+            f"INSERT INTO users ({', '.join(columns)}, mirrored_version) "
+            f"VALUES ({', '.join('?' for _ in columns)}, ?) "
+            f"ON CONFLICT(user_id) DO UPDATE SET {updates}, version = users.version + 1, "
+            f"mirrored_version = CASE WHEN excluded.mirrored_version > 0 "
+            f"THEN users.version + 1 ELSE users.mirrored_version END"
+        )
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany(sql, [
+                    self._user_params(user_id, user_info) + (int(mirrored),)
+                    for user_id, user_info in changed_users.items()
+                ])
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error saving users to SQLite: {e}")
+            return False
+
+    def subscribers(self, service):
+        """
+        Args:
+            service (str): Service column, e.g. quran_service
+
+        Returns:
+            list: IDs of users subscribed to the service
+        """
+        if service not in SERVICE_COLUMNS:
+            return []
+        with self._lock:
+            rows = self._conn.execute(f"SELECT user_id FROM users WHERE {service} = 1").fetchall()
+        return [row['user_id'] for row in rows]
+
+    # ---- stats ----
+
+    def load_stats(self):
+        try:
+            with self._lock:
+                row = self._conn.execute("SELECT value FROM stats WHERE name = 'users'").fetchone()
+            return json.loads(row['value']) if row is not None else None
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Error loading stats from SQLite: {e}")
+            return None
+
+    def save_stats(self, stats):
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT INTO stats (name, value) VALUES ('users', ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                    (json.dumps(stats),)
+                )
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error saving stats to SQLite: {e}")
+            return False
+
+    # ---- quran tracking ----
+
+    def _tracking_from_row(self, row):
+        tracking = {column: row[column] for column in QURAN_TRACKING_COLUMNS}
+        for column in ('last_reminder_message_id', 'last_wird_reminder_message_id'):
+            if tracking[column] is None:
+                tracking[column] = ''
+        return tracking
+
+    def _tracking_params(self, tracking_data):
+        return (
+            str(tracking_data['user_id']),
+            str(tracking_data.get('username') or ''),
+            _to_int(tracking_data.get('total_pages_read')),
+            _to_int(tracking_data.get('current_position')),
+            str(tracking_data.get('last_batch_confirmed') or 'True'),
+            str(tracking_data.get('pending_pages') or ''),
+            _to_int(tracking_data.get('last_reminder_message_id'), None),
+            _to_int(tracking_data.get('last_wird_reminder_message_id'), None)
+        )
+
+    def get_quran_tracking(self, user_id):
+        """
+        Get Quran tracking data for a user
+
+        Args:
+            user_id (str): Telegram user ID
+
+        Returns:
+            dict: Tracking row keyed like the quran_tracking worksheet, or None if not found
+        """
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT * FROM quran_tracking WHERE user_id = ?", (str(user_id),)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Error getting Quran tracking from SQLite: {e}")
+            return None
+        return self._tracking_from_row(row) if row else None
+
+    def get_all_quran_tracking(self):
+        """
+        Returns:
+            dict: user_id -> tracking row for every user, or None on error
+        """
+        try:
+            with self._lock:
+                rows = self._conn.execute("SELECT * FROM quran_tracking").fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error getting all Quran tracking from SQLite: {e}")
+            return None
+        return {row['user_id']: self._tracking_from_row(row) for row in rows}
+
+    def batch_update_quran_tracking(self, tracking_rows, mirrored=False):
+        """
+        Insert or update many users' Quran tracking in a single transaction
+
+        Args:
+            tracking_rows (list): Tracking rows, each must include user_id
+            mirrored (bool): True if the rows already match Google Sheets
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not tracking_rows:
+            return True
+
+        updates = ', '.join(f'{column} = excluded.{column}' for column in QURAN_TRACKING_COLUMNS[1:])
+        sql = (
+            f"INSERT INTO quran_tracking ({', '.join(QURAN_TRACKING_COLUMNS)}, mirrored_version) "
+            f"VALUES ({', '.join('?' for _ in QURAN_TRACKING_COLUMNS)}, ?) "
+            f"ON CONFLICT(user_id) DO UPDATE SET {updates}, version = quran_tracking.version + 1, "
+            f"mirrored_version = CASE WHEN excluded.mirrored_version > 0 "
+            f"THEN quran_tracking.version + 1 ELSE quran_tracking.mirrored_version END"
+        )
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany(sql, [
+                    self._tracking_params(row) + (int(mirrored),) for row in tracking_rows
+                ])
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error saving Quran tracking to SQLite: {e}")
+            return False
+
+    # ---- Google Sheets mirror ----
+
+    def unmirrored_users(self):
+        """
+        Users changed since they were last exported
+
+        Returns:
+            tuple: (user_id -> user data, user_id -> version being exported)
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM users WHERE version > mirrored_version").fetchall()
+        users = {row['user_id']: self._user_from_row(row) for row in rows}
+        versions = {row['user_id']: row['version'] for row in rows}
+        return users, versions
+
+    def unmirrored_quran_tracking(self):
+        """
+        Tracking rows changed since they were last exported
+
+        Returns:
+            tuple: (list of tracking rows, user_id -> version being exported)
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM quran_tracking WHERE version > mirrored_version").fetchall()
+        tracking_rows = [self._tracking_from_row(row) for row in rows]
+        versions = {row['user_id']: row['version'] for row in rows}
+        return tracking_rows, versions
+
+    def _mark_mirrored(self, table, versions):
+        # A row written again during the export keeps its newer version and stays pending
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"UPDATE {table} SET mirrored_version = ? WHERE user_id = ? AND mirrored_version < ?",
+                [(version, user_id, version) for user_id, version in versions.items()]
+            )
+
+    def mark_users_mirrored(self, versions):
+        self._mark_mirrored('users', versions)
+
+    def mark_quran_tracking_mirrored(self, versions):
+        self._mark_mirrored('quran_tracking', versions)
@@ -0,0 +1,215 @@
+import copy
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Service flags of a user, named after the service callback data
+SERVICE_COLUMNS = ('quran_service', 'prophet_prayer_service', 'dhikr_service', 'night_prayer_service')
+
+# Columns of a quran_tracking row, same names as the quran_tracking worksheet
+QURAN_TRACKING_COLUMNS = ('user_id', 'username', 'total_pages_read', 'current_position',
+                          'last_batch_confirmed', 'pending_pages',
+                          'last_reminder_message_id', 'last_wird_reminder_message_id')
+
+
+class StorageBackend:
+    """
+    Storage of users, their service subscriptions and their Quran tracking
+
+    Users are exchanged in the user registry's format,
+    ``{"username", "joined_date", "services": {service: bool}, "unreachable"}``
+    keyed by user ID, where ``unreachable`` is None or
+    ``{"reason", "since", "probed"}`` for users deliveries can not reach.
+    Quran tracking is exchanged as rows keyed like the quran_tracking
+    worksheet, see QURAN_TRACKING_COLUMNS.
+
+    All methods are blocking. Backends doing network I/O set ``remote`` so
+    that callers on the event loop run them in a worker thread, on
+    ``executor`` if the backend bounds its concurrency.
+    """
+
+    # True if calls do network I/O and must not run on the event loop
+    remote = False
+    # Thread pool calls from the event loop run on, None for the loop's default executor
+    executor = None
+
+    def open(self):
+        """Connect to the backing store"""
+
+    def close(self):
+        """Release the backing store"""
+
+    def is_empty(self):
+        """
+        Returns:
+            bool: True if neither users nor Quran tracking were ever stored
+        """
+        raise NotImplementedError
+
+    def load_users(self):
+        """
+        Returns:
+            dict: user_id -> user data for all users, or None if the store could not be read
+        """
+        raise NotImplementedError
+
+    def save_users(self, changed_users):
+        """
+        Insert or update users
+
+        Args:
+            changed_users (dict): user_id -> user data
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        raise NotImplementedError
+
+    def subscribers(self, service):
+        """
+        Args:
+            service (str): Service name, e.g. quran_service
+
+        Returns:
+            list: IDs of users subscribed to the service
+        """
+        raise NotImplementedError
+
+    def load_stats(self):
+        """
+        Returns:
+            dict: Last saved snapshot of the user totals, None if the backend keeps none
+        """
+        return None
+
+    def save_stats(self, stats):
+        """
+        Save a snapshot of the user totals, see UserStats
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        return True
+
+    def get_quran_tracking(self, user_id):
+        """
+        Args:
+            user_id (str): Telegram user ID
+
+        Returns:
+            dict: Tracking row, or None if not found
+        """
+        raise NotImplementedError
+
+    def get_all_quran_tracking(self):
+        """
+        Returns:
+            dict: user_id -> tracking row for every user, or None if the store could not be read
+        """
+        raise NotImplementedError
+
+    def batch_update_quran_tracking(self, tracking_rows):
+        """
+        Insert or update many users' Quran tracking at once
+
+        Args:
+            tracking_rows (list): Tracking rows, each must include user_id
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        raise NotImplementedError
+
+    def update_quran_tracking(self, tracking_data):
+        """
+        Insert or update a single user's Quran tracking
+
+        Args:
+            tracking_data (dict): Tracking row, must include user_id
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        return self.batch_update_quran_tracking([tracking_data])
+
+
+class MemoryStorage(StorageBackend):
+    def __init__(self, users=None, quran_tracking=None):
+        """
+        Pure in-memory storage for tests, benchmarks and load simulations
+
+        Nothing survives the process. Values are copied on the way in and out
+        so callers can never mutate the stored state by accident, a lock makes
+        it safe to use from the user registry's flusher thread.
+
+        Args:
+            users (dict): Initial user_id -> user data
+            quran_tracking (dict): Initial user_id -> tracking row
+        """
+        self._users = {}
+        self._service_index = {service: set() for service in SERVICE_COLUMNS}
+        self._quran_tracking = {}
+        self._stats = None
+        self._lock = threading.Lock()
+        if users:
+            self.save_users(users)
+        if quran_tracking:
+            self.batch_update_quran_tracking(list(quran_tracking.values()))
+
+    def is_empty(self):
+        return not self._users and not self._quran_tracking
+
+    def load_users(self):
+        with self._lock:
+            return copy.deepcopy(self._users)
+
+    def save_users(self, changed_users):
+        with self._lock:
+            for user_id, user_info in changed_users.items():
+                self._save_user(str(user_id), user_info)
+        return True
+
+    def _save_user(self, user_id, user_info):
+        services = user_info.get('services', {})
+        self._users[user_id] = {
+            "username": user_info.get('username', ''),
+            "joined_date": user_info.get('joined_date', ''),
+            "services": {service: bool(services.get(service, False)) for service in SERVICE_COLUMNS},
+            "unreachable": copy.deepcopy(user_info.get('unreachable'))
+        }
+        for service, enabled in self._users[user_id]["services"].items():
+            if enabled:
+                self._service_index[service].add(user_id)
+            else:
+                self._service_index[service].discard(user_id)
+
+    def subscribers(self, service):
+        with self._lock:
+            return list(self._service_index.get(service, ()))
+
+    def load_stats(self):
+        with self._lock:
+            return copy.deepcopy(self._stats)
+
+    def save_stats(self, stats):
+        with self._lock:
+            self._stats = copy.deepcopy(stats)
+        return True
+
+    def get_quran_tracking(self, user_id):
+        with self._lock:
+            tracking = self._quran_tracking.get(str(user_id))
+            return dict(tracking) if tracking is not None else None
+
+    def get_all_quran_tracking(self):
+        with self._lock:
+            return {user_id: dict(tracking) for user_id, tracking in self._quran_tracking.items()}
+
+    def batch_update_quran_tracking(self, tracking_rows):
+        with self._lock:
+            for tracking_data in tracking_rows:
+                tracking = {column: tracking_data.get(column, '') for column in QURAN_TRACKING_COLUMNS}
+                tracking['user_id'] = str(tracking_data['user_id'])
+                self._quran_tracking[tracking['user_id']] = tracking
+        return True
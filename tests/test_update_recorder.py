@@ -0,0 +1,32 @@
+from update_recorder import anonymize_update, pseudonymize_id
+
+KEY = b'test-key'
+
+
+def test_users_inside_lists_are_pseudonymized():
+    update = {
+        'update_id': 1,
+        'message': {
+            'message_id': 5,
+            'from': {'id': 111, 'is_bot': False, 'first_name': 'Ahmed', 'username': 'ahmed'},
+            'chat': {'id': -100, 'type': 'group', 'title': 'Family'},
+            'new_chat_members': [
+                {'id': 222, 'is_bot': False, 'first_name': 'Sara', 'last_name': 'Ali', 'username': 'sara'},
+                {'id': 333, 'is_bot': False, 'first_name': 'Omar'},
+            ],
+        },
+    }
+
+    members = anonymize_update(update, KEY)['message']['new_chat_members']
+
+    assert members == [
+        {'id': pseudonymize_id(222, KEY), 'is_bot': False, 'first_name': 'user'},
+        {'id': pseudonymize_id(333, KEY), 'is_bot': False, 'first_name': 'user'},
+    ]
+
+
+def test_entities_lists_are_kept():
+    update = {'update_id': 2, 'message': {'message_id': 6, 'text': '/start',
+                                          'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]}}
+
+    assert anonymize_update(update, KEY)['message']['entities'] == [{'type': 'bot_command', 'offset': 0, 'length': 6}]
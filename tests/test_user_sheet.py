@@ -0,0 +1,56 @@
+from user_sheet import UserSheet
+
+HEADER = ['user_id', 'username', 'joined_date']
+
+
+class FakeWorksheet:
+    def __init__(self, values):
+        self.values = [list(row) for row in values]
+        self.row_count = 1000
+
+    def get_all_values(self, value_render_option=None):
+        return [list(row) for row in self.values]
+
+    def col_values(self, col, value_render_option=None):
+        column = [row[col - 1] if len(row) >= col else '' for row in self.values]
+        while column and column[-1] == '':
+            column.pop()
+        return column
+
+    def add_rows(self, rows):
+        self.row_count += rows
+
+    def batch_update(self, data, raw=True):
+        for update in data:
+            row_number = int(update['range'].split(':')[0][1:])
+            while len(self.values) < row_number:
+                self.values.append([])
+            self.values[row_number - 1] = list(update['values'][0])
+
+
+def test_export_after_restart_keeps_existing_rows():
+    sheet = FakeWorksheet([HEADER, ['1', 'one', '2024-01-01'], ['2', 'two', '2024-01-02']])
+    # A restart with an existing local database never calls load_records()
+    user_sheet = UserSheet(lambda: sheet, HEADER)
+
+    assert user_sheet.upsert_rows({
+        '99': ['99', 'new', '2024-02-01'],
+        '2': ['2', 'two renamed', '2024-01-02'],
+    })
+
+    assert sheet.values == [
+        HEADER,
+        ['1', 'one', '2024-01-01'],
+        ['2', 'two renamed', '2024-01-02'],
+        ['99', 'new', '2024-02-01'],
+    ]
+
+
+def test_first_export_to_empty_sheet_writes_header():
+    sheet = FakeWorksheet([])
+    user_sheet = UserSheet(lambda: sheet, HEADER)
+
+    assert user_sheet.upsert_rows({'1': ['1', 'one', '2024-01-01']})
+    assert user_sheet.upsert_rows({'2': ['2', 'two', '2024-01-02']})
+
+    assert sheet.values == [HEADER, ['1', 'one', '2024-01-01'], ['2', 'two', '2024-01-02']]
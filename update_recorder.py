@@ -0,0 +1,106 @@
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import time
+
+logger = logging.getLogger(__name__)
+
+# Objects, or lists of objects, describing a user or chat, their ids are replaced and personal fields dropped
+PERSON_KEYS = {'from', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat', 'via_bot',
+               'new_chat_members', 'left_chat_member', 'voter_chat', 'actor_chat', 'users'}
+PERSONAL_FIELDS = {'first_name', 'last_name', 'username', 'title', 'bio', 'description', 'photo',
+                   'active_usernames', 'emoji_status_custom_emoji_id'}
+# Free text and attachments the bot never needs to replay an update
+DROPPED_FIELDS = {'contact', 'location', 'venue', 'caption', 'caption_entities', 'document', 'voice',
+                  'audio', 'video', 'video_note', 'sticker', 'animation'}
+
+
+def pseudonymize_id(value, key):
+    """
+    Replace a Telegram user or chat ID by a stable pseudonym
+
+    The same ID always maps to the same pseudonym for a given key, so the
+    updates of one user stay connected in a recording. Negative (group) IDs
+    stay negative.
+    """
+    digest = hmac.new(key, str(abs(int(value))).encode(), hashlib.sha256).hexdigest()
+    pseudonym = 1_000_000_000 + int(digest[:12], 16) % 9_000_000_000
+    return -pseudonym if int(value) < 0 else pseudonym
+
+
+def anonymize_update(data, key):
+    """
+    Returns:
+        dict: Copy of an Update dict without names, usernames, free text or attachments
+    """
+    def walk(value, parent_key=None):
+        if isinstance(value, list):
+            # Items of a list are what its key describes, e.g. the users of new_chat_members
+            return [walk(item, parent_key) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        result = {}
+        for name, item in value.items():
+            if name in DROPPED_FIELDS:
+                continue
+            if parent_key in PERSON_KEYS:
+                if name in PERSONAL_FIELDS:
+                    continue
+                if name == 'id':
+                    item = pseudonymize_id(item, key)
+            if name == 'text' and isinstance(item, str):
+                # Commands are kept, anything users typed is not
+                item = item.split()[0] if item.startswith('/') else '<redacted>'
+            result[name] = walk(item, name)
+
+        if parent_key in PERSON_KEYS and 'type' not in result:
+            result.setdefault('first_name', 'user')
+        return result
+
+    return walk(data)
+
+
+class UpdateRecorder:
+    def __init__(self, path, key=None):
+        """
+        Appends every incoming update, anonymized, to a JSONL file
+
+        Each line holds ``{"offset": <seconds since recording started>,
+        "update": <Update dict>}``, which is what benchmarks/replay_updates.py
+        replays. Register ``record`` as a TypeHandler in a group before all
+        other handlers.
+
+        Args:
+            path (str): JSONL file, appended to
+            key (bytes): Pseudonymization key, random for every recording if not given
+        """
+        self.path = path
+        self.key = key or secrets.token_bytes(32)
+        self._file = None
+        self._started = None
+        self.recorded = 0
+
+    async def record(self, update, context):
+        try:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+                self._started = time.monotonic()
+            line = {
+                "offset": round(time.monotonic() - self._started, 3),
+                "update": anonymize_update(update.to_dict(), self.key),
+            }
+            self._file.write(json.dumps(line, ensure_ascii=False) + '\n')
+            self._file.flush()
+            self.recorded += 1
+        except Exception as e:
+            # Recording must never get in the way of handling the update
+            logger.error(f"Error recording update {update.update_id}: {e}")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info(f"Recorded {self.recorded} updates to {self.path}")
@@ -0,0 +1,430 @@
+import bisect
+import copy
+import logging
+import threading
+from datetime import datetime
+
+from user_stats import UserStats
+
+logger = logging.getLogger(__name__)
+
+# Same format as the joined_date of users
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class UserRegistry:
+    def __init__(self, loader, writer, flush_interval=30, stats=None):
+        """
+        In-process registry of bot users with write-behind persistence
+
+        The registry is loaded once at startup and stays authoritative for the
+        lifetime of the process. Mutations only touch memory and mark the
+        changed users dirty; a background flusher coalesces them and hands only
+        the changed users to ``writer`` at most once every ``flush_interval``
+        seconds.
+
+        Args:
+            loader (callable): Returns the stored users as a dict keyed by user ID,
+                or None if the backing store could not be read
+            writer (callable): Persists a dict of changed users, returns True on success
+            flush_interval (float): Seconds between two write-behind flushes
+            stats (UserStats): Running totals updated with every mutation and
+                flushed together with the users, unpersisted if not given
+        """
+        self._loader = loader
+        self._writer = writer
+        self.flush_interval = flush_interval
+        self.stats = stats if stats is not None else UserStats()
+
+        self._users = {}
+        # service -> IDs of subscribed users, kept in sync with every mutation
+        self._service_index = {}
+        # IDs of users deliveries can not reach, left out of every audience
+        self._unreachable = set()
+        # (joined_date, user_id) of every user in order, built on first use for paging
+        self._order = None
+        self._dirty = set()
+        self._loaded = False
+
+        # Guards the in-memory state, the flush lock serializes writers
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def load(self):
+        """
+        Load all users from the backing store into memory
+
+        Returns:
+            bool: True if the users were loaded, False otherwise
+        """
+        users = self._loader()
+        if users is None:
+            logger.error("Could not load users, registry stays empty until the next attempt")
+            return False
+
+        with self._lock:
+            # Keep anything registered while the store was unreachable
+            users.update(self._users)
+            self._users = users
+            self._rebuild_service_index()
+            self._order = None
+            self.stats.rebuild(self._users, self._service_index, self._unreachable)
+            self._loaded = True
+
+        logger.info(f"User registry loaded with {len(users)} users")
+        return True
+
+    def start(self):
+        """Start the background write-behind flusher"""
+        if self._thread is not None:
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="user-registry-flusher", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the flusher and force a final flush of pending changes"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.flush():
+            self.stats.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+
+            if not self._loaded:
+                self.load()
+            # Totals are only persisted once the users they count are
+            if self.flush():
+                self.stats.flush()
+
+    def flush(self):
+        """
+        Persist pending changes if there are any
+
+        Returns:
+            bool: True if nothing was pending or the write succeeded
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return True
+                if not self._loaded:
+                    # Never overwrite the store with a partial view of it
+                    logger.warning("Skipping user flush, registry was never loaded")
+                    return False
+                changed = {
+                    user_id: copy.deepcopy(self._users[user_id])
+                    for user_id in self._dirty if user_id in self._users
+                }
+                self._dirty = set()
+
+            try:
+                saved = self._writer(changed)
+            except Exception as e:
+                logger.error(f"Error flushing user registry: {e}")
+                saved = False
+
+            if not saved:
+                with self._lock:
+                    self._dirty.update(changed)
+            return saved
+
+    def _rebuild_service_index(self):
+        self._service_index = {}
+        self._unreachable = set()
+        for user_id, data in self._users.items():
+            if data.get("unreachable"):
+                self._unreachable.add(user_id)
+            for service, enabled in data.get("services", {}).items():
+                if enabled:
+                    self._service_index.setdefault(service, set()).add(user_id)
+
+    def _index_service(self, user_id, service, enabled):
+        subscribers = self._service_index.setdefault(service, set())
+        if enabled:
+            subscribers.add(user_id)
+        else:
+            subscribers.discard(user_id)
+
+    def _mark_dirty(self, user_id):
+        self._dirty.add(user_id)
+
+    def __contains__(self, user_id):
+        return str(user_id) in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def get(self, user_id):
+        """
+        Get a copy of a user's data
+
+        Args:
+            user_id (str): Telegram user ID
+
+        Returns:
+            dict: User data or None if not found
+        """
+        with self._lock:
+            user = self._users.get(str(user_id))
+            return copy.deepcopy(user) if user is not None else None
+
+    def user_ids(self):
+        """
+        Returns:
+            list: IDs of all registered users
+        """
+        with self._lock:
+            return list(self._users.keys())
+
+    def subscribers(self, service):
+        """
+        Args:
+            service (str): Service callback name, e.g. quran_service
+
+        Returns:
+            list: IDs of users subscribed to the service
+        """
+        with self._lock:
+            return list(self._service_index.get(service, ()))
+
+    def reachable_user_ids(self):
+        """
+        Returns:
+            list: IDs of all registered users deliveries can still reach
+        """
+        with self._lock:
+            return [user_id for user_id in self._users if user_id not in self._unreachable]
+
+    def reachable_subscribers(self, service):
+        """
+        Args:
+            service (str): Service callback name, e.g. quran_service
+
+        Returns:
+            list: IDs of subscribed users deliveries can still reach
+        """
+        with self._lock:
+            return list(self._service_index.get(service, set()) - self._unreachable)
+
+    def _order_key(self, user_id):
+        return (self._users[user_id].get("joined_date") or "", user_id)
+
+    def page(self, after=None, before=None, limit=20):
+        """
+        One page of users in joining order, addressed by a cursor instead of an offset
+
+        Args:
+            after (str): Return the users following this user ID
+            before (str): Return the users preceding this user ID
+            limit (int): Maximum number of users on the page
+
+        Returns:
+            tuple: (position of the first user, [(user_id, user data copy)], total users)
+        """
+        with self._lock:
+            if self._order is None:
+                self._order = sorted(self._order_key(user_id) for user_id in self._users)
+            order = self._order
+            if before is not None and str(before) in self._users:
+                start = max(0, bisect.bisect_left(order, self._order_key(str(before))) - limit)
+            elif after is not None and str(after) in self._users:
+                start = bisect.bisect_right(order, self._order_key(str(after)))
+            else:
+                start = 0
+            users = [(user_id, copy.deepcopy(self._users[user_id])) for _, user_id in order[start:start + limit]]
+            return start, users, len(order)
+
+    def iter_users(self, chunk_size=1000):
+        """
+        Walk all users in joining order, one page at a time
+
+        The lock is only held while a page is copied, so registrations go on
+        while a long export runs.
+
+        Yields:
+            tuple: (user_id, user data copy)
+        """
+        after = None
+        while True:
+            _, users, _ = self.page(after=after, limit=chunk_size)
+            if not users:
+                return
+            yield from users
+            after = users[-1][0]
+
+    def items(self):
+        """
+        Returns:
+            list: (user_id, user data copy) pairs for all registered users
+        """
+        with self._lock:
+            return [(user_id, copy.deepcopy(data)) for user_id, data in self._users.items()]
+
+    def add_user(self, user_id, user_info):
+        """
+        Register a new user, does nothing if the user already exists
+
+        Args:
+            user_id (str): Telegram user ID
+            user_info (dict): Initial user data
+
+        Returns:
+            bool: True if the user was added
+        """
+        user_id = str(user_id)
+        with self._lock:
+            if user_id in self._users:
+                return False
+            self._users[user_id] = copy.deepcopy(user_info)
+            for service, enabled in user_info.get("services", {}).items():
+                self._index_service(user_id, service, enabled)
+            if user_info.get("unreachable"):
+                self._unreachable.add(user_id)
+            if self._order is not None:
+                bisect.insort(self._order, self._order_key(user_id))
+            self.stats.user_added(user_info)
+            self._mark_dirty(user_id)
+            return True
+
+    def set_username(self, user_id, username):
+        """
+        Update a user's username if it changed
+
+        Returns:
+            bool: True if the username was changed
+        """
+        user_id = str(user_id)
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None or user.get("username") == username:
+                return False
+            user["username"] = username
+            self._mark_dirty(user_id)
+            return True
+
+    def set_services(self, user_id, services):
+        """
+        Replace a user's service subscription flags at once
+
+        Args:
+            user_id (str): Telegram user ID
+            services (dict): Service name -> subscribed flag
+
+        Returns:
+            bool: True if any flag changed, None if the user is unknown
+        """
+        user_id = str(user_id)
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return None
+            current = user.setdefault("services", {})
+            changed = False
+            for service, enabled in services.items():
+                enabled = bool(enabled)
+                if current.get(service, False) != enabled:
+                    current[service] = enabled
+                    self._index_service(user_id, service, enabled)
+                    self.stats.service_changed(service, enabled)
+                    changed = True
+            if changed:
+                self._mark_dirty(user_id)
+            return changed
+
+    def mark_unreachable(self, user_id, reason):
+        """
+        Record that deliveries to a user fail for good, e.g. because they blocked the bot
+
+        Args:
+            user_id (str): Telegram user ID
+            reason (str): Why, e.g. blocked, deactivated or chat_not_found
+
+        Returns:
+            bool: True if the user was reachable until now
+        """
+        user_id = str(user_id)
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return False
+            now = datetime.now().strftime(TIME_FORMAT)
+            unreachable = user.get("unreachable")
+            if unreachable:
+                # A failed re-probe, the user stays excluded until the next one
+                self.stats.reachability_changed(unreachable.get("reason"), reason)
+                unreachable["reason"] = reason
+                unreachable["probed"] = now
+                self._mark_dirty(user_id)
+                return False
+            user["unreachable"] = {"reason": reason, "since": now, "probed": now}
+            self._unreachable.add(user_id)
+            self.stats.reachability_changed(None, reason)
+            self._mark_dirty(user_id)
+            return True
+
+    def mark_reachable(self, user_id):
+        """
+        Return a user to the audiences, e.g. after they wrote to the bot again
+
+        Returns:
+            bool: True if the user was unreachable until now
+        """
+        user_id = str(user_id)
+        with self._lock:
+            if user_id not in self._unreachable:
+                return False
+            self._unreachable.discard(user_id)
+            user = self._users.get(user_id)
+            if user is not None:
+                self.stats.reachability_changed((user.get("unreachable") or {}).get("reason") or "unknown", None)
+                user["unreachable"] = None
+                self._mark_dirty(user_id)
+            return True
+
+    def is_reachable(self, user_id):
+        return str(user_id) not in self._unreachable
+
+    def unreachable_counts(self):
+        """
+        Returns:
+            dict: reason -> number of unreachable users
+        """
+        return self.stats.unreachable_counts()
+
+    def due_for_probe(self, min_age, limit):
+        """
+        Unreachable users whose last probe is old enough to try them again
+
+        Args:
+            min_age (timedelta): Time since the last probe
+            limit (int): Maximum number of users returned, the longest waiting first
+
+        Returns:
+            list: User IDs
+        """
+        cutoff = (datetime.now() - min_age).strftime(TIME_FORMAT)
+        with self._lock:
+            due = [
+                (self._users[user_id]["unreachable"].get("probed") or "", user_id)
+                for user_id in self._unreachable
+            ]
+        due = sorted(entry for entry in due if entry[0] <= cutoff)
+        return [user_id for _, user_id in due[:limit]]
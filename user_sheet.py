@@ -0,0 +1,134 @@
+import logging
+import threading
+from gspread.utils import ValueRenderOption, rowcol_to_a1
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_user_id(user_id):
+    """Unformatted reads return numbers, users are always keyed by strings"""
+    if isinstance(user_id, float) and user_id.is_integer():
+        user_id = int(user_id)
+    return str(user_id)
+
+
+class UserSheet:
+    def __init__(self, open_worksheet, header):
+        """
+        Row-level access to the user_data worksheet
+
+        Keeps a user_id -> row number index so that changed users can be
+        written in place. The index is rebuilt by every full load, and read
+        from the user_id column before the first write if nothing was loaded. All writes of a flush go
+        out as a single values.batchUpdate call and are serialized by a lock,
+        the sheet is never cleared.
+
+        Args:
+            open_worksheet (callable): Returns the gspread worksheet or None
+            header (list): Column names, the first one must be user_id
+        """
+        self._open_worksheet = open_worksheet
+        self.header = header
+        self._last_column = rowcol_to_a1(1, len(header)).rstrip('1')
+
+        self._row_index = {}
+        self._next_row = 2
+        self._has_header = False
+        self._indexed = False
+        self._lock = threading.Lock()
+
+    def load_records(self):
+        """
+        Read the whole worksheet and rebuild the row index
+
+        Returns:
+            list: One dict per user row keyed by header name, or None if the
+                worksheet could not be read
+        """
+        with self._lock:
+            sheet = self._open_worksheet()
+            if not sheet:
+                return None
+
+            values = sheet.get_all_values(value_render_option=ValueRenderOption.unformatted)
+            self._build_index([row[0] if row else '' for row in values])
+            if not self._has_header:
+                return []
+
+            headers = values[0]
+            return [
+                {header: row[i] if i < len(row) else '' for i, header in enumerate(headers)}
+                for row in values[1:]
+                if row and row[0] not in ('', None)
+            ]
+
+    def _build_index(self, user_ids):
+        """
+        Rebuild the row index from the user_id column, header included
+
+        Args:
+            user_ids (list): Value of the first column of every row, in sheet order
+        """
+        self._row_index = {}
+        self._has_header = bool(user_ids) and user_ids[0] not in ('', None)
+        self._next_row = max(len(user_ids), 1) + 1
+        if self._has_header:
+            for row_number, user_id in enumerate(user_ids[1:], start=2):
+                if user_id not in ('', None):
+                    self._row_index[normalize_user_id(user_id)] = row_number
+        self._indexed = True
+
+    def upsert_rows(self, rows):
+        """
+        Write changed user rows in place and append new ones
+
+        Args:
+            rows (dict): user_id -> list of values in header order
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not rows:
+            return True
+
+        with self._lock:
+            sheet = self._open_worksheet()
+            if not sheet:
+                return False
+
+            # Without a load since startup the index is empty, writing from
+            # row 2 would overwrite the users already in the sheet
+            if not self._indexed:
+                self._build_index(sheet.col_values(1, value_render_option=ValueRenderOption.unformatted))
+
+            data = []
+            if not self._has_header:
+                data.append({'range': f'A1:{self._last_column}1', 'values': [self.header]})
+
+            next_row = self._next_row
+            new_rows = {}
+            for user_id, row in rows.items():
+                user_id = normalize_user_id(user_id)
+                row_number = self._row_index.get(user_id)
+                if row_number is None:
+                    row_number = next_row
+                    next_row += 1
+                    new_rows[user_id] = row_number
+                data.append({
+                    'range': f'A{row_number}:{self._last_column}{row_number}',
+                    'values': [row]
+                })
+
+            # values.batchUpdate cannot write past the grid, grow it first
+            if next_row - 1 > sheet.row_count:
+                sheet.add_rows(next_row - 1 - sheet.row_count)
+
+            sheet.batch_update(data, raw=True)
+
+            # Only commit the index once the write went through
+            self._row_index.update(new_rows)
+            self._next_row = next_row
+            self._has_header = True
+
+            logger.info(f"Upserted {len(rows)} user rows ({len(new_rows)} new) to Google Sheets")
+            return True
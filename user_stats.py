@@ -0,0 +1,217 @@
+import collections
+import copy
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class UserStats:
+    def __init__(self, loader=None, writer=None):
+        """
+        Running totals over the registered users, kept up to date as they change
+
+        The user registry reports every registration, service toggle and
+        reachability change, so admin commands and /metrics read the totals
+        without touching the users. A snapshot is persisted with the users and
+        served at startup until the registry has loaded and recounted them.
+
+        Args:
+            loader (callable): Returns the persisted snapshot, or None if there is none
+            writer (callable): Persists a snapshot, returns True on success
+        """
+        self._loader = loader
+        self._writer = writer
+        self._lock = threading.Lock()
+        self._dirty = False
+        # Set once the totals were counted from the users themselves
+        self._recounted = False
+        self._reset()
+
+    def _reset(self):
+        self.total = 0
+        self.services = {}
+        # reason -> users deliveries can not reach, everyone else is active
+        self.unreachable = {}
+        # joined date (YYYY-MM-DD) -> users who joined that day
+        self.joins = {}
+
+    @property
+    def active(self):
+        return self.total - sum(self.unreachable.values())
+
+    @staticmethod
+    def _increment(counts, key, delta):
+        counts[key] = counts.get(key, 0) + delta
+        if counts[key] <= 0:
+            del counts[key]
+
+    def _count_user(self, user_info, delta):
+        self.total += delta
+        for service, enabled in user_info.get("services", {}).items():
+            if enabled:
+                self._increment(self.services, service, delta)
+        unreachable = user_info.get("unreachable")
+        if unreachable:
+            self._increment(self.unreachable, unreachable.get("reason") or "unknown", delta)
+        joined_date = (user_info.get("joined_date") or "")[:10]
+        if joined_date:
+            self._increment(self.joins, joined_date, delta)
+
+    def rebuild(self, users, service_index=None, unreachable_ids=None):
+        """
+        Recount everything from the full set of users, e.g. once they are loaded
+
+        Args:
+            users (dict): user_id -> user data in the registry's format
+            service_index (dict): Optional service -> IDs of subscribed users,
+                saves a pass over every user's flags when the caller has one
+            unreachable_ids (set): IDs of the unreachable users, required with service_index
+        """
+        if service_index is None:
+            service_index = {}
+            unreachable_ids = set()
+            for user_id, user_info in users.items():
+                for service, enabled in user_info.get("services", {}).items():
+                    if enabled:
+                        service_index.setdefault(service, set()).add(user_id)
+                if user_info.get("unreachable"):
+                    unreachable_ids.add(user_id)
+
+        services = {service: len(user_ids) for service, user_ids in service_index.items() if user_ids}
+        unreachable = collections.Counter(
+            users[user_id]["unreachable"].get("reason") or "unknown" for user_id in unreachable_ids
+        )
+        joins = collections.Counter((user_info.get("joined_date") or "")[:10] for user_info in users.values())
+        joins.pop("", None)
+
+        with self._lock:
+            before = self._snapshot()
+            self.total = len(users)
+            self.services = services
+            self.unreachable = dict(unreachable)
+            self.joins = dict(joins)
+            if before["total"] and before != self._snapshot():
+                logger.warning(f"Persisted user stats were stale ({before['total']} users, "
+                               f"recounted {self.total}), replaced by the recount")
+            self._recounted = True
+            self._dirty = True
+
+    def user_added(self, user_info):
+        with self._lock:
+            self._count_user(user_info, 1)
+            self._dirty = True
+
+    def service_changed(self, service, enabled):
+        with self._lock:
+            self._increment(self.services, service, 1 if enabled else -1)
+            self._dirty = True
+
+    def reachability_changed(self, old_reason, new_reason):
+        """
+        Args:
+            old_reason (str): Previous unreachable reason, None if the user was reachable
+            new_reason (str): New unreachable reason, None if the user is reachable again
+        """
+        if old_reason == new_reason:
+            return
+        with self._lock:
+            if old_reason is not None:
+                self._increment(self.unreachable, old_reason, -1)
+            if new_reason is not None:
+                self._increment(self.unreachable, new_reason, 1)
+            self._dirty = True
+
+    def _snapshot(self):
+        return {
+            "total": self.total,
+            "services": dict(self.services),
+            "unreachable": dict(self.unreachable),
+            "joins": dict(self.joins),
+        }
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Copy of all totals, ``{"total", "services", "unreachable", "joins"}``
+        """
+        with self._lock:
+            return self._snapshot()
+
+    def service_counts(self):
+        """
+        Returns:
+            dict: service -> subscribed users
+        """
+        with self._lock:
+            return dict(self.services)
+
+    def unreachable_counts(self):
+        """
+        Returns:
+            dict: reason -> users deliveries can not reach
+        """
+        with self._lock:
+            return dict(self.unreachable)
+
+    def joined_since(self, day):
+        """
+        Args:
+            day (str): First day counted, YYYY-MM-DD
+
+        Returns:
+            int: Users who joined on that day or later
+        """
+        with self._lock:
+            return sum(count for joined, count in self.joins.items() if joined >= day)
+
+    def load(self):
+        """
+        Serve the persisted snapshot until the registry recounts
+
+        Returns:
+            bool: True if a snapshot was found
+        """
+        if self._loader is None:
+            return False
+        try:
+            snapshot = self._loader()
+        except Exception as e:
+            logger.error(f"Error loading user stats: {e}")
+            return False
+        if not snapshot:
+            return False
+        with self._lock:
+            # The registry may have recounted already, that is always more accurate
+            if self._recounted:
+                return False
+            self.total = int(snapshot.get("total", 0))
+            self.services = copy.deepcopy(snapshot.get("services", {}))
+            self.unreachable = copy.deepcopy(snapshot.get("unreachable", {}))
+            self.joins = copy.deepcopy(snapshot.get("joins", {}))
+        logger.info(f"User stats loaded with {self.total} users")
+        return True
+
+    def flush(self):
+        """
+        Persist the totals if they changed
+
+        Returns:
+            bool: True if nothing changed or the write succeeded
+        """
+        if self._writer is None:
+            return True
+        with self._lock:
+            if not self._dirty:
+                return True
+            snapshot = self._snapshot()
+            self._dirty = False
+        try:
+            saved = self._writer(snapshot)
+        except Exception as e:
+            logger.error(f"Error saving user stats: {e}")
+            saved = False
+        if not saved:
+            with self._lock:
+                self._dirty = True
+        return saved